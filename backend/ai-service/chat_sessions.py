@@ -0,0 +1,138 @@
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.logger import setup_logger
+
+logger = setup_logger("chat-sessions")
+
+CHAT_SESSION_PATH = os.getenv(
+    "CHAT_SESSION_PATH", os.path.join(tempfile.gettempdir(), "rarematch_chat_sessions.sqlite3")
+)
+CHAT_SESSION_TTL_SECONDS = int(os.getenv("CHAT_SESSION_TTL_SECONDS", str(6 * 3600)))
+CHAT_MAX_SESSIONS = int(os.getenv("CHAT_MAX_SESSIONS", "10000"))
+# Upstream prompt budget for past turns (approximate tokens).
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "2000"))
+# Turns kept in storage; older ones can never fit the budget again anyway.
+CHAT_MAX_STORED_TURNS = int(os.getenv("CHAT_MAX_STORED_TURNS", "100"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token); no tokenizer round trip."""
+    return len(text) // 4 + 1
+
+
+def turn_text(turn: dict) -> str:
+    parts = turn.get("parts", [])
+    if isinstance(parts, str):
+        return parts
+    return " ".join(str(p) for p in parts)
+
+
+def trim_history(history: List[dict], budget: int = CHAT_HISTORY_TOKEN_BUDGET) -> List[dict]:
+    """
+    Most recent turns that fit the token budget. Turns are dropped oldest
+    first and the kept window always starts on a user turn, as Gemini
+    expects alternating user/model history.
+    """
+    kept = 0
+    used = 0
+    for turn in reversed(history):
+        used += estimate_tokens(turn_text(turn))
+        if used > budget:
+            break
+        kept += 1
+    window = history[len(history) - kept:]
+    while window and window[0].get("role") != "user":
+        window = window[1:]
+    return window
+
+
+class ChatSessionStore:
+    """
+    Server-side chat histories in a local SQLite file shared by all worker
+    processes on the host. Each session belongs to the user who started it;
+    load, save and delete only match sessions of the given user, so a known
+    session id is useless to anyone else. Sessions expire after
+    CHAT_SESSION_TTL_SECONDS of inactivity and the least recently used ones
+    are evicted beyond CHAT_MAX_SESSIONS.
+    """
+
+    def __init__(
+        self,
+        path: str = CHAT_SESSION_PATH,
+        ttl_seconds: int = CHAT_SESSION_TTL_SECONDS,
+        max_sessions: int = CHAT_MAX_SESSIONS,
+    ):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.local = threading.local()
+        with self._connect() as conn:
+            columns = [row[1] for row in conn.execute("pragma table_info(chat_sessions)")]
+            if columns and "user_id" not in columns:
+                # Sessions from before ownership was tracked can't be
+                # attributed to anyone; they are short-lived, so drop them.
+                conn.execute("drop table chat_sessions")
+            conn.execute(
+                "create table if not exists chat_sessions ("
+                "id text primary key, user_id text not null, history text not null, updated_at real not null)"
+            )
+            conn.execute("create index if not exists chat_sessions_updated_idx on chat_sessions (updated_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("pragma journal_mode=wal")
+            self.local.conn = conn
+        return conn
+
+    def new_id(self) -> str:
+        return str(uuid.uuid4())
+
+    def load(self, session_id: str, user_id: str) -> Optional[List[dict]]:
+        try:
+            row = self._connect().execute(
+                "select history from chat_sessions where id = ? and user_id = ? and updated_at > ?",
+                (session_id, user_id, time.time() - self.ttl_seconds),
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to load chat session: {e}")
+            return None
+        return json.loads(row[0]) if row else None
+
+    def save(self, session_id: str, user_id: str, history: List[dict]):
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                # A session owned by someone else is left untouched.
+                conn.execute(
+                    "insert into chat_sessions (id, user_id, history, updated_at) values (?, ?, ?, ?) "
+                    "on conflict (id) do update set history = excluded.history, updated_at = excluded.updated_at "
+                    "where chat_sessions.user_id = excluded.user_id",
+                    (session_id, user_id, json.dumps(history[-CHAT_MAX_STORED_TURNS:]), now),
+                )
+                conn.execute("delete from chat_sessions where updated_at <= ?", (now - self.ttl_seconds,))
+                conn.execute(
+                    "delete from chat_sessions where id in ("
+                    "select id from chat_sessions order by updated_at desc limit -1 offset ?)",
+                    (self.max_sessions,),
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to save chat session: {e}")
+
+    def delete(self, session_id: str, user_id: str):
+        try:
+            with self._connect() as conn:
+                conn.execute("delete from chat_sessions where id = ? and user_id = ?", (session_id, user_id))
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to delete chat session: {e}")
@@ -0,0 +1,282 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import google.generativeai as genai
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.logger import setup_logger
+
+logger = setup_logger("gemini-client")
+
+# "google" calls the Gemini API; "stub" answers locally (offline dev / tests).
+GEMINI_CLIENT = os.getenv("GEMINI_CLIENT", "google").lower()
+DIAGNOSE_CACHE_PATH = os.getenv(
+    "DIAGNOSE_CACHE_PATH", os.path.join(tempfile.gettempdir(), "rarematch_diagnose_cache.sqlite3")
+)
+DIAGNOSE_CACHE_TTL_SECONDS = int(os.getenv("DIAGNOSE_CACHE_TTL_SECONDS", str(24 * 3600)))
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", "16"))
+# How long a request may wait for a free upstream slot before it is rejected.
+CHAT_ADMISSION_TIMEOUT_SECONDS = float(os.getenv("CHAT_ADMISSION_TIMEOUT_SECONDS", "0.1"))
+CHAT_FIRST_TOKEN_TIMEOUT_SECONDS = float(os.getenv("CHAT_FIRST_TOKEN_TIMEOUT_SECONDS", "15"))
+CHAT_DEADLINE_SECONDS = float(os.getenv("CHAT_DEADLINE_SECONDS", "60"))
+
+
+class GeminiClient:
+    """Thin async wrapper around google.generativeai."""
+
+    async def generate(self, model_name: str, prompt: str) -> str:
+        def call():
+            return genai.GenerativeModel(model_name).generate_content(prompt).text
+        return await asyncio.to_thread(call)
+
+    async def stream_chat(self, model_name: str, history: List[dict], message: str) -> AsyncIterator[str]:
+        chat = genai.GenerativeModel(model_name).start_chat(history=history)
+        response = await chat.send_message_async(message, stream=True)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class StubGeminiClient:
+    """
+    Local stand-in for GeminiClient: answers with a canned differential (or
+    an echoing chat stream) after an optional delay and counts calls, so
+    caching, coalescing and streaming can be exercised without network
+    access or an API key.
+    """
+
+    def __init__(self, delay: float = float(os.getenv("GEMINI_STUB_DELAY_SECONDS", "0"))):
+        self.delay = delay
+        self.calls = 0
+
+    async def generate(self, model_name: str, prompt: str) -> str:
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return json.dumps({
+            "model": model_name,
+            "diagnosis": [
+                {
+                    "name": "Stub Syndrome",
+                    "confidence": "Low",
+                    "reasoning": f"Stub response for a {len(prompt)}-character prompt.",
+                    "next_steps": ["Configure GOOGLE_AI_API_KEY for real answers"]
+                }
+            ]
+        })
+
+    async def stream_chat(self, model_name: str, history: List[dict], message: str) -> AsyncIterator[str]:
+        self.calls += 1
+        for word in f"(stub, {len(history)} earlier turns) You said: {message}".split(" "):
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield word + " "
+
+
+def make_gemini_client():
+    if GEMINI_CLIENT == "stub":
+        logger.info("Using stub Gemini client")
+        return StubGeminiClient()
+    return GeminiClient()
+
+
+def cache_key(model_name: str, inputs: dict) -> str:
+    """sha256 over the model name and the already-normalized prompt inputs."""
+    payload = json.dumps({"model": model_name, "inputs": inputs}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent TTL cache of LLM responses in a local SQLite file. The file
+    is shared by every worker process on the host (WAL mode), so a response
+    generated by one worker is served by the others.
+    """
+
+    def __init__(self, path: str = DIAGNOSE_CACHE_PATH, ttl_seconds: int = DIAGNOSE_CACHE_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.local = threading.local()
+        self.stats = {"hits": 0, "misses": 0, "errors": 0}
+        with self._connect() as conn:
+            conn.execute(
+                "create table if not exists responses ("
+                "key text primary key, value text not null, expires_at real not null)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("pragma journal_mode=wal")
+            self.local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            row = self._connect().execute(
+                "select value from responses where key = ? and expires_at > ?", (key, time.time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Response cache read failed: {e}")
+            return None
+        self.stats["hits" if row else "misses"] += 1
+        return row[0] if row else None
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "insert or replace into responses (key, value, expires_at) values (?, ?, ?)",
+                    (key, value, now + self.ttl_seconds),
+                )
+                conn.execute("delete from responses where expires_at <= ?", (now,))
+        except sqlite3.Error as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Response cache write failed: {e}")
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one in-flight coroutine. The
+    coroutine runs in a task owned by the flight, not by the first caller,
+    and every caller awaits it through a shield: a caller that is cancelled
+    (client disconnect) stops waiting without cancelling the call the
+    others are waiting on.
+    """
+
+    def __init__(self):
+        self.inflight: Dict[str, asyncio.Task] = {}
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]):
+        task = self.inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.create_task(fn())
+            self.inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+        # Mark retrieved so a failure nobody awaited anymore doesn't log a warning.
+        if not task.cancelled():
+            task.exception()
+
+
+class CachedGenerator:
+    """Cache lookup, then one coalesced upstream call per key on a miss."""
+
+    def __init__(self, client, cache: ResponseCache):
+        self.client = client
+        self.cache = cache
+        self.flights = SingleFlight()
+
+    async def generate(self, model_name: str, prompt: str, inputs: dict):
+        """Returns (text, cached)."""
+        key = cache_key(model_name, inputs)
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            return cached, True
+
+        async def fetch():
+            text = await self.client.generate(model_name, prompt)
+            await asyncio.to_thread(self.cache.set, key, text)
+            return text
+
+        return await self.flights.do(key, fetch), False
+
+
+class Saturated(Exception):
+    """No upstream slot freed up within the admission timeout."""
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class ChatLimiter:
+    """
+    Caps concurrent upstream chat streams. Admission waits at most
+    CHAT_ADMISSION_TIMEOUT_SECONDS for a slot and otherwise raises Saturated,
+    so overload turns into fast 503s instead of a growing queue. Streams
+    are cut off when the first token or the whole reply misses its deadline.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = CHAT_MAX_CONCURRENCY,
+        admission_timeout: float = CHAT_ADMISSION_TIMEOUT_SECONDS,
+        first_token_timeout: float = CHAT_FIRST_TOKEN_TIMEOUT_SECONDS,
+        deadline: float = CHAT_DEADLINE_SECONDS,
+    ):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.admission_timeout = admission_timeout
+        self.first_token_timeout = first_token_timeout
+        self.deadline = deadline
+        self.active = 0
+        self.stats = {"admitted": 0, "rejected": 0, "timeouts": 0}
+
+    async def acquire(self):
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout=self.admission_timeout)
+        except asyncio.TimeoutError:
+            self.stats["rejected"] += 1
+            raise Saturated()
+        self.active += 1
+        self.stats["admitted"] += 1
+
+    def release(self):
+        self.active -= 1
+        self.semaphore.release()
+
+    def saturated(self) -> bool:
+        """Cheap pre-check so callers can reject before starting a response."""
+        if self.active >= self.max_concurrency:
+            self.stats["rejected"] += 1
+            return True
+        return False
+
+    async def stream(self, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        """
+        Take a slot, then relay chunks under the deadlines. The slot is held
+        only while this generator runs, so a response that never starts
+        iterating cannot leak it.
+        """
+        await self.acquire()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        first = True
+        try:
+            while True:
+                remaining = self.deadline - (loop.time() - started)
+                timeout = min(self.first_token_timeout, remaining) if first else remaining
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=max(timeout, 0))
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    self.stats["timeouts"] += 1
+                    raise DeadlineExceeded("first token" if first else "reply")
+                first = False
+                yield chunk
+        finally:
+            self.release()
+            aclose = getattr(chunks, "aclose", None)
+            if aclose:
+                await aclose()
@@ -1,12 +1,13 @@
 import sys
 import os
-from fastapi import FastAPI, HTTPException, Body
+import asyncio
+from fastapi import FastAPI, Depends, HTTPException, Body, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict
 import google.generativeai as genai
 import json
 import tensorflow as tf
-import pandas as pd
 import numpy as np
 
 from dotenv import load_dotenv
@@ -14,12 +15,22 @@ from dotenv import load_dotenv
 # Add parent directory to path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
+from shared.admission import AdmissionGate, client_key, request_priority
+from shared.auth import get_current_user
 from shared.logger import setup_logger
+from shared.symptoms import canonical_symptom, get_symptom_dictionary
+
+sys.path.append(os.path.dirname(__file__))
+from chat_sessions import ChatSessionStore, trim_history, turn_text
+from model_registry import AI_MODEL_POLL_SECONDS, AI_MODEL_RUNTIME, ModelRegistry
+from gemini_client import (
+    GEMINI_CLIENT, CachedGenerator, ChatLimiter, DeadlineExceeded, ResponseCache, Saturated, make_gemini_client
+)
 
 # Load environment variables
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '..', '.env'))
 
-app = FastAPI(title="RareMatch AI Service", version="1.0.0")
+app = FastAPI(title="RareMatch AI Service", version="1.0.0", default_response_class=ORJSONResponse)
 logger = setup_logger("ai-service")
 
 from fastapi.middleware.cors import CORSMiddleware
@@ -39,56 +50,88 @@ if GOOGLE_AI_API_KEY:
 else:
     logger.warning("GOOGLE_AI_API_KEY not found in environment variables.")
 
-# Load ML Model and Metadata
-# Load ML Models
-EMBEDDING_MODEL_PATH = os.path.join(os.path.dirname(__file__), "rare_match_embedding_model.h5")
-FULL_MODEL_PATH = os.path.join(os.path.dirname(__file__), "rare_match_multilabel_model.h5")
-VOCAB_PATH = os.path.join(os.path.dirname(__file__), "symptom_vocab.csv")
-
-embedding_model = None
-full_model = None
-symptom_to_idx = {}
-vocab_size = 0
-
-try:
-    if os.path.exists(EMBEDDING_MODEL_PATH) and os.path.exists(FULL_MODEL_PATH) and os.path.exists(VOCAB_PATH):
-        logger.info(f"Loading embedding model from {EMBEDDING_MODEL_PATH}")
-        embedding_model = tf.keras.models.load_model(EMBEDDING_MODEL_PATH)
-        
-        logger.info(f"Loading full classification model from {FULL_MODEL_PATH}")
-        full_model = tf.keras.models.load_model(FULL_MODEL_PATH)
-        
-        logger.info(f"Loading vocab from {VOCAB_PATH}")
-        vocab_df = pd.read_csv(VOCAB_PATH)
-        symptom_vocab = vocab_df["symptom"].tolist()
-        symptom_to_idx = {s: i for i, s in enumerate(symptom_vocab)}
-        vocab_size = len(symptom_vocab)
-        logger.info(f"Models loaded successfully. Vocab size: {vocab_size}")
-    else:
-        logger.warning("Model or vocab file not found. Using mock embeddings.")
-except Exception as e:
-    logger.error(f"Failed to load ML models: {e}")
-
-# Load Metadata
-METADATA_PATH = os.path.join(os.path.dirname(__file__), "rare_match_metadata.json")
-feature_cols = []
-label_cols = []
-
-try:
-    if os.path.exists(METADATA_PATH):
-        with open(METADATA_PATH, "r") as f:
-            metadata = json.load(f)
-            feature_cols = metadata.get("feature_cols", [])
-            label_cols = metadata.get("label_cols", [])
-            logger.info(f"Loaded {len(feature_cols)} feature columns and {len(label_cols)} labels from metadata.")
-    else:
-        logger.warning("Metadata file not found!")
-except Exception as e:
-    logger.error(f"Failed to load metadata: {e}")
+DIAGNOSE_MODEL = "gemini-2.0-flash"
+CHAT_MODEL = "gemini-2.0-flash"
+gemini_client = make_gemini_client()
+diagnosis_generator = CachedGenerator(gemini_client, ResponseCache())
+chat_limiter = ChatLimiter()
+chat_sessions = ChatSessionStore()
+
+# Per-caller admission control. /diagnose also has an endpoint-wide cap;
+# /chat concurrency is already bounded by chat_limiter, so only its rate is.
+DIAGNOSE_MAX_CONCURRENCY = int(os.getenv("DIAGNOSE_MAX_CONCURRENCY", "8"))
+DIAGNOSE_RATE_PER_MINUTE = float(os.getenv("DIAGNOSE_RATE_PER_MINUTE", "10"))
+DIAGNOSE_BURST = float(os.getenv("DIAGNOSE_BURST", "3"))
+CHAT_RATE_PER_MINUTE = float(os.getenv("CHAT_RATE_PER_MINUTE", "30"))
+CHAT_BURST = float(os.getenv("CHAT_BURST", "5"))
+
+diagnose_gate = AdmissionGate("diagnose", DIAGNOSE_MAX_CONCURRENCY, DIAGNOSE_RATE_PER_MINUTE, DIAGNOSE_BURST)
+chat_gate = AdmissionGate("chat", None, CHAT_RATE_PER_MINUTE, CHAT_BURST)
+
+# ML models: versioned bundles (models, vocab, metadata) served by the
+# registry, which hot-swaps to a new version once it passes a smoke check.
+model_registry = ModelRegistry()
+model_watch_task: Optional[asyncio.Task] = None
+
+# Thread pools per process (0 = TensorFlow default: all cores). serve.py sizes
+# these per worker so N workers don't each spin up a pool as big as the box.
+TF_INTRA_OP_THREADS = int(os.getenv("TF_INTRA_OP_THREADS", "0"))
+TF_INTER_OP_THREADS = int(os.getenv("TF_INTER_OP_THREADS", "0"))
+# serve.py imports this module in the parent before forking and loads the
+# models itself: once in the parent when they run without TensorFlow, else
+# in each worker (TensorFlow's runtime is not fork-safe).
+DEFER_MODEL_LOAD = os.getenv("AI_DEFER_MODEL_LOAD", "false").lower() == "true"
+
+def configure_tf_threads(intra: int = TF_INTRA_OP_THREADS, inter: int = TF_INTER_OP_THREADS):
+    """Must run before the first TensorFlow op in this process."""
+    try:
+        if intra:
+            tf.config.threading.set_intra_op_parallelism_threads(intra)
+        if inter:
+            tf.config.threading.set_inter_op_parallelism_threads(inter)
+    except RuntimeError as e:
+        logger.warning(f"TensorFlow already initialized; thread settings ignored: {e}")
+
+def load_models(runtime: str = AI_MODEL_RUNTIME):
+    """Load the registry's target version (later versions are picked up by watch_model_registry)."""
+    try:
+        model_registry.sync(runtime)
+    except Exception as e:
+        logger.error(f"Failed to load ML models: {e}")
+
+if not DEFER_MODEL_LOAD:
+    configure_tf_threads()
+    load_models()
+
+async def watch_model_registry():
+    while True:
+        await asyncio.sleep(AI_MODEL_POLL_SECONDS)
+        try:
+            await asyncio.to_thread(model_registry.sync)
+        except Exception as e:
+            logger.error(f"Model registry check failed: {e}")
+
+@app.on_event("startup")
+async def start_model_watch():
+    global model_watch_task
+    model_watch_task = asyncio.create_task(watch_model_registry())
+
+@app.on_event("shutdown")
+async def stop_model_watch():
+    if model_watch_task:
+        model_watch_task.cancel()
+
+@app.get("/models")
+def model_status():
+    return model_registry.snapshot()
+
+symptom_dictionary = get_symptom_dictionary()
 
 class EmbedRequest(BaseModel):
     text: str # Keeping 'text' for compatibility
     symptoms: Optional[List[str]] = None
+    # Shared symptom dictionary IDs (shared/symptom_dictionary.json)
+    symptom_ids: Optional[List[int]] = None
     # Add other fields if the frontend sends them, otherwise we use defaults
     age: Optional[int] = 30
     symptom_count: Optional[int] = 1
@@ -99,49 +142,60 @@ class DiagnoseRequest(BaseModel):
     gender: Optional[str] = None
     history: Optional[str] = None
     
-def preprocess_input(text: str, symptoms: List[str] = None, age: int = 30):
+def preprocess_input(text: str, symptoms: List[str] = None, age: int = 30, symptom_ids: List[int] = None, feature_cols: List[str] = None):
     if not feature_cols:
         logger.error("Feature columns not loaded. Cannot preprocess.")
-        return None, None
+        return None, None, []
 
     # 1. Parse Symptoms
     input_symptoms = []
     if symptoms:
         input_symptoms.extend(symptoms)
-    if text and not symptoms:
+    if text and not symptoms and not symptom_ids:
         input_symptoms.extend([s.strip() for s in text.split(',')])
     
-    # Normalize input symptoms
-    normalized_symptoms = [s.lower().strip().replace(" ", "_") for s in input_symptoms]
-    
     # 2. Initialize Feature Vector
     # Create a dictionary for easier mapping, then convert to list
     feature_map = {col: 0.0 for col in feature_cols}
     
-    # 3. Map Symptoms to Features (with Fuzzy Matching)
+    # 3. Map Symptoms to Features via the shared dictionary (with Fuzzy Matching)
     import difflib
     
-    # Pre-compute valid symptom names from feature_cols (stripping 'sym_')
-    valid_symptoms = [col.replace("sym_", "") for col in feature_cols if col.startswith("sym_")]
+    # Dictionary names whose feature column this model has
+    valid_symptoms = [
+        name for i, name in enumerate(symptom_dictionary.names)
+        if name and symptom_dictionary.feature_of(i) in feature_map
+    ]
     
+    resolved_ids = []
     active_features = []
-    for s in normalized_symptoms:
-        # 1. Try Exact Match
-        key = f"sym_{s}"
-        if key in feature_map:
+
+    def activate(symptom_id: int, label: str):
+        key = symptom_dictionary.feature_of(symptom_id)
+        if key not in feature_map:
+            return False
+        if symptom_id not in resolved_ids:
             feature_map[key] = 1.0
-            active_features.append(key)
+            resolved_ids.append(symptom_id)
+            active_features.append(label.format(key=key))
+        return True
+
+    for symptom_id in symptom_ids or []:
+        if not activate(symptom_id, "{key}"):
+            logger.warning(f"Unknown symptom id: {symptom_id}")
+
+    for s in input_symptoms:
+        # 1. Try Exact Match (canonical name or alias)
+        symptom_id = symptom_dictionary.id_of(s)
+        if symptom_id is not None and activate(symptom_id, "{key}"):
             continue
             
         # 2. Try Fuzzy Match
-        matches = difflib.get_close_matches(s, valid_symptoms, n=1, cutoff=0.7)
+        matches = difflib.get_close_matches(canonical_symptom(s), valid_symptoms, n=1, cutoff=0.7)
         if matches:
             best_match = matches[0]
-            key = f"sym_{best_match}"
-            if key in feature_map:
-                feature_map[key] = 1.0
-                active_features.append(f"{key} (fuzzy: {s})")
-                logger.info(f"Fuzzy match: '{s}' -> '{best_match}'")
+            activate(symptom_dictionary.id_of(best_match), f"{{key}} (fuzzy: {s})")
+            logger.info(f"Fuzzy match: '{s}' -> '{best_match}'")
         else:
             logger.warning(f"No match found for symptom: '{s}'")
             
@@ -149,46 +203,49 @@ def preprocess_input(text: str, symptoms: List[str] = None, age: int = 30):
     if "age" in feature_map:
         feature_map["age"] = float(age)
     if "symptom_count" in feature_map:
-        feature_map["symptom_count"] = float(len(normalized_symptoms))
+        feature_map["symptom_count"] = float(len(input_symptoms) + len(symptom_ids or []))
         
     # 5. Convert to Ordered List
     # STRICTLY follow the order in feature_cols
     input_vector = [feature_map[col] for col in feature_cols]
     
     # 6. Reshape for Model (1, N)
-    return np.array([input_vector], dtype=np.float32), active_features
+    return np.array([input_vector], dtype=np.float32), active_features, resolved_ids
 
 @app.post("/embed")
 def generate_embedding(request: EmbedRequest):
-    """Generate embedding and disease probabilities using custom TensorFlow models."""
-    if embedding_model and full_model and feature_cols:
+    """
+    Generate embedding and disease probabilities using custom TensorFlow models.
+    model_version names the model that produced the embedding (None for the
+    zero fallback). embedding_space is what callers key stored vectors on:
+    versions sharing it produce comparable embeddings. Reference rows
+    without a tag belong to baseline_space.
+    """
+    # One bundle for the whole request, even if a new version swaps in meanwhile.
+    bundle = model_registry.active
+    if bundle and bundle.feature_cols:
         try:
-            input_vec, active_features = preprocess_input(request.text, request.symptoms, request.age)
+            input_vec, active_features, symptom_ids = preprocess_input(
+                request.text, request.symptoms, request.age, request.symptom_ids, bundle.feature_cols
+            )
             if input_vec is not None:
                 # Verify shape
-                expected_shape = embedding_model.input_shape[1]
+                expected_shape = bundle.input_width
                 if input_vec.shape[1] != expected_shape:
                     logger.error(f"Shape mismatch! Model expects {expected_shape}, got {input_vec.shape[1]}")
-                    return {"embedding": [0.0] * 256, "probabilities": [], "debug_info": {"error": "Shape mismatch"}}
-
-                # 1. Generate Embedding
-                embedding = embedding_model.predict(input_vec)
-                
-                # 2. Generate Disease Probabilities
-                predictions = full_model.predict(input_vec)[0] # Get first batch
-                
-                # Get top 5 predictions
-                top_indices = predictions.argsort()[-5:][::-1]
-                top_diseases = []
-                for idx in top_indices:
-                    if idx < len(label_cols):
-                        disease_name = label_cols[idx].replace("label_", "")
-                        score = float(predictions[idx])
-                        top_diseases.append({"disease": disease_name, "probability": score})
+                    return {"embedding": [0.0] * 256, "model_version": None, "probabilities": [], "debug_info": {"error": "Shape mismatch"}}
+
+                # 1. Generate Embedding + 2. Disease Probabilities
+                embedding, predictions = bundle.predict(input_vec)
 
                 return {
                     "embedding": embedding[0].tolist(),
-                    "probabilities": top_diseases,
+                    "model_version": bundle.version,
+                    "embedding_space": bundle.space,
+                    "baseline_space": model_registry.baseline_space,
+                    "symptom_ids": symptom_ids,
+                    # Top 5 predictions
+                    "probabilities": bundle.top_diseases(predictions[0]),
                     "debug_info": {
                         "active_features": active_features,
                         "vector_sum": float(np.sum(input_vec)),
@@ -197,16 +254,26 @@ def generate_embedding(request: EmbedRequest):
                 }
         except Exception as e:
             logger.error(f"Error generating embedding with model: {e}")
-            return {"embedding": [0.0] * 256, "probabilities": [], "debug_info": {"error": str(e)}}
+            return {"embedding": [0.0] * 256, "model_version": None, "probabilities": [], "debug_info": {"error": str(e)}}
     
     # Fallback
     logger.warning("Using fallback embedding (zeros)")
-    return {"embedding": [0.0] * 256, "probabilities": [], "debug_info": {"status": "fallback"}}
+    return {"embedding": [0.0] * 256, "model_version": None, "probabilities": [], "debug_info": {"status": "fallback"}}
+
+def normalize_diagnose_inputs(request: DiagnoseRequest) -> dict:
+    """Prompt inputs in canonical form, so equivalent requests share a cache entry."""
+    symptoms = sorted({canonical_symptom(s).replace("_", " ") for s in request.symptoms if s.strip()})
+    return {
+        "symptoms": symptoms,
+        "age": request.age,
+        "gender": request.gender.strip().lower() if request.gender else None,
+        "history": " ".join(request.history.split()) if request.history else None,
+    }
 
 @app.post("/diagnose")
-async def diagnose_symptoms(request: DiagnoseRequest):
-    """Generate differential diagnosis using Gemini Pro (keeping this as is)."""
-    if not GOOGLE_AI_API_KEY:
+async def diagnose_symptoms(request: DiagnoseRequest, http_request: Request, user: dict = Depends(get_current_user)):
+    """Generate differential diagnosis using Gemini, cached per normalized input."""
+    if not GOOGLE_AI_API_KEY and GEMINI_CLIENT != "stub":
         return {
             "diagnosis": "Mock Diagnosis: Rare Disease X",
             "confidence": 0.85,
@@ -214,13 +281,13 @@ async def diagnose_symptoms(request: DiagnoseRequest):
             "next_steps": ["Consult a specialist", "Genetic testing"]
         }
 
+    inputs = normalize_diagnose_inputs(request)
     try:
-        model = genai.GenerativeModel('gemini-2.0-flash')
         prompt = f"""
         Act as an expert medical diagnostician for rare diseases.
-        Patient Profile: Age {request.age}, Gender {request.gender}
-        Medical History: {request.history}
-        Symptoms: {', '.join(request.symptoms)}
+        Patient Profile: Age {inputs["age"]}, Gender {inputs["gender"]}
+        Medical History: {inputs["history"]}
+        Symptoms: {', '.join(inputs["symptoms"])}
         
         Provide a differential diagnosis with top 3 potential rare diseases.
         For each, provide:
@@ -232,8 +299,11 @@ async def diagnose_symptoms(request: DiagnoseRequest):
         Format as JSON.
         """
         
-        response = model.generate_content(prompt)
-        return {"result": response.text}
+        with diagnose_gate.admit(client_key(http_request, user), request_priority(http_request)):
+            text, cached = await diagnosis_generator.generate(DIAGNOSE_MODEL, prompt, inputs)
+        return {"result": text, "cached": cached}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error generating diagnosis: {e}")
         # Mock Fallback
@@ -258,28 +328,109 @@ async def diagnose_symptoms(request: DiagnoseRequest):
 
 class ChatRequest(BaseModel):
     message: str
-    history: List[Dict[str, str]] = [] # [{"role": "user", "parts": ["msg"]}, {"role": "model", "parts": ["msg"]}]
+    # Server-side session from a previous reply; history is then kept here.
+    session_id: Optional[str] = None
+    # Only used to seed a new session (older clients resend it every turn).
+    history: List[dict] = [] # [{"role": "user", "parts": ["msg"]}, {"role": "model", "parts": ["msg"]}]
+
+def open_chat_session(request: ChatRequest, user_id: str):
+    """
+    (session_id, stored history); unknown, expired or other users' sessions
+    start fresh.
+    """
+    if request.session_id:
+        history = chat_sessions.load(request.session_id, user_id)
+        if history is not None:
+            return request.session_id, history
+    seed = [{"role": turn.get("role", "user"), "parts": [turn_text(turn)]} for turn in request.history]
+    return chat_sessions.new_id(), seed
+
+def save_chat_turn(session_id: str, user_id: str, history: List[dict], message: str, reply: str):
+    chat_sessions.save(session_id, user_id, history + [
+        {"role": "user", "parts": [message]},
+        {"role": "model", "parts": [reply]},
+    ])
+
+CHAT_UNAVAILABLE_MESSAGE = "I'm having trouble connecting to my brain right now. Please try again later."
+CHAT_BUSY_MESSAGE = "Chat is at capacity, please retry shortly"
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
 
 @app.post("/chat")
-async def chat_with_ai(request: ChatRequest):
+async def chat_with_ai(request: ChatRequest, http_request: Request, user: dict = Depends(get_current_user)):
     """
-    Conversational endpoint using Gemini Pro.
+    Conversational endpoint using Gemini.
+    Streams the reply as server-sent events when the client sends
+    'Accept: text/event-stream'; otherwise returns the whole reply as JSON.
     """
-    if not GOOGLE_AI_API_KEY:
-        return {"response": "I'm sorry, but I can't chat right now because my API key is missing."}
+    streaming = "text/event-stream" in http_request.headers.get("accept", "")
+    if not GOOGLE_AI_API_KEY and GEMINI_CLIENT != "stub":
+        message = "I'm sorry, but I can't chat right now because my API key is missing."
+        if streaming:
+            return StreamingResponse(
+                iter([sse_event({"delta": message}), sse_event({}, "done")]), media_type="text/event-stream"
+            )
+        return {"response": message}
+
+    chat_gate.check_rate(client_key(http_request, user))
+    if chat_limiter.saturated():
+        raise HTTPException(status_code=503, detail=CHAT_BUSY_MESSAGE, headers={"Retry-After": "1"})
+    user_id = user["id"]
+    session_id, history = await asyncio.to_thread(open_chat_session, request, user_id)
+    chunks = chat_limiter.stream(gemini_client.stream_chat(CHAT_MODEL, trim_history(history), request.message))
+
+    if streaming:
+        async def events():
+            reply = []
+            try:
+                yield sse_event({"session_id": session_id}, "session")
+                async for chunk in chunks:
+                    reply.append(chunk)
+                    yield sse_event({"delta": chunk})
+                await asyncio.to_thread(save_chat_turn, session_id, user_id, history, request.message, "".join(reply))
+                yield sse_event({"session_id": session_id}, "done")
+            except Saturated:
+                yield sse_event({"error": CHAT_BUSY_MESSAGE, "session_id": session_id}, "error")
+            except DeadlineExceeded as e:
+                logger.warning(f"Chat stream missed its {e} deadline")
+                yield sse_event({"error": "timeout", "session_id": session_id}, "error")
+            except Exception as e:
+                logger.error(f"Error in chat stream: {e}")
+                yield sse_event({"error": CHAT_UNAVAILABLE_MESSAGE, "session_id": session_id}, "error")
+
+        return StreamingResponse(
+            events(), media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Chat-Session": session_id},
+        )
 
     try:
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        
-        # Convert history to Gemini format if needed, or use start_chat
-        # Simple stateless approach for now:
-        chat = model.start_chat(history=request.history)
-        
-        response = chat.send_message(request.message)
-        return {"response": response.text}
+        reply = "".join([chunk async for chunk in chunks])
+        await asyncio.to_thread(save_chat_turn, session_id, user_id, history, request.message, reply)
+        return {"response": reply, "session_id": session_id}
+    except Saturated:
+        raise HTTPException(
+            status_code=503, detail=CHAT_BUSY_MESSAGE, headers={"Retry-After": "1", "X-Chat-Session": session_id}
+        )
     except Exception as e:
         logger.error(f"Error in chat: {e}")
-        return {"response": "I'm having trouble connecting to my brain right now. Please try again later."}
+        # Keep the session: the client would otherwise start over next turn.
+        return {"response": CHAT_UNAVAILABLE_MESSAGE, "session_id": session_id}
+
+@app.delete("/chat/sessions/{session_id}")
+async def delete_chat_session(session_id: str, user: dict = Depends(get_current_user)):
+    await asyncio.to_thread(chat_sessions.delete, session_id, user["id"])
+    return {"status": "success"}
+
+@app.get("/chat/stats")
+def chat_stats():
+    return {
+        "active": chat_limiter.active,
+        "max_concurrency": chat_limiter.max_concurrency,
+        **chat_limiter.stats,
+        "admission": {"chat": chat_gate.snapshot(), "diagnose": diagnose_gate.snapshot()},
+    }
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,447 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import h5py
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.logger import setup_logger
+
+logger = setup_logger("model-registry")
+
+# Versioned model sets, one immutable directory per version:
+#
+#   models/<version>/rare_match_embedding_model.h5
+#                   /rare_match_multilabel_model.h5
+#                   /symptom_vocab.csv
+#                   /rare_match_metadata.json
+#                   /smoke.json          (optional, see smoke_check)
+#   models/CURRENT                       (optional: version to serve)
+#   models/SPACES.json                   (written: version -> embedding space)
+#
+# Without CURRENT the lexically greatest version is served. With no
+# versions at all, the files next to main.py are served as before.
+AI_MODEL_REGISTRY_DIR = os.getenv("AI_MODEL_REGISTRY_DIR", os.path.join(os.path.dirname(__file__), "models"))
+AI_MODEL_POLL_SECONDS = float(os.getenv("AI_MODEL_POLL_SECONDS", "30"))
+# Share of smoke.json cases whose expected top diagnosis must be predicted.
+AI_MODEL_MIN_AGREEMENT = float(os.getenv("AI_MODEL_MIN_AGREEMENT", "0.9"))
+# Parity against the serving version: share of the same inputs on which
+# both versions must predict the same top diagnosis.
+AI_MODEL_MIN_PARITY = float(os.getenv("AI_MODEL_MIN_PARITY", "0.8"))
+# Mean cosine between both versions' embeddings of the same inputs below
+# which the candidate is treated as a new embedding space.
+AI_MODEL_SAME_SPACE_COSINE = float(os.getenv("AI_MODEL_SAME_SPACE_COSINE", "0.99"))
+# Embedding space of reference rows uploaded without an embedding_model tag.
+# Defaults to the space of the model files next to main.py (what those rows
+# were embedded with), else of the oldest registry version.
+EMBEDDING_BASELINE_SPACE = os.getenv("EMBEDDING_BASELINE_SPACE")
+LEGACY_MODEL_DIR = os.path.dirname(__file__)
+# "numpy" runs models made only of Dense layers as plain numpy arrays (no
+# TensorFlow runtime, so they can be loaded before serve.py forks and be
+# shared by all workers); "tensorflow" always uses Keras; "auto" uses numpy
+# when the model allows it.
+AI_MODEL_RUNTIME = os.getenv("AI_MODEL_RUNTIME", "auto").lower()
+
+EMBEDDING_FILE = "rare_match_embedding_model.h5"
+FULL_MODEL_FILE = "rare_match_multilabel_model.h5"
+VOCAB_FILE = "symptom_vocab.csv"
+METADATA_FILE = "rare_match_metadata.json"
+SMOKE_FILE = "smoke.json"
+SPACES_FILE = "SPACES.json"
+
+
+class ModelCheckFailed(Exception):
+    pass
+
+
+class UnsupportedModel(Exception):
+    pass
+
+
+def softmax(x: np.ndarray) -> np.ndarray:
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0),
+    "sigmoid": lambda x: 1 / (1 + np.exp(-x)),
+    "tanh": np.tanh,
+    "softmax": softmax,
+}
+
+
+class DenseStack:
+    """
+    A Keras .h5 model made of a chain of Dense layers (Dropout is a no-op at
+    inference), evaluated with numpy. The weights are read with h5py
+    without starting TensorFlow, so a parent process can load them before
+    forking and its workers share them copy-on-write.
+    """
+
+    def __init__(self, layers: List[Tuple[np.ndarray, Optional[np.ndarray], str]], input_width: int):
+        self.layers = layers
+        self.input_shape = (None, input_width)
+
+    @classmethod
+    def from_h5(cls, path: str) -> "DenseStack":
+        with h5py.File(path, "r") as f:
+            config = json.loads(f.attrs["model_config"])
+            if config.get("class_name") not in ("Sequential", "Functional"):
+                raise UnsupportedModel(f"{config.get('class_name')} model")
+            weights = f["model_weights"]
+            layers, input_width = [], None
+            for layer in config["config"]["layers"]:
+                kind, layer_config = layer["class_name"], layer["config"]
+                if kind == "InputLayer":
+                    shape = layer_config.get("batch_shape") or layer_config.get("batch_input_shape")
+                    input_width = shape[-1]
+                    continue
+                if kind == "Dropout":
+                    continue
+                if kind != "Dense":
+                    raise UnsupportedModel(f"{kind} layer {layer_config.get('name')}")
+                activation = layer_config.get("activation", "linear")
+                if activation not in ACTIVATIONS:
+                    raise UnsupportedModel(f"activation {activation}")
+                group = weights[layer_config["name"]]
+                names = [n.decode() if isinstance(n, bytes) else n for n in group.attrs["weight_names"]]
+                kernel = np.asarray(group[names[0]], dtype=np.float32)
+                bias = np.asarray(group[names[1]], dtype=np.float32) if layer_config.get("use_bias", True) else None
+                layers.append((kernel, bias, activation))
+                if input_width is None:
+                    input_width = kernel.shape[0]
+        if not layers:
+            raise UnsupportedModel("no Dense layers")
+        return cls(layers, input_width)
+
+    def predict(self, x: np.ndarray, verbose: int = 0) -> np.ndarray:
+        out = np.asarray(x, dtype=np.float32)
+        for kernel, bias, activation in self.layers:
+            out = out @ kernel
+            if bias is not None:
+                out = out + bias
+            out = ACTIVATIONS[activation](out)
+        return out
+
+
+def load_model_file(path: str, runtime: str = AI_MODEL_RUNTIME):
+    """DenseStack when the runtime allows and the model supports it, else Keras."""
+    if runtime != "tensorflow":
+        try:
+            return DenseStack.from_h5(path)
+        except UnsupportedModel as e:
+            if runtime == "numpy":
+                raise
+            logger.info(f"{os.path.basename(path)} needs TensorFlow ({e})")
+    return tf.keras.models.load_model(path)
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+class ModelBundle:
+    """One model version: both Keras models plus the vocab and metadata they were trained with."""
+
+    def __init__(self, version: str, path: str, runtime: str = AI_MODEL_RUNTIME):
+        self.version = version
+        self.path = path
+        with open(os.path.join(path, METADATA_FILE), "r") as f:
+            metadata = json.load(f)
+        # Versions whose embeddings stay comparable share a space id, so
+        # reference embeddings of one serve the other (see ModelRegistry.sync).
+        self.space: str = metadata.get("embedding_space") or version
+        self.feature_cols: List[str] = metadata.get("feature_cols", [])
+        self.label_cols: List[str] = metadata.get("label_cols", [])
+        vocab = pd.read_csv(os.path.join(path, VOCAB_FILE))["symptom"].tolist()
+        self.symptom_to_idx: Dict[str, int] = {s: i for i, s in enumerate(vocab)}
+        self.embedding_model = load_model_file(os.path.join(path, EMBEDDING_FILE), runtime)
+        self.full_model = load_model_file(os.path.join(path, FULL_MODEL_FILE), runtime)
+
+    @property
+    def runtime(self) -> str:
+        numpy_only = isinstance(self.embedding_model, DenseStack) and isinstance(self.full_model, DenseStack)
+        return "numpy" if numpy_only else "tensorflow"
+
+    @property
+    def input_width(self) -> int:
+        return self.embedding_model.input_shape[1]
+
+    def predict(self, input_vec: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(embeddings, label probabilities) for a (batch, features) matrix."""
+        return (
+            self.embedding_model.predict(input_vec, verbose=0),
+            self.full_model.predict(input_vec, verbose=0),
+        )
+
+    def top_diseases(self, probabilities: np.ndarray, k: int = 5) -> List[dict]:
+        top = []
+        for idx in probabilities.argsort()[-k:][::-1]:
+            if idx < len(self.label_cols):
+                top.append({"disease": self.label_cols[idx].replace("label_", ""), "probability": float(probabilities[idx])})
+        return top
+
+    def feature_vector(self, features: List[str]) -> List[float]:
+        active = set(features)
+        return [1.0 if col in active else 0.0 for col in self.feature_cols]
+
+    def smoke_cases(self) -> List[dict]:
+        smoke_path = os.path.join(self.path, SMOKE_FILE)
+        if not os.path.exists(smoke_path):
+            return []
+        with open(smoke_path, "r") as f:
+            return json.load(f).get("cases", [])
+
+
+def smoke_check(bundle: ModelBundle, min_agreement: float = AI_MODEL_MIN_AGREEMENT):
+    """
+    Run a smoke batch through a freshly loaded bundle before it serves.
+    This also warms up both models, so the first real request does not pay
+    for graph tracing. smoke.json, if present, holds
+    {"cases": [{"features": ["sym_fever", ...], "expected": "label_..."}]}.
+    Its expected top diagnoses must agree at least `min_agreement` of the
+    time. Without it, a zero row and a few single-feature rows are only
+    checked for sane outputs.
+    """
+    if bundle.input_width != len(bundle.feature_cols):
+        raise ModelCheckFailed(f"model expects {bundle.input_width} features, metadata lists {len(bundle.feature_cols)}")
+    cases = bundle.smoke_cases()
+    if cases:
+        batch = np.array([bundle.feature_vector(c.get("features", [])) for c in cases], dtype=np.float32)
+    else:
+        batch = np.vstack([np.zeros((1, len(bundle.feature_cols))), np.eye(len(bundle.feature_cols))[:8]]).astype(np.float32)
+    embeddings, probabilities = bundle.predict(batch)
+
+    if embeddings.ndim != 2 or embeddings.shape[0] != len(batch) or not np.isfinite(embeddings).all():
+        raise ModelCheckFailed(f"bad embedding output {embeddings.shape}")
+    if probabilities.shape != (len(batch), len(bundle.label_cols)):
+        raise ModelCheckFailed(f"classifier returned {probabilities.shape}, expected {(len(batch), len(bundle.label_cols))}")
+    if not np.isfinite(probabilities).all() or probabilities.min() < 0 or probabilities.max() > 1:
+        raise ModelCheckFailed("classifier probabilities outside [0, 1]")
+
+    expected = [(i, c["expected"]) for i, c in enumerate(cases) if c.get("expected")]
+    if expected:
+        agreed = sum(1 for i, label in expected if bundle.label_cols[int(probabilities[i].argmax())] == label)
+        if agreed / len(expected) < min_agreement:
+            raise ModelCheckFailed(f"smoke agreement {agreed}/{len(expected)} below {min_agreement:.0%}")
+    return {"cases": len(batch), "embedding_dim": int(embeddings.shape[1])}
+
+
+def parity_check(
+    candidate: ModelBundle,
+    active: ModelBundle,
+    min_parity: float = AI_MODEL_MIN_PARITY,
+    same_space_cosine: float = AI_MODEL_SAME_SPACE_COSINE,
+) -> dict:
+    """
+    Run the same inputs through the serving and the candidate version:
+    the candidate's smoke.json cases, else one row per symptom feature
+    both versions know. The embedding dimension must not change (stored
+    timeline and reference vectors have a fixed size) and the top
+    diagnosis may change on at most 1 - `min_parity` of the inputs.
+    `same_space` is False when the embeddings themselves moved, i.e.
+    reference cases must be re-uploaded for the new version before vector
+    search can use it (matching only compares vectors of one model).
+    """
+    inputs = [c.get("features", []) for c in candidate.smoke_cases()]
+    if not inputs:
+        shared = [col for col in active.feature_cols if col in set(candidate.feature_cols)]
+        inputs = [[]] + [[col] for col in shared[:64]]
+    old_emb, old_prob = active.predict(np.array([active.feature_vector(f) for f in inputs], dtype=np.float32))
+    new_emb, new_prob = candidate.predict(np.array([candidate.feature_vector(f) for f in inputs], dtype=np.float32))
+
+    if new_emb.shape[1] != old_emb.shape[1]:
+        raise ModelCheckFailed(f"embedding dimension changed from {old_emb.shape[1]} to {new_emb.shape[1]}")
+    agreed = sum(
+        1 for old, new in zip(old_prob, new_prob)
+        if active.label_cols[int(old.argmax())] == candidate.label_cols[int(new.argmax())]
+    )
+    parity = agreed / len(inputs)
+    if parity < min_parity:
+        raise ModelCheckFailed(f"top diagnosis changed on {len(inputs) - agreed}/{len(inputs)} parity inputs (parity {parity:.0%} below {min_parity:.0%})")
+
+    norms = np.linalg.norm(old_emb, axis=1) * np.linalg.norm(new_emb, axis=1)
+    cosine = np.divide((old_emb * new_emb).sum(axis=1), norms, out=np.ones(len(inputs)), where=norms > 0)
+    mean_cosine = float(cosine.mean())
+    return {
+        "against": active.version,
+        "inputs": len(inputs),
+        "top_diagnosis_parity": parity,
+        "embedding_cosine": mean_cosine,
+        "same_space": mean_cosine >= same_space_cosine,
+    }
+
+
+class ModelRegistry:
+    """
+    Serves one ModelBundle at a time and hot-swaps to a new version without
+    a restart. Candidates are loaded, warmed up and smoke-checked off the
+    request path while the current bundle keeps serving; only a bundle that
+    passes replaces it, in a single reference assignment, so a request
+    always sees one consistent model/vocab/metadata set. Once a version is
+    serving, a candidate must also pass parity_check against it. A version
+    that fails is not retried until the target changes.
+
+    Every version has an embedding space id, reported with each embedding
+    and used by the matching service to pick comparable reference vectors.
+    A version that passes parity with `same_space` inherits the serving
+    version's space, so reference cases stay searchable across the swap;
+    otherwise it starts a new space of its own. Inherited spaces are kept in
+    SPACES.json so a restart straight into that version keeps them.
+    """
+
+    def __init__(self, root: str = AI_MODEL_REGISTRY_DIR, legacy_dir: str = LEGACY_MODEL_DIR):
+        self.root = root
+        self.legacy_dir = legacy_dir
+        self.active: Optional[ModelBundle] = None
+        self.failed: Dict[str, str] = {}  # version -> reason
+        self.load_lock = threading.Lock()
+        self.legacy_version: Optional[Tuple[float, str]] = None  # (mtime, version)
+        self.stats = {"swaps": 0, "rejected": 0}
+        self.last_parity: Optional[dict] = None
+        self.spaces: Dict[str, str] = self._read_spaces()  # version -> inherited space
+        self.baseline_space: Optional[str] = None
+
+    def _read_spaces(self) -> Dict[str, str]:
+        try:
+            with open(os.path.join(self.root, SPACES_FILE), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Could not read {SPACES_FILE}: {e}")
+            return {}
+
+    def _write_spaces(self):
+        path = os.path.join(self.root, SPACES_FILE)
+        try:
+            with open(path + ".tmp", "w") as f:
+                json.dump(self.spaces, f, indent=2, sort_keys=True)
+            os.replace(path + ".tmp", path)
+        except Exception as e:
+            logger.warning(f"Could not record embedding spaces in {path}: {e}")
+
+    def _baseline_space(self) -> Optional[str]:
+        if EMBEDDING_BASELINE_SPACE:
+            return EMBEDDING_BASELINE_SPACE
+        if os.path.exists(os.path.join(self.legacy_dir, EMBEDDING_FILE)):
+            version = self._legacy_version()
+        else:
+            versions = self.versions()
+            if not versions:
+                return None
+            version = versions[0]
+        return self.spaces.get(version, version)
+
+    @property
+    def version(self) -> Optional[str]:
+        return self.active.version if self.active else None
+
+    def versions(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name for name in os.listdir(self.root)
+            if os.path.isfile(os.path.join(self.root, name, EMBEDDING_FILE))
+        )
+
+    def target(self) -> Optional[Tuple[str, str]]:
+        """(version, directory) that should be serving, or None if there is no model."""
+        current = os.path.join(self.root, "CURRENT")
+        if os.path.exists(current):
+            with open(current, "r") as f:
+                name = f.read().strip()
+            if name:
+                return name, os.path.join(self.root, name)
+        versions = self.versions()
+        if versions:
+            return versions[-1], os.path.join(self.root, versions[-1])
+        if all(os.path.exists(os.path.join(self.legacy_dir, f)) for f in (EMBEDDING_FILE, FULL_MODEL_FILE, VOCAB_FILE, METADATA_FILE)):
+            return self._legacy_version(), self.legacy_dir
+        return None
+
+    def _legacy_version(self) -> str:
+        if os.getenv("EMBEDDING_MODEL_VERSION"):
+            return os.getenv("EMBEDDING_MODEL_VERSION")
+        path = os.path.join(self.legacy_dir, EMBEDDING_FILE)
+        mtime = os.path.getmtime(path)
+        if self.legacy_version is None or self.legacy_version[0] != mtime:
+            self.legacy_version = (mtime, f"emb-{file_digest(path)}")
+        return self.legacy_version[1]
+
+    def sync(self, runtime: str = AI_MODEL_RUNTIME) -> bool:
+        """
+        Load, check and swap in the target version if it isn't serving yet.
+        True on swap. With runtime="numpy" a model that needs TensorFlow is
+        left for a later sync instead of being rejected.
+        """
+        with self.load_lock:
+            target = self.target()
+            if target is None:
+                if self.active is None:
+                    logger.warning("No model files found. Using mock embeddings.")
+                return False
+            version, path = target
+            if version == self.version or version in self.failed:
+                return False
+            logger.info(f"Loading model version {version} from {path}")
+            try:
+                bundle = ModelBundle(version, path, runtime)
+                check = smoke_check(bundle)
+                parity = parity_check(bundle, self.active) if self.active else None
+                if parity is None:
+                    bundle.space = self.spaces.get(version, bundle.space)
+                elif parity["same_space"]:
+                    bundle.space = self.active.space
+            except UnsupportedModel as e:
+                logger.info(f"Model version {version} not loaded with the {runtime} runtime: {e}")
+                return False
+            except Exception as e:
+                self.failed[version] = str(e)
+                self.stats["rejected"] += 1
+                logger.error(f"Model version {version} rejected; still serving {self.version}: {e}")
+                return False
+            if self.spaces.get(version, version) != bundle.space:
+                self.spaces[version] = bundle.space
+                self._write_spaces()
+            self.baseline_space = self._baseline_space()
+            previous, self.active = self.active, bundle
+            self.stats["swaps"] += 1
+            self.last_parity = parity
+            if parity and not parity["same_space"]:
+                logger.warning(
+                    f"Model version {version} embeds in a new space (mean cosine {parity['embedding_cosine']:.3f} "
+                    f"to {previous.version}); matching falls back to symptom overlap until reference_cases "
+                    f"are uploaded with embedding_model = '{bundle.space}'"
+                )
+            logger.info(
+                f"Serving model version {version} on {bundle.runtime} ({len(bundle.feature_cols)} features, "
+                f"{len(bundle.label_cols)} labels, {check['embedding_dim']}-d embeddings)"
+                + (f", replaced {previous.version}" if previous else "")
+            )
+            return True
+
+    def snapshot(self) -> dict:
+        return {
+            "active": self.version,
+            "embedding_space": self.active.space if self.active else None,
+            "baseline_space": self.baseline_space,
+            "runtime": self.active.runtime if self.active else None,
+            "available": self.versions(),
+            "failed": dict(self.failed),
+            "parity": self.last_parity,
+            **self.stats,
+        }
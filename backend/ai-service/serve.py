@@ -0,0 +1,74 @@
+import os
+import sys
+
+# Preload-and-fork server for the AI service.
+#
+# The parent imports main (TensorFlow, pandas, symptom dictionary, Gemini
+# clients) and loads the model bundle once; gunicorn then forks AI_WORKERS
+# uvicorn workers that share those pages copy-on-write. The shipped models
+# are plain Dense stacks, which the registry runs as numpy arrays read
+# straight from the .h5 files, so loading them starts no TensorFlow runtime
+# (which must not be running across a fork) and N workers hold one copy.
+#
+# A model that needs TensorFlow (other layer types, or
+# AI_MODEL_RUNTIME=tensorflow) can't be preloaded: each worker then loads
+# it in post_fork, before its first op, and memory grows by one model copy
+# per worker. Versions swapped in later by the registry watcher are loaded
+# by each worker as well; restart to share them again.
+#
+# Usage: python ai-service/serve.py
+
+WORKERS = int(os.getenv("AI_WORKERS", str(os.cpu_count() or 1)))
+PORT = int(os.getenv("PORT", "8080"))
+# Split the cores between workers so their pools don't oversubscribe the box.
+THREADS_PER_WORKER = max(1, (os.cpu_count() or 1) // max(1, WORKERS))
+
+# Must be set before TensorFlow / numpy are imported.
+os.environ.setdefault("TF_INTRA_OP_THREADS", str(THREADS_PER_WORKER))
+os.environ.setdefault("TF_INTER_OP_THREADS", "1" if THREADS_PER_WORKER < 4 else "2")
+for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(var, os.environ["TF_INTRA_OP_THREADS"])
+os.environ["AI_DEFER_MODEL_LOAD"] = "true"
+
+sys.path.append(os.path.dirname(__file__))
+
+from gunicorn.app.base import BaseApplication
+
+import main
+
+
+def post_fork(server, worker):
+    main.configure_tf_threads(int(os.environ["TF_INTRA_OP_THREADS"]), int(os.environ["TF_INTER_OP_THREADS"]))
+    if main.model_registry.active is None:
+        main.load_models()
+
+
+class PreloadedApplication(BaseApplication):
+    def __init__(self, app, options):
+        self.application = app
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+if __name__ == "__main__":
+    if main.AI_MODEL_RUNTIME != "tensorflow":
+        main.load_models(runtime="numpy")
+    main.logger.info(
+        f"Starting {WORKERS} AI workers on :{PORT} "
+        f"(intra-op {os.environ['TF_INTRA_OP_THREADS']}, inter-op {os.environ['TF_INTER_OP_THREADS']} threads each)"
+    )
+    PreloadedApplication(main.app, {
+        "bind": f"0.0.0.0:{PORT}",
+        "workers": WORKERS,
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        "preload_app": True,
+        "post_fork": post_fork,
+        "timeout": int(os.getenv("AI_WORKER_TIMEOUT", "120")),
+    }).run()
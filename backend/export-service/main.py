@@ -1,42 +1,184 @@
 import sys
 import os
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Literal
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.lib.units import inch
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Flowable, Paragraph, Spacer, Table, TableStyle
 from reportlab.lib.styles import getSampleStyleSheet
-from io import BytesIO
+from tempfile import SpooledTemporaryFile
 import uuid
 
 # Add parent directory to path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
+from shared.admission import AdmissionGate, client_key, request_priority
 from shared.auth import get_current_user
 from shared.supabase_client import get_supabase_client
 from shared.logger import setup_logger
 
-app = FastAPI(title="RareMatch Export Service", version="1.0.0")
+app = FastAPI(title="RareMatch Export Service", version="1.0.0", default_response_class=ORJSONResponse)
 logger = setup_logger("export-service")
 
 class ExportRequest(BaseModel):
     timeline_id: str
     include_diagnosis: bool = True
+    # "url": upload to the 'reports' bucket and return a public URL.
+    # "download": stream the PDF bytes straight back in the response.
+    delivery: Literal["url", "download"] = "url"
+    # Only used in download mode: also keep a copy in Storage.
+    store_copy: bool = False
+
+# Rows per symptom table. Each chunk is laid out on its own, so long
+# timelines never produce one giant table that reportlab has to split.
+SYMPTOM_ROWS_PER_TABLE = int(os.getenv("EXPORT_ROWS_PER_TABLE", "40"))
+# PDFs larger than this spill from memory to a temp file while rendering.
+SPOOL_MAX_BYTES = int(os.getenv("EXPORT_SPOOL_MAX_BYTES", str(2 * 1024 * 1024)))
+STREAM_CHUNK_SIZE = 64 * 1024
+# Same layout as reportlab's SimpleDocTemplate default: 1 inch margins
+# and a frame with 6pt padding.
+PAGE_MARGIN = inch + 6
+# Admission control for PDF rendering (CPU-bound, runs in the threadpool).
+EXPORT_MAX_CONCURRENCY = int(os.getenv("EXPORT_MAX_CONCURRENCY", "4"))
+EXPORT_RATE_PER_MINUTE = float(os.getenv("EXPORT_RATE_PER_MINUTE", "6"))
+EXPORT_BURST = float(os.getenv("EXPORT_BURST", "3"))
+
+export_gate = AdmissionGate("export", EXPORT_MAX_CONCURRENCY, EXPORT_RATE_PER_MINUTE, EXPORT_BURST)
+
+SYMPTOM_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black)
+])
 
 @app.get("/health")
 def health_check():
-    return {"status": "healthy", "service": "export-service"}
+    return {"status": "healthy", "service": "export-service", "admission": export_gate.snapshot()}
+
+def symptom_tables(symptoms: List[dict], rows_per_table: int = SYMPTOM_ROWS_PER_TABLE):
+    """Yield the symptom table in fixed-size chunks, each with its own header row."""
+    header = ["Symptom", "Start Date", "Severity"]
+    for start in range(0, len(symptoms), rows_per_table):
+        data = [header]
+        for s in symptoms[start:start + rows_per_table]:
+            data.append([s.get("symptom_name"), s.get("start_date"), str(s.get("severity"))])
+        t = Table(data, repeatRows=1)
+        t.setStyle(SYMPTOM_TABLE_STYLE)
+        yield t
+
+class PageFlow:
+    """
+    Lays flowables out top to bottom on a canvas, splitting them across
+    pages as needed. Each flowable is drawn as soon as it is placed and then
+    dropped, so unlike doc.build(story) only the chunk being laid out is
+    alive, not every table of the report. (Finished pages stay in the
+    canvas as compressed content streams until save().)
+    """
+
+    def __init__(self, canv: canvas.Canvas, pagesize=letter, margin: float = PAGE_MARGIN):
+        self.canv = canv
+        self.left = margin
+        self.width = pagesize[0] - 2 * margin
+        self.top = pagesize[1] - margin
+        self.bottom = margin
+        self.y = self.top
+
+    def add(self, flowable: Flowable):
+        pending = [flowable]
+        while pending:
+            f = pending.pop(0)
+            available = self.y - self.bottom
+            _, height = f.wrapOn(self.canv, self.width, available)
+            if height <= available:
+                f.drawOn(self.canv, self.left, self.y - height)
+                self.y -= height
+                continue
+            if isinstance(f, Spacer):
+                # Space at a page break is not carried over.
+                self.new_page()
+                continue
+            parts = f.split(self.width, available)
+            if len(parts) > 1:
+                pending[0:0] = parts
+            elif self.y == self.top:
+                # Taller than a page and can't be split: draw it clipped.
+                f.drawOn(self.canv, self.left, self.y - height)
+                self.y = self.bottom
+            else:
+                self.new_page()
+                pending.insert(0, f)
+
+    def new_page(self):
+        self.canv.showPage()
+        self.y = self.top
+
+
+def render_timeline_pdf(timeline: dict, out) -> None:
+    """Render the timeline report into the writable file object `out`."""
+    canv = canvas.Canvas(out, pagesize=letter, pageCompression=1)
+    flow = PageFlow(canv)
+    styles = getSampleStyleSheet()
+
+    # Title
+    flow.add(Paragraph(f"RareMatch Report: {timeline.get('title', 'Untitled')}", styles['Title']))
+    flow.add(Spacer(1, 12))
+
+    # Description
+    flow.add(Paragraph(f"Description: {timeline.get('description', '')}", styles['Normal']))
+    flow.add(Spacer(1, 12))
+
+    # Symptoms Table, one chunk at a time
+    for t in symptom_tables(timeline.get("symptoms") or []):
+        flow.add(t)
+        flow.add(Spacer(1, 6))
+
+    canv.save()
+
+def iter_file(f, chunk_size: int = STREAM_CHUNK_SIZE):
+    """Stream a file object in chunks and close it once exhausted."""
+    try:
+        f.seek(0)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
+
+def upload_report(supabase, user_id: str, pdf_bytes: bytes) -> str:
+    """Upload a rendered report to the 'reports' bucket and return its public URL."""
+    filename = f"reports/{user_id}/{uuid.uuid4()}.pdf"
+    # Note: Bucket 'reports' must exist
+    supabase.storage.from_("reports").upload(
+        path=filename,
+        file=pdf_bytes,
+        file_options={"content-type": "application/pdf"}
+    )
+    return supabase.storage.from_("reports").get_public_url(filename)
 
 @app.post("/export/pdf")
-def generate_pdf(request: ExportRequest, user: dict = Depends(get_current_user)):
-    """Generate PDF report for a timeline and upload to Supabase Storage."""
+def generate_pdf(request: ExportRequest, http_request: Request, user: dict = Depends(get_current_user)):
+    """Generate PDF report for a timeline and upload it or stream it back."""
     user_id = user.get("id")
+    with export_gate.admit(client_key(http_request, user), request_priority(http_request)):
+        return build_pdf_response(request, user_id)
+
+def build_pdf_response(request: ExportRequest, user_id: str):
+    """Fetch, render and deliver the report (runs while holding an export slot)."""
     supabase = get_supabase_client()
     
     # 1. Fetch Data
     try:
-        timeline_response = supabase.table("timelines").select("*").eq("id", request.timeline_id).single().execute()
+        timeline_response = supabase.table("timelines").select("title,description,symptoms").eq("id", request.timeline_id).single().execute()
         if not timeline_response.data:
             raise HTTPException(status_code=404, detail="Timeline not found")
         timeline = timeline_response.data
@@ -53,53 +195,41 @@ def generate_pdf(request: ExportRequest, user: dict = Depends(get_current_user))
         }
 
     # 2. Generate PDF
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    styles = getSampleStyleSheet()
-    story = []
-
-    # Title
-    story.append(Paragraph(f"RareMatch Report: {timeline.get('title', 'Untitled')}", styles['Title']))
-    story.append(Spacer(1, 12))
-    
-    # Description
-    story.append(Paragraph(f"Description: {timeline.get('description', '')}", styles['Normal']))
-    story.append(Spacer(1, 12))
-
-    # Symptoms Table
-    data = [["Symptom", "Start Date", "Severity"]]
-    for s in timeline.get("symptoms", []):
-        data.append([s.get("symptom_name"), s.get("start_date"), str(s.get("severity"))])
-
-    t = Table(data)
-    t.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    story.append(t)
-
-    doc.build(story)
-    pdf_bytes = buffer.getvalue()
-    buffer.close()
-
-    # 3. Upload to Storage
-    filename = f"reports/{user_id}/{uuid.uuid4()}.pdf"
+    out = SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
     try:
-        # Supabase Storage Upload
-        # Note: Bucket 'reports' must exist
-        supabase.storage.from_("reports").upload(
-            path=filename,
-            file=pdf_bytes,
-            file_options={"content-type": "application/pdf"}
+        render_timeline_pdf(timeline, out)
+    except Exception:
+        # Drop the partial render (and its temp file, if it spilled).
+        out.close()
+        raise
+    size = out.seek(0, os.SEEK_END)
+
+    # 3a. Direct download: stream the rendered file back
+    if request.delivery == "download":
+        if request.store_copy:
+            try:
+                out.seek(0)
+                upload_report(supabase, user_id, out.read())
+            except Exception as e:
+                logger.error(f"Error uploading PDF copy: {e}")
+        return StreamingResponse(
+            iter_file(out),
+            media_type="application/pdf",
+            headers={
+                "Content-Disposition": f'attachment; filename="rarematch-report-{request.timeline_id}.pdf"',
+                "Content-Length": str(size),
+                "Cache-Control": "no-store",
+            },
         )
-        
-        # Get Public URL
-        public_url = supabase.storage.from_("reports").get_public_url(filename)
+
+    # 3b. Upload to Storage
+    try:
+        out.seek(0)
+        pdf_bytes = out.read()
+    finally:
+        out.close()
+    try:
+        public_url = upload_report(supabase, user_id, pdf_bytes)
         return {"url": public_url}
     except Exception as e:
         logger.error(f"Error uploading PDF: {e}")
@@ -0,0 +1,99 @@
+import asyncio
+import importlib.util
+import os
+import sys
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+
+# Add parent directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.logger import setup_logger
+
+# Gateway mode: every service app mounted under its own prefix in a single
+# ASGI process (one copy of FastAPI, supabase and shared code), with
+# matching -> AI calls made in-process. The services still run standalone
+# exactly as before; this is only an alternative entry point.
+#
+# Usage: uvicorn gateway.main:app --port 8000   (from backend/)
+
+logger = setup_logger("gateway")
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), '..')
+
+# (name, directory, mount prefix)
+SERVICES = [
+    ("user", "user-service", "/user"),
+    ("timeline", "timeline-service", "/timeline"),
+    ("matching", "matching-service", "/matching"),
+    ("ai", "ai-service", "/ai"),
+    ("export", "export-service", "/export"),
+    ("notification", "notification-service", "/notification"),
+]
+# Comma-separated subset of service names to mount (default: all).
+GATEWAY_SERVICES = os.getenv("GATEWAY_SERVICES")
+
+
+def load_service(name: str, directory: str):
+    """Import a service's main.py under a unique module name (they are all 'main')."""
+    path = os.path.join(BACKEND_DIR, directory, "main.py")
+    spec = importlib.util.spec_from_file_location(f"{name}_service_main", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+enabled = set(GATEWAY_SERVICES.split(",")) if GATEWAY_SERVICES else {name for name, _, _ in SERVICES}
+services = {name: load_service(name, directory) for name, directory, _ in SERVICES if name in enabled}
+
+
+def wire_in_process_calls():
+    """Route matching's AI client straight to the AI service's handlers."""
+    matching, ai = services.get("matching"), services.get("ai")
+    if not matching or not ai:
+        return
+
+    async def embed(payload: dict) -> dict:
+        # generate_embedding is sync and CPU-bound (model inference).
+        return await asyncio.to_thread(ai.generate_embedding, ai.EmbedRequest(**payload))
+
+    matching.ai_client.bind_local("/embed", embed)
+    logger.info("Matching -> AI /embed calls run in-process")
+
+
+wire_in_process_calls()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Mounted sub-apps don't get lifespan events; run their handlers here.
+    for module in services.values():
+        await module.app.router.startup()
+    yield
+    for module in reversed(list(services.values())):
+        await module.app.router.shutdown()
+
+
+app = FastAPI(title="RareMatch Gateway", version="1.0.0", lifespan=lifespan, default_response_class=ORJSONResponse)
+
+for name, _, prefix in SERVICES:
+    if name in services:
+        app.mount(prefix, services[name].app)
+        logger.info(f"Mounted {name} service at {prefix}")
+
+
+@app.get("/health")
+def health_check():
+    return {
+        "status": "healthy",
+        "service": "gateway",
+        "mounted": {name: prefix for name, _, prefix in SERVICES if name in services},
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "8000")))
@@ -0,0 +1,198 @@
+import asyncio
+import os
+import sys
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.logger import setup_logger
+
+logger = setup_logger("ai-client")
+
+AI_SERVICE_URL = os.getenv("AI_SERVICE_URL", "http://127.0.0.1:8004")
+# Total time a request may spend waiting on the AI service, hedges included.
+AI_EMBED_BUDGET_SECONDS = float(os.getenv("AI_EMBED_BUDGET_SECONDS", "2.0"))
+# Send a second, identical /embed call if the first has not answered by
+# then (0 disables hedging). Set it around the p95 latency of /embed.
+AI_HEDGE_AFTER_SECONDS = float(os.getenv("AI_HEDGE_AFTER_SECONDS", "0"))
+AI_BREAKER_FAILURES = int(os.getenv("AI_BREAKER_FAILURES", "5"))
+AI_BREAKER_RESET_SECONDS = float(os.getenv("AI_BREAKER_RESET_SECONDS", "30"))
+
+
+class AIServiceUnavailable(Exception):
+    pass
+
+
+class AIRequestRejected(AIServiceUnavailable):
+    """The AI service answered 4xx: the request was bad, the service is up."""
+    pass
+
+
+def as_unavailable(error: Exception) -> AIServiceUnavailable:
+    """The AIServiceUnavailable (AIRequestRejected for 4xx) to raise for a failed call."""
+    if isinstance(error, AIServiceUnavailable):
+        return error
+    if isinstance(error, asyncio.TimeoutError):
+        return AIServiceUnavailable("latency budget exceeded")
+    # In-process handlers (gateway mode) raise HTTPException.
+    status = getattr(error, "status_code", None)
+    if status is not None and 400 <= status < 500:
+        return AIRequestRejected(f"{status}: {getattr(error, 'detail', error)}")
+    return AIServiceUnavailable(str(error) or type(error).__name__)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures; while open every
+    call fails immediately. After `reset_timeout` one probe call is let
+    through (half-open): success closes the breaker, failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int = AI_BREAKER_FAILURES, reset_timeout: float = AI_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning(f"AI service circuit opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def end_call(self):
+        """A call ended without a verdict (e.g. cancelled): let the next one probe."""
+        self.probing = False
+
+
+class AIClient:
+    """
+    Deadline-bounded client for the AI service. Every call fits in one
+    latency budget, optionally hedged with a second request, and is gated
+    by a circuit breaker so an outage costs callers microseconds instead of
+    a full timeout each.
+    """
+
+    def __init__(
+        self,
+        base_url: str = AI_SERVICE_URL,
+        budget: float = AI_EMBED_BUDGET_SECONDS,
+        hedge_after: float = AI_HEDGE_AFTER_SECONDS,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.base_url = base_url
+        self.budget = budget
+        self.hedge_after = hedge_after
+        self.breaker = breaker or CircuitBreaker()
+        self.client: Optional[httpx.AsyncClient] = None
+        # path -> in-process handler (gateway mode): no HTTP hop, no JSON.
+        self.local: Dict[str, Callable[[dict], Awaitable[dict]]] = {}
+        self.stats = {"calls": 0, "failures": 0, "rejected": 0, "hedged": 0}
+
+    def _client(self) -> httpx.AsyncClient:
+        if self.client is None:
+            self.client = httpx.AsyncClient(base_url=self.base_url, timeout=self.budget)
+        return self.client
+
+    def bind_local(self, path: str, handler: Callable[[dict], Awaitable[dict]]):
+        """Serve `path` by calling `handler(payload)` in-process instead of over HTTP."""
+        self.local[path] = handler
+
+    async def _post(self, path: str, payload: dict) -> dict:
+        handler = self.local.get(path)
+        if handler is not None:
+            return await handler(payload)
+        response = await self._client().post(path, json=payload)
+        if response.status_code != 200:
+            error = AIRequestRejected if 400 <= response.status_code < 500 else AIServiceUnavailable
+            raise error(f"{path} returned {response.status_code}: {response.text[:200]}")
+        return response.json()
+
+    async def _hedged(self, path: str, payload: dict) -> dict:
+        first = asyncio.create_task(self._post(path, payload))
+        tasks = {first}
+        try:
+            if self.hedge_after and path not in self.local:
+                done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+                if not done:
+                    self.stats["hedged"] += 1
+                    tasks.add(asyncio.create_task(self._post(path, payload)))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def post(self, path: str, payload: dict, budget: Optional[float] = None) -> dict:
+        """
+        POST within the latency budget; raises AIServiceUnavailable on any
+        failure (AIRequestRejected for 4xx). Timeouts, connection errors
+        and 5xx count against the breaker; a 4xx does not: it shows the
+        service is up, and a bad request must not cut everyone else off.
+        """
+        if not self.breaker.allow():
+            self.stats["rejected"] += 1
+            raise AIServiceUnavailable("circuit open")
+        probe = self.breaker.probing
+        self.stats["calls"] += 1
+        try:
+            result = await asyncio.wait_for(self._hedged(path, payload), timeout=budget or self.budget)
+        except Exception as e:
+            self.stats["failures"] += 1
+            error = as_unavailable(e)
+            if isinstance(error, AIRequestRejected):
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+            if error is e:
+                raise
+            raise error from e
+        finally:
+            # Cancellation (client gone, losing hedge) is neither outcome;
+            # a half-open probe must not stay taken forever.
+            if probe:
+                self.breaker.end_call()
+        self.breaker.record_success()
+        return result
+
+    async def embed(self, payload: dict, budget: Optional[float] = None) -> dict:
+        return await self.post("/embed", payload, budget)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
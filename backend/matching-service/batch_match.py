@@ -0,0 +1,252 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from typing import List, Optional, Tuple
+
+# One BLAS thread per process: parallelism comes from the worker pool, and
+# per-process thread pools would oversubscribe the cores. Must be set before
+# numpy is imported.
+for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(var, "1")
+
+import numpy as np
+import orjson
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.dirname(__file__))
+
+from shared.symptoms import get_symptom_dictionary, idf_weights
+from evaluate_retrieval import current_space, load_dataset
+
+# Offline all-pairs matching: top-k reference cases for every timeline (or
+# every reference case, e.g. duplicate-patient detection) in one pass.
+#
+# Similarity is computed block by block: a block of queries against a block
+# of reference rows is one matrix multiply for cosine similarity and one for
+# the weighted-Jaccard intersection, and a running top-k per query is kept
+# across reference blocks. Query blocks are spread over a process pool, so
+# memory per worker is bounded by the block sizes (plus one copy of the
+# reference matrices, shared copy-on-write after fork) and throughput
+# scales with cores. Results are streamed to a JSON-lines file as blocks
+# finish.
+#
+# Reference cases and timelines are restricted to one embedding space
+# (--space, else the AI service's active one via --ai-url); see
+# load_dataset() in evaluate_retrieval.py.
+#
+# Usage:
+#   python matching-service/batch_match.py --cache /tmp/reference_cases.npz --output dupes.jsonl
+#   python matching-service/batch_match.py --queries timelines --k 20 --workers 8 --output cohort.jsonl
+
+# Same scoring as score_candidates() in main.py (feedback boost excluded)
+# and the same vector pre-filter as the match_reference_cases RPC.
+VECTOR_WEIGHT = 0.6
+MATCH_THRESHOLD = 0.1
+
+
+def unit_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def membership(symptom_ids: List[List[int]], size: int) -> np.ndarray:
+    matrix = np.zeros((len(symptom_ids), size), dtype=np.float32)
+    for row, ids in enumerate(symptom_ids):
+        matrix[row, [i for i in ids if 0 <= i < size]] = 1.0
+    return matrix
+
+
+def fetch_timelines(dim: int, space: Optional[str] = None, page_size: int = 1000) -> dict:
+    """Timelines with a stored embedding of the reference dimension (and space, when given)."""
+    from shared.supabase_client import get_supabase_client
+    supabase = get_supabase_client()
+    dictionary = get_symptom_dictionary()
+    ids, vectors, symptom_ids = [], [], []
+    last_id = None
+    while True:
+        query = supabase.table("timelines").select("id,symptoms,embedding,embedding_model").not_.is_("embedding", "null")
+        if last_id:
+            query = query.gt("id", last_id)
+        rows = query.order("id").limit(page_size).execute().data or []
+        for row in rows:
+            vector = row.get("embedding")
+            if isinstance(vector, str):
+                vector = json.loads(vector)
+            if not vector or len(vector) != dim:
+                continue
+            if space and row.get("embedding_model") != space:
+                continue
+            ids.append(row["id"])
+            vectors.append(vector)
+            symptom_ids.append(dictionary.ids([s["symptom_name"] for s in row.get("symptoms") or []]))
+        if len(rows) < page_size:
+            break
+        last_id = rows[-1]["id"]
+        print(f"Fetched {len(ids)} timelines...")
+    return {"ids": np.array(ids), "embeddings": np.array(vectors, dtype=np.float32), "symptom_ids": symptom_ids}
+
+
+# Worker state, set once per process by init_worker (inherited on fork).
+_state: dict = {}
+
+
+def init_worker(query_unit, query_members, ref_unit, ref_members, weights, k, ref_block, self_join):
+    _state.update(
+        query_unit=query_unit,
+        query_weighted=query_members * weights,
+        ref_unit=ref_unit,
+        ref_members=ref_members,
+        ref_weight=ref_members @ weights,
+        k=k,
+        ref_block=ref_block,
+        self_join=self_join,
+    )
+
+
+def match_block(bounds: Tuple[int, int]):
+    """Top-k (reference rows, hybrid, vector, jaccard) for query rows [start, stop)."""
+    start, stop = bounds
+    s = _state
+    q_unit = s["query_unit"][start:stop]
+    q_weighted = s["query_weighted"][start:stop]
+    q_weight = q_weighted.sum(axis=1)
+    n, k = len(s["ref_unit"]), s["k"]
+    rows = np.arange(start, stop)
+
+    best_score = np.full((len(rows), 0), -np.inf, dtype=np.float32)
+    best_ref = np.zeros((len(rows), 0), dtype=np.int64)
+    for ref_start in range(0, n, s["ref_block"]):
+        ref_stop = min(n, ref_start + s["ref_block"])
+        vector = q_unit @ s["ref_unit"][ref_start:ref_stop].T
+        inter = q_weighted @ s["ref_members"][ref_start:ref_stop].T
+        union = q_weight[:, None] + s["ref_weight"][None, ref_start:ref_stop] - inter
+        jaccard = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+        score = VECTOR_WEIGHT * vector + (1 - VECTOR_WEIGHT) * jaccard
+        score[vector <= MATCH_THRESHOLD] = -np.inf
+        if s["self_join"]:
+            own = rows[(rows >= ref_start) & (rows < ref_stop)]
+            score[own - start, own - ref_start] = -np.inf
+
+        # Merge this block's candidates into the running top-k.
+        take = min(k, ref_stop - ref_start)
+        top = np.argpartition(-score, take - 1, axis=1)[:, :take]
+        merged_score = np.concatenate([best_score, np.take_along_axis(score, top, axis=1)], axis=1)
+        merged_ref = np.concatenate([best_ref, top + ref_start], axis=1)
+        keep = np.argsort(-merged_score, axis=1, kind="stable")[:, :k]
+        best_score = np.take_along_axis(merged_score, keep, axis=1)
+        best_ref = np.take_along_axis(merged_ref, keep, axis=1)
+
+    # Score components of the kept matches, for the output.
+    valid = np.isfinite(best_score)
+    refs = np.where(valid, best_ref, 0)
+    vector = np.einsum("bkd,bd->bk", s["ref_unit"][refs], q_unit)
+    inter = np.einsum("bks,bs->bk", s["ref_members"][refs], q_weighted)
+    union = q_weight[:, None] + s["ref_weight"][refs] - inter
+    jaccard = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+    results = [
+        [
+            (int(refs[i, j]), float(best_score[i, j]), float(vector[i, j]), float(jaccard[i, j]))
+            for j in range(best_score.shape[1]) if valid[i, j]
+        ]
+        for i in range(len(rows))
+    ]
+    return start, results
+
+
+def run(queries: dict, reference: dict, k: int, block: int, ref_block: int, workers: int, output: str, self_join: bool) -> int:
+    size = len(get_symptom_dictionary())
+    weights = np.array(idf_weights(size, reference["symptom_ids"], reference.get("multiplicity")), dtype=np.float32)
+    ref_unit = unit_rows(reference["embeddings"])
+    ref_members = membership(reference["symptom_ids"], size)
+    if self_join:
+        query_unit, query_members = ref_unit, ref_members
+    else:
+        query_unit, query_members = unit_rows(queries["embeddings"]), membership(queries["symptom_ids"], size)
+
+    total = len(query_unit)
+    blocks = [(start, min(total, start + block)) for start in range(0, total, block)]
+    init_args = (query_unit, query_members, ref_unit, ref_members, weights, k, ref_block, self_join)
+    labels = reference.get("labels")
+    multiplicity = reference.get("multiplicity")
+
+    def write(out, start, results):
+        for offset, hits in enumerate(results):
+            out.write(orjson.dumps({
+                "query_id": str(queries["ids"][start + offset]),
+                "matches": [
+                    {
+                        "match_id": str(reference["ids"][r]),
+                        "similarity": score,
+                        "vector_similarity": vector,
+                        "symptom_similarity": jaccard,
+                        "diagnosis": str(labels[r]) if labels is not None else None,
+                        "multiplicity": int(multiplicity[r]) if multiplicity is not None else 1,
+                    }
+                    for r, score, vector, jaccard in hits
+                ],
+            }))
+            out.write(b"\n")
+
+    written = 0
+    started = time.perf_counter()
+    with open(output, "wb") as out:
+        if workers <= 1:
+            init_worker(*init_args)
+            results = map(match_block, blocks)
+        else:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork" if "fork" in methods else None)
+            pool = context.Pool(workers, initializer=init_worker, initargs=init_args)
+            results = pool.imap(match_block, blocks)
+        try:
+            for start, block_results in results:
+                write(out, start, block_results)
+                written += len(block_results)
+                elapsed = time.perf_counter() - started
+                print(f"  {written}/{total} queries ({written / max(elapsed, 1e-9):.0f}/s)", end="\r")
+        finally:
+            if workers > 1:
+                pool.close()
+                pool.join()
+    print()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline all-pairs top-k matching against the reference set")
+    parser.add_argument("--queries", choices=["reference", "timelines"], default="reference",
+                        help="match every reference case (excluding itself) or every timeline with an embedding")
+    parser.add_argument("--cache", help="npz snapshot of reference_cases (fetched from Supabase if missing)")
+    parser.add_argument("--k", type=int, default=10, help="matches kept per query")
+    parser.add_argument("--block", type=int, default=256, help="query rows per task")
+    parser.add_argument("--ref-block", type=int, default=8192, help="reference rows per matrix multiply")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", default="batch_matches.jsonl", help="JSON lines: one query and its matches per line")
+    parser.add_argument("--space", help="embedding space to match in (default: the AI service's active one)")
+    parser.add_argument("--baseline-space", default=os.getenv("EMBEDDING_BASELINE_SPACE"),
+                        help="space of untagged reference rows (default: the AI service's)")
+    parser.add_argument("--ai-url", help="AI service to ask for the active embedding space")
+    args = parser.parse_args()
+
+    space, baseline = args.space, args.baseline_space
+    if args.ai_url and not space:
+        space, baseline = current_space(args.ai_url)
+    reference = load_dataset(args.cache, space, baseline)
+    if not space:
+        # A single space in the data (checked by load_dataset); untagged rows name none.
+        space = next(iter(set(reference["embedding_model"])), None) or None
+    self_join = args.queries == "reference"
+    queries = reference if self_join else fetch_timelines(reference["embeddings"].shape[1], space)
+    print(f"Matching {len(queries['ids'])} {args.queries} against {len(reference['ids'])} reference cases "
+          f"(k={args.k}, {args.workers} workers, blocks {args.block}x{args.ref_block})")
+    started = time.perf_counter()
+    written = run(queries, reference, args.k, args.block, args.ref_block, args.workers, args.output, self_join)
+    print(f"Wrote top-{args.k} matches for {written} queries to {args.output} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.dirname(__file__))
+
+from shared.symptoms import get_symptom_dictionary, idf_weights
+from vector_index import VectorIndex, hnswlib, normalize
+from reference_index import PartitionedReferenceIndex, partitions_to_probe
+
+# Offline retrieval evaluation over labeled reference_cases.
+#
+# Every sampled case is used as a leave-one-out query (its own embedding and
+# symptom set). The ground truth is an exact brute-force hybrid ranking over
+# all other cases; each configuration (candidate search x over-fetch factor,
+# i.e. match_count = limit * factor) is scored on recall@k against it, on
+# diagnosis hit rate and on per-query latency.
+#
+# Usage:
+#   python matching-service/evaluate_retrieval.py --cache /tmp/reference_cases.npz
+#   python matching-service/evaluate_retrieval.py --cache ... --ai-url http://127.0.0.1:8004 --output report.json
+#
+# Without --ai-url the partitioned configurations use a nearest-centroid
+# stand-in for the AI service's diagnosis probabilities.
+#
+# Only reference cases embedded in one embedding space are compared, as in
+# the matching service: --space, else the AI service's active space
+# (--ai-url), else the single space present in the data. Untagged rows
+# belong to the baseline space.
+
+# Same weights as score_candidates() in main.py (feedback boost excluded).
+VECTOR_WEIGHT = 0.6
+MATCH_THRESHOLD = 0.1
+
+
+def reference_models(space: Optional[str], baseline: Optional[str]) -> List[str]:
+    """embedding_model tags comparable with `space` ("" stands for untagged rows), as in main.py."""
+    return [space, ""] if space == baseline else [space]
+
+
+def current_space(ai_url: str) -> Tuple[Optional[str], Optional[str]]:
+    """(embedding space, baseline space) of the AI service's active model."""
+    import httpx
+    status = httpx.get(f"{ai_url.rstrip('/')}/models", timeout=30).json()
+    return status.get("embedding_space") or status.get("active"), status.get("baseline_space")
+
+
+def fetch_reference_cases(models: Optional[List[str]] = None, page_size: int = 1000) -> dict:
+    from shared.supabase_client import get_supabase_client
+    supabase = get_supabase_client()
+    ids, labels, vectors, symptom_ids, multiplicity, tags = [], [], [], [], [], []
+    last_id = None
+    while True:
+        query = supabase.table("reference_cases").select("id,diagnosis_label,symptoms,symptom_ids,multiplicity,embedding_model,embedding")
+        if last_id:
+            query = query.gt("id", last_id)
+        rows = query.order("id").limit(page_size).execute().data or []
+        for row in rows:
+            vector = row.get("embedding")
+            if isinstance(vector, str):
+                vector = json.loads(vector)
+            tag = row.get("embedding_model") or ""
+            if not vector or (models is not None and tag not in models):
+                continue
+            ids.append(row["id"])
+            labels.append(row.get("diagnosis_label") or "Unknown")
+            vectors.append(vector)
+            symptom_ids.append(row.get("symptom_ids") or get_symptom_dictionary().ids(row.get("symptoms") or []))
+            multiplicity.append(row.get("multiplicity") or 1)
+            tags.append(tag)
+        if len(rows) < page_size:
+            break
+        last_id = rows[-1]["id"]
+        print(f"Fetched {len(ids)} reference cases...")
+    return {
+        "ids": np.array(ids),
+        "labels": np.array(labels),
+        "embeddings": np.array(vectors, dtype=np.float32),
+        "symptom_ids": np.array([json.dumps(s) for s in symptom_ids]),
+        "multiplicity": np.array(multiplicity, dtype=np.int32),
+        "embedding_model": np.array(tags, dtype=str),
+    }
+
+
+def load_dataset(cache: Optional[str], space: Optional[str] = None, baseline: Optional[str] = None) -> dict:
+    """
+    Reference cases embedded in `space` (plus untagged rows when it is the
+    baseline space). Without a space the data must hold a single one.
+    """
+    models = reference_models(space, baseline) if space else None
+    if cache and os.path.exists(cache):
+        data = dict(np.load(cache))
+        print(f"Loaded {len(data['ids'])} reference cases from {cache}")
+    else:
+        data = fetch_reference_cases(models)
+        if cache:
+            np.savez_compressed(cache, **data)
+            print(f"Saved {len(data['ids'])} reference cases to {cache}")
+    if "embedding_model" not in data:  # snapshots taken before embedding spaces
+        data["embedding_model"] = np.full(len(data["ids"]), "", dtype=str)
+    if models is None:
+        spaces = set(data["embedding_model"])
+        if len(spaces) > 1:
+            raise SystemExit(f"reference_cases span embedding spaces {sorted(spaces)}; pass --space or --ai-url")
+    else:
+        keep = np.isin(data["embedding_model"], models)
+        if not keep.all():
+            data = {key: value[keep] for key, value in data.items()}
+            print(f"Kept {len(data['ids'])} reference cases embedded in space {space}")
+    data["symptom_ids"] = [json.loads(s) for s in data["symptom_ids"]]
+    if "multiplicity" not in data:  # snapshots taken before prototypes
+        data["multiplicity"] = np.ones(len(data["ids"]), dtype=np.int32)
+    return data
+
+
+class HybridScorer:
+    """Vectorized hybrid score of one query against any subset of cases."""
+
+    def __init__(self, data: dict):
+        size = len(get_symptom_dictionary())
+        self.weights = np.array(idf_weights(size, data["symptom_ids"], data.get("multiplicity")), dtype=np.float32)
+        self.unit = np.stack([normalize(v) for v in data["embeddings"]])
+        self.membership = np.zeros((len(data["ids"]), size), dtype=np.float32)
+        for row, ids in enumerate(data["symptom_ids"]):
+            self.membership[row, ids] = 1.0
+        self.row_weight = self.membership @ self.weights
+
+    def jaccard(self, query_row: int, rows: np.ndarray) -> np.ndarray:
+        q = self.membership[query_row] * self.weights
+        inter = self.membership[rows] @ q
+        union = self.row_weight[rows] + q.sum() - inter
+        return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+    def scores(self, query_row: int, rows: np.ndarray, vector_sims: Optional[np.ndarray] = None) -> np.ndarray:
+        if vector_sims is None:
+            vector_sims = self.unit[rows] @ self.unit[query_row]
+        return VECTOR_WEIGHT * vector_sims + (1 - VECTOR_WEIGHT) * self.jaccard(query_row, rows)
+
+
+def top_k(rows: np.ndarray, scores: np.ndarray, k: int) -> np.ndarray:
+    order = np.argsort(-scores, kind="stable")[:k]
+    return rows[order]
+
+
+def ground_truth(scorer: HybridScorer, query_row: int, k: int) -> np.ndarray:
+    rows = np.delete(np.arange(len(scorer.unit)), query_row)
+    return top_k(rows, scorer.scores(query_row, rows), k)
+
+
+def centroid_predictor(data: dict, top: int = 5) -> Callable[[int], List[dict]]:
+    """Stand-in for the AI service's top-5 diagnoses: softmax over label centroids."""
+    labels = sorted(set(data["labels"]))
+    unit = np.stack([normalize(v) for v in data["embeddings"]])
+    centroids = np.stack([normalize(unit[data["labels"] == label].mean(axis=0)) for label in labels])
+
+    def predict(row: int) -> List[dict]:
+        logits = (centroids @ unit[row]) * 20
+        probs = np.exp(logits - logits.max())
+        probs /= probs.sum()
+        best = np.argsort(-probs)[:top]
+        return [{"disease": labels[i], "probability": float(probs[i])} for i in best]
+    return predict
+
+
+def ai_predictor(data: dict, ai_url: str) -> Callable[[int], List[dict]]:
+    import httpx
+    client = httpx.Client(base_url=ai_url, timeout=30)
+
+    def predict(row: int) -> List[dict]:
+        response = client.post("/embed", json={"text": "", "symptom_ids": data["symptom_ids"][row]})
+        return response.json().get("probabilities") or []
+    return predict
+
+
+def build_searchers(data: dict, predictor) -> Dict[str, Callable]:
+    """name -> search(query_row, match_count) returning (rows, vector similarities)."""
+    dim = data["embeddings"].shape[1]
+    row_of = {case_id: row for row, case_id in enumerate(data["ids"])}
+    indexes = {"exact": VectorIndex(dim, capacity=len(data["ids"]))}
+    if hnswlib is not None:
+        from vector_index import HnswVectorIndex
+        indexes["hnsw"] = HnswVectorIndex(dim, capacity=len(data["ids"]))
+    partitioned = PartitionedReferenceIndex(dim)
+    for row, case_id in enumerate(data["ids"]):
+        for index in indexes.values():
+            index.upsert(case_id, data["embeddings"][row])
+        partitioned.upsert(case_id, data["labels"][row], data["embeddings"][row], None)
+
+    def flat(index):
+        def search(query_row: int, count: int):
+            hits = index.search(data["embeddings"][query_row], count, MATCH_THRESHOLD, exclude={data["ids"][query_row]})
+            return np.array([row_of[key] for key, _, _ in hits], dtype=int), np.array([s for _, s, _ in hits])
+        return search
+
+    def by_diagnosis(query_row: int, count: int):
+        query = data["embeddings"][query_row]
+        labels = partitions_to_probe(predictor(query_row))
+        # One extra slot: the query itself is in its own partition.
+        hits = partitioned.search(query, count + 1, MATCH_THRESHOLD, labels)
+        if labels is not None and len(hits) <= count:
+            hits = partitioned.search(query, count + 1, MATCH_THRESHOLD)
+        hits = [hit for hit in hits if hit[0] != data["ids"][query_row]][:count]
+        return np.array([row_of[key] for key, _, _ in hits], dtype=int), np.array([s for _, s, _ in hits])
+
+    searchers = {name: flat(index) for name, index in indexes.items()}
+    searchers["partitioned"] = by_diagnosis
+    return searchers
+
+
+def evaluate(data: dict, queries: np.ndarray, k: int, overfetch: List[int], predictor) -> List[dict]:
+    scorer = HybridScorer(data)
+    truths = {q: ground_truth(scorer, q, k) for q in queries}
+    # Diagnosis probabilities come with the embedding in the service (one
+    # /embed call), so they are not part of the search latency measured here.
+    predictions = {q: predictor(q) for q in queries}
+    searchers = build_searchers(data, predictions.__getitem__)
+    report = []
+    for name, search in searchers.items():
+        for factor in overfetch:
+            recalls, hits, latencies = [], [], []
+            for q in queries:
+                started = time.perf_counter()
+                rows, sims = search(q, k * factor)
+                result = top_k(rows, scorer.scores(q, rows, sims), k) if len(rows) else rows
+                latencies.append((time.perf_counter() - started) * 1000)
+                recalls.append(len(set(result) & set(truths[q])) / k)
+                hits.append(bool(len(result)) and bool((data["labels"][result] == data["labels"][q]).any()))
+            report.append({
+                "search": name,
+                "overfetch": factor,
+                "match_count": k * factor,
+                f"recall@{k}": float(np.mean(recalls)),
+                f"diagnosis_hit@{k}": float(np.mean(hits)),
+                "latency_ms_p50": float(np.percentile(latencies, 50)),
+                "latency_ms_p95": float(np.percentile(latencies, 95)),
+                "latency_ms_mean": float(np.mean(latencies)),
+            })
+            print(f"  {name:<12} x{factor:<3} recall@{k}={report[-1][f'recall@{k}']:.3f} "
+                  f"hit@{k}={report[-1][f'diagnosis_hit@{k}']:.3f} p50={report[-1]['latency_ms_p50']:.2f}ms")
+    return report
+
+
+def print_report(report: List[dict], k: int):
+    header = f"{'search':<12} {'match_count':>11} {'recall@' + str(k):>10} {'hit@' + str(k):>8} {'p50 ms':>8} {'p95 ms':>8}"
+    print("\n" + header)
+    print("-" * len(header))
+    for r in sorted(report, key=lambda r: (r["search"], r["overfetch"])):
+        print(f"{r['search']:<12} {r['match_count']:>11} {r[f'recall@{k}']:>10.3f} {r[f'diagnosis_hit@{k}']:>8.3f} "
+              f"{r['latency_ms_p50']:>8.2f} {r['latency_ms_p95']:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline recall / latency evaluation of reference-case search")
+    parser.add_argument("--cache", help="npz snapshot of reference_cases (fetched from Supabase if missing)")
+    parser.add_argument("--queries", type=int, default=200, help="leave-one-out queries to sample")
+    parser.add_argument("--k", type=int, default=10, help="result limit per query")
+    parser.add_argument("--overfetch", default="1,3,5", help="match_count = k * factor, comma-separated")
+    parser.add_argument("--ai-url", help="AI service for diagnosis probabilities (default: centroid stand-in)")
+    parser.add_argument("--space", help="embedding space to evaluate (default: the AI service's active one)")
+    parser.add_argument("--baseline-space", default=os.getenv("EMBEDDING_BASELINE_SPACE"),
+                        help="space of untagged reference rows (default: the AI service's)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args()
+
+    space, baseline = args.space, args.baseline_space
+    if args.ai_url and not space:
+        space, baseline = current_space(args.ai_url)
+    data = load_dataset(args.cache, space, baseline)
+    rng = np.random.default_rng(args.seed)
+    queries = rng.choice(len(data["ids"]), size=min(args.queries, len(data["ids"])), replace=False)
+    predictor = ai_predictor(data, args.ai_url) if args.ai_url else centroid_predictor(data)
+    overfetch = [int(f) for f in args.overfetch.split(",")]
+
+    print(f"Evaluating {len(queries)} queries over {len(data['ids'])} cases "
+          f"({len(set(data['labels']))} diagnoses, probabilities from {'AI service' if args.ai_url else 'centroids'})")
+    report = evaluate(data, queries, args.k, overfetch, predictor)
+    print_report(report, args.k)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"queries": len(queries), "cases": len(data["ids"]), "k": args.k, "results": report}, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
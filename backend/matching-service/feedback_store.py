@@ -0,0 +1,248 @@
+import asyncio
+import os
+import sys
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.logger import setup_logger
+
+logger = setup_logger("feedback-store")
+
+FEEDBACK_FLUSH_SIZE = int(os.getenv("FEEDBACK_FLUSH_SIZE", "200"))
+FEEDBACK_FLUSH_SECONDS = float(os.getenv("FEEDBACK_FLUSH_SECONDS", "2"))
+FEEDBACK_MAX_BUFFER = int(os.getenv("FEEDBACK_MAX_BUFFER", "20000"))
+FEEDBACK_PERSIST_SECONDS = float(os.getenv("FEEDBACK_PERSIST_SECONDS", "60"))
+# How often the aggregates are reloaded, picking up other replicas' votes.
+FEEDBACK_REFRESH_SECONDS = float(os.getenv("FEEDBACK_REFRESH_SECONDS", "300"))
+FEEDBACK_PAGE_SIZE = 1000
+# Boost = weight * (helpful - unhelpful) / (total + prior); the prior damps
+# the boost until a pair has collected a few votes.
+FEEDBACK_BOOST_WEIGHT = float(os.getenv("FEEDBACK_BOOST_WEIGHT", "0.1"))
+FEEDBACK_BOOST_PRIOR = float(os.getenv("FEEDBACK_BOOST_PRIOR", "5"))
+FINGERPRINT_CACHE_SIZE = 50000
+
+# (reference case id, symptom-set fingerprint)
+AggregateKey = Tuple[str, str]
+
+
+class FeedbackStore:
+    """
+    Write-behind buffer for match feedback plus materialized helpfulness
+    aggregates per (reference case, symptom-set fingerprint).
+
+    record() only appends to memory. A background loop flushes the buffer
+    to 'match_feedback' in one batched upsert (one vote per user, timeline
+    and match: a repeated vote replaces the earlier one) whenever it reaches
+    FEEDBACK_FLUSH_SIZE or FEEDBACK_FLUSH_SECONDS pass, and periodically
+    adds the aggregate deltas to 'match_feedback_aggregates', and every
+    FEEDBACK_REFRESH_SECONDS reloads the stored aggregates so votes taken by
+    other replicas count here too. boost() is a single dict lookup for the
+    ranking path.
+    """
+
+    def __init__(self, supabase_factory: Callable):
+        self.supabase_factory = supabase_factory
+        self.buffer: List[dict] = []
+        self.aggregates: Dict[AggregateKey, List[int]] = {}  # key -> [helpful, total]
+        self.deltas: Dict[AggregateKey, List[int]] = {}
+        self.fingerprints: "OrderedDict[str, str]" = OrderedDict()  # timeline_id -> fingerprint
+        self.stats = {"recorded": 0, "flushed": 0, "dropped": 0, "flush_errors": 0, "refresh_errors": 0}
+        self._flush_now: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    # --- Ranking path -----------------------------------------------------
+
+    def remember_fingerprint(self, timeline_id: str, fingerprint: str):
+        self.fingerprints[timeline_id] = fingerprint
+        self.fingerprints.move_to_end(timeline_id)
+        if len(self.fingerprints) > FINGERPRINT_CACHE_SIZE:
+            self.fingerprints.popitem(last=False)
+
+    def boost(self, match_id: str, fingerprint: Optional[str]) -> float:
+        if not fingerprint:
+            return 0.0
+        counts = self.aggregates.get((match_id, fingerprint))
+        if not counts:
+            return 0.0
+        helpful, total = counts
+        return FEEDBACK_BOOST_WEIGHT * (2 * helpful - total) / (total + FEEDBACK_BOOST_PRIOR)
+
+    # --- Ingestion --------------------------------------------------------
+
+    def record(self, user_id: str, timeline_id: str, match_id: str, is_helpful: bool):
+        if len(self.buffer) >= FEEDBACK_MAX_BUFFER:
+            self.stats["dropped"] += 1
+            logger.warning("Feedback buffer full; dropping feedback")
+            return
+        self.buffer.append({
+            "user_id": user_id,
+            "timeline_id": timeline_id,
+            "match_id": match_id,
+            "is_helpful": is_helpful,
+        })
+        self.stats["recorded"] += 1
+        if len(self.buffer) >= FEEDBACK_FLUSH_SIZE and self._flush_now:
+            self._flush_now.set()
+
+    def _apply(self, votes: List[dict], fingerprints: Dict[str, str]):
+        """
+        Fold recorded votes into the aggregates. A user's first vote counts
+        once; a changed vote only moves the helpful count and a repeated
+        one changes nothing.
+        """
+        for vote in votes:
+            fingerprint = fingerprints.get(vote["timeline_id"])
+            if not fingerprint:
+                continue
+            if vote.get("previous") is None:
+                helpful, total = int(vote["is_helpful"]), 1
+            else:
+                helpful, total = int(vote["is_helpful"]) - int(vote["previous"]), 0
+            if not helpful and not total:
+                continue
+            key = (vote["match_id"], fingerprint)
+            for table in (self.aggregates, self.deltas):
+                counts = table.setdefault(key, [0, 0])
+                counts[0] += helpful
+                counts[1] += total
+
+    def _resolve_fingerprints(self, supabase, timeline_ids: List[str]) -> Dict[str, str]:
+        known = {tid: self.fingerprints[tid] for tid in timeline_ids if tid in self.fingerprints}
+        missing = [tid for tid in timeline_ids if tid not in known]
+        if missing:
+            try:
+                rows = supabase.table("timelines").select("id,embedding_fingerprint").in_("id", missing).execute().data or []
+            except Exception as e:
+                logger.warning(f"Could not resolve symptom fingerprints for feedback: {e}")
+                rows = []
+            for row in rows:
+                if row.get("embedding_fingerprint"):
+                    known[row["id"]] = row["embedding_fingerprint"]
+        return known
+
+    def _write(self, rows: List[dict]) -> Optional[Tuple[List[dict], Dict[str, str]]]:
+        """
+        Batch upsert (worker thread). Returns the recorded votes, each with
+        the vote it replaced, and their fingerprints; None on failure.
+        """
+        supabase = self.supabase_factory()
+        try:
+            votes = supabase.rpc("record_match_feedback", {"votes": rows}).execute().data or []
+        except Exception as e:
+            logger.error(f"Failed to flush {len(rows)} feedback rows: {e}")
+            return None
+        return votes, self._resolve_fingerprints(supabase, list({v["timeline_id"] for v in votes}))
+
+    async def flush(self):
+        """Upsert buffered feedback in one batch and fold it into the aggregates."""
+        if not self.buffer:
+            return
+        rows, self.buffer = self.buffer, []
+        written = await asyncio.to_thread(self._write, rows)
+        if written is None:
+            self.stats["flush_errors"] += 1
+            # Put them back (ahead of newer rows) for the next flush.
+            self.buffer = (rows + self.buffer)[-FEEDBACK_MAX_BUFFER:]
+            return
+        votes, fingerprints = written
+        self.stats["flushed"] += len(rows)
+        for tid, fingerprint in fingerprints.items():
+            self.remember_fingerprint(tid, fingerprint)
+        self._apply(votes, fingerprints)
+
+    def load_aggregates(self) -> Optional[Dict[AggregateKey, List[int]]]:
+        """Stored aggregates of all replicas (worker thread), or None on failure."""
+        supabase = self.supabase_factory()
+        aggregates: Dict[AggregateKey, List[int]] = {}
+        try:
+            start = 0
+            while True:
+                rows = supabase.table("match_feedback_aggregates").select("*") \
+                    .order("reference_case_id").order("symptom_fingerprint") \
+                    .range(start, start + FEEDBACK_PAGE_SIZE - 1).execute().data or []
+                for row in rows:
+                    key = (row["reference_case_id"], row["symptom_fingerprint"])
+                    aggregates[key] = [row["helpful_count"], row["total_count"]]
+                if len(rows) < FEEDBACK_PAGE_SIZE:
+                    break
+                start += FEEDBACK_PAGE_SIZE
+        except Exception as e:
+            logger.warning(f"Could not load feedback aggregates: {e}")
+            return None
+        return aggregates
+
+    async def refresh_aggregates(self):
+        """
+        Replace the aggregates with the stored ones plus local deltas not yet
+        persisted. The new map is swapped in whole, so boost() never sees a
+        partly loaded one.
+        """
+        stored = await asyncio.to_thread(self.load_aggregates)
+        if stored is None:
+            self.stats["refresh_errors"] += 1
+            return
+        for key, c in self.deltas.items():
+            counts = stored.setdefault(key, [0, 0])
+            counts[0] += c[0]
+            counts[1] += c[1]
+        self.aggregates = stored
+        logger.info(f"Loaded {len(stored)} feedback aggregates")
+
+    def _add_deltas(self, deltas: Dict[AggregateKey, List[int]]) -> bool:
+        payload = [
+            {"reference_case_id": key[0], "symptom_fingerprint": key[1], "helpful": c[0], "total": c[1]}
+            for key, c in deltas.items()
+        ]
+        try:
+            self.supabase_factory().rpc("add_feedback_aggregates", {"deltas": payload}).execute()
+            return True
+        except Exception as e:
+            logger.error(f"Failed to persist feedback aggregates: {e}")
+            return False
+
+    async def persist_aggregates(self):
+        """Add accumulated deltas to the stored aggregates (safe across replicas)."""
+        if not self.deltas:
+            return
+        deltas, self.deltas = self.deltas, {}
+        if not await asyncio.to_thread(self._add_deltas, deltas):
+            for key, c in deltas.items():
+                counts = self.deltas.setdefault(key, [0, 0])
+                counts[0] += c[0]
+                counts[1] += c[1]
+
+    # --- Lifecycle --------------------------------------------------------
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._flush_now = asyncio.Event()
+        await self.refresh_aggregates()
+        self._tasks = [asyncio.create_task(self._flush_loop())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush()
+        await self.persist_aggregates()
+
+    async def _flush_loop(self):
+        last_persist = last_refresh = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), timeout=FEEDBACK_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            await self.flush()
+            if time.monotonic() - last_persist >= FEEDBACK_PERSIST_SECONDS:
+                await self.persist_aggregates()
+                last_persist = time.monotonic()
+            if time.monotonic() - last_refresh >= FEEDBACK_REFRESH_SECONDS:
+                await self.refresh_aggregates()
+                last_refresh = time.monotonic()
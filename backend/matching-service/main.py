@@ -1,18 +1,32 @@
 import sys
 import os
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Header, Request, Response
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
-import httpx
+import asyncio
+import hashlib
+import hmac
+import json
+import orjson
 
 # Add parent directory to path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.dirname(__file__))
 
+from shared.admission import AdmissionGate, client_key, request_priority
 from shared.auth import get_current_user
-from shared.supabase_client import get_supabase_client
+from shared.supabase_client import get_supabase_client, SUPABASE_URL, SUPABASE_KEY
 from shared.logger import setup_logger
+from timeline_feed import DebouncedRunner, LocalChangeFeed, event_timeline_id, start_realtime_listener, symptoms_changed
+from vector_index import make_vector_index
+from feedback_store import FeedbackStore
+from match_cache import MatchCacheWriter
+from ai_client import AIClient, AIServiceUnavailable
+from reference_index import LiveReferenceIndex, partitions_to_probe
+from shared.symptoms import get_symptom_dictionary, idf_weights, weighted_jaccard
 
-app = FastAPI(title="RareMatch Matching Engine", version="1.0.0")
+app = FastAPI(title="RareMatch Matching Engine", version="1.0.0", default_response_class=ORJSONResponse)
 logger = setup_logger("matching-service")
 
 from fastapi.middleware.cors import CORSMiddleware
@@ -26,7 +40,29 @@ app.add_middleware(
 )
 
 # Configuration
-AI_SERVICE_URL = os.getenv("AI_SERVICE_URL", "http://127.0.0.1:8004")
+PRECOMPUTE_ENABLED = os.getenv("MATCH_PRECOMPUTE_ENABLED", "true").lower() == "true"
+# "local" or "realtime"; MATCH_PRECOMPUTE_SOURCE is the earlier name.
+TIMELINE_FEED_SOURCE = os.getenv("TIMELINE_FEED_SOURCE", os.getenv("MATCH_PRECOMPUTE_SOURCE", "local"))
+PRECOMPUTE_DEBOUNCE_SECONDS = float(os.getenv("MATCH_PRECOMPUTE_DEBOUNCE_SECONDS", "3"))
+PRECOMPUTE_CONCURRENCY = int(os.getenv("MATCH_PRECOMPUTE_CONCURRENCY", "2"))
+PRECOMPUTE_LIMIT = int(os.getenv("MATCH_PRECOMPUTE_LIMIT", "10"))
+EVENTS_WEBHOOK_SECRET = os.getenv("MATCH_EVENTS_WEBHOOK_SECRET")
+TIMELINE_INDEX_ENABLED = os.getenv("TIMELINE_INDEX_ENABLED", "true").lower() == "true"
+REFERENCE_INDEX_ENABLED = os.getenv("REFERENCE_INDEX_ENABLED", "true").lower() == "true"
+REFERENCE_VERSION_POLL_SECONDS = float(os.getenv("REFERENCE_VERSION_POLL_SECONDS", "30"))
+# Output size of the AI service's embedding model (embedding_layer of
+# rare_match_embedding_model.h5) and of the vector(256) embedding columns.
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "256"))
+# Admission control for /match computes (cache misses and force_refresh);
+# cache hits are never limited.
+MATCH_MAX_CONCURRENCY = int(os.getenv("MATCH_MAX_CONCURRENCY", "8"))
+MATCH_RATE_PER_MINUTE = float(os.getenv("MATCH_RATE_PER_MINUTE", "20"))
+MATCH_BURST = float(os.getenv("MATCH_BURST", "5"))
+
+feedback_store = FeedbackStore(get_supabase_client)
+match_cache = MatchCacheWriter(get_supabase_client)
+ai_client = AIClient()
+match_gate = AdmissionGate("match", MATCH_MAX_CONCURRENCY, MATCH_RATE_PER_MINUTE, MATCH_BURST)
 
 class MatchRequest(BaseModel):
     timeline_id: str
@@ -39,11 +75,24 @@ class MatchResult(BaseModel):
     diagnosis: Optional[str] = None
     symptoms: List[str]
     explanation: Optional[str] = None
+    # Reference patients collapsed into this prototype at ingestion
+    multiplicity: int = 1
     
 class DebugRequest(BaseModel):
     timeline_id: Optional[str] = None
     symptoms: Optional[List[str]] = None
 
+class SimilarTimelinesRequest(BaseModel):
+    timeline_id: str
+    limit: int = 10
+    min_similarity: float = 0.1
+
+class SimilarTimeline(BaseModel):
+    # Ids and scores only: other patients' titles and symptoms are not
+    # shared without their consent.
+    timeline_id: str
+    similarity: float
+
 class FeedbackRequest(BaseModel):
     timeline_id: str
     match_id: str
@@ -53,102 +102,315 @@ class FeedbackRequest(BaseModel):
 async def submit_feedback(request: FeedbackRequest, user: dict = Depends(get_current_user)):
     """
     Submit user feedback for a match.
+    Buffered in memory and written to 'match_feedback' in batches.
     """
     try:
         user_id = user.user.id
     except AttributeError:
         user_id = user.get("id")
         
+    feedback_store.record(user_id, request.timeline_id, request.match_id, request.is_helpful)
+    return {"status": "success", "message": "Feedback submitted"}
+
+@app.get("/health")
+def health_check():
+    return {"status": "healthy", "service": "matching-service", "ai_circuit": ai_client.breaker.state, **ai_client.stats, "admission": match_gate.snapshot()}
+
+# Symptom weights: smoothed IDF over reference_cases, indexed by symptom ID.
+# Uniform until load_symptom_weights() has run (at startup and whenever
+# reference data changes).
+symptom_dictionary = get_symptom_dictionary()
+symptom_weights: List[float] = [1.0] * len(symptom_dictionary)
+
+def reference_symptom_ids(item: dict) -> List[int]:
+    """Symptom IDs of a reference case (stored IDs, else resolved from names)."""
+    if item.get("symptom_ids") is not None:
+        return item["symptom_ids"]
+    return symptom_dictionary.ids(item.get("symptoms") or [])
+
+def load_symptom_weights(page_size: int = 1000):
+    """
+    Precompute IDF weights from every reference case's symptom set, each
+    prototype counted once per patient it stands for.
+    """
+    global symptom_weights
     supabase = get_supabase_client()
-    
+    documents = []
+    counts = []
+    last_id = None
     try:
-        supabase.table("match_feedback").insert({
-            "user_id": user_id,
-            "timeline_id": request.timeline_id,
-            "match_id": request.match_id,
-            "is_helpful": request.is_helpful
-        }).execute()
-        return {"status": "success", "message": "Feedback submitted"}
+        while True:
+            query = supabase.table("reference_cases").select("id,symptoms,symptom_ids,multiplicity")
+            if last_id:
+                query = query.gt("id", last_id)
+            rows = query.order("id").limit(page_size).execute().data or []
+            documents.extend(reference_symptom_ids(row) for row in rows)
+            counts.extend(row.get("multiplicity") or 1 for row in rows)
+            if len(rows) < page_size:
+                break
+            last_id = rows[-1]["id"]
     except Exception as e:
-        logger.error(f"Error submitting feedback: {e}")
-        raise HTTPException(status_code=500, detail="Failed to submit feedback")
+        logger.error(f"Failed to load symptom statistics: {e}")
+        return
+    if documents:
+        symptom_weights = idf_weights(len(symptom_dictionary), documents, counts)
+        logger.info(f"Computed IDF symptom weights over {len(documents)} reference prototypes ({sum(counts)} cases)")
 
-@app.get("/health")
-def health_check():
-    return {"status": "healthy", "service": "matching-service"}
-
-# Symptom Weights (Default: 1.0, Rare/Severe: 3.0)
-SYMPTOM_WEIGHTS = {
-    "itching": 1.0, "skin_rash": 1.0, "nodal_skin_eruptions": 2.0,
-    "continuous_sneezing": 1.0, "shivering": 1.0, "chills": 1.0,
-    "joint_pain": 1.0, "stomach_pain": 1.0, "acidity": 1.0,
-    "ulcers_on_tongue": 1.0, "muscle_wasting": 3.0, "vomiting": 1.0,
-    "burning_micturition": 1.0, "spotting_ urination": 2.0, "fatigue": 1.0,
-    "weight_gain": 1.0, "anxiety": 1.0, "cold_hands_and_feets": 1.0,
-    "mood_swings": 1.0, "weight_loss": 1.0, "restlessness": 1.0,
-    "lethargy": 1.0, "patches_in_throat": 1.0, "irregular_sugar_level": 2.0,
-    "cough": 1.0, "high_fever": 1.0, "sunken_eyes": 1.0,
-    "breathlessness": 2.0, "sweating": 1.0, "dehydration": 1.0,
-    "indigestion": 1.0, "headache": 1.0, "yellowish_skin": 2.0,
-    "dark_urine": 2.0, "nausea": 1.0, "loss_of_appetite": 1.0,
-    "pain_behind_the_eyes": 1.0, "back_pain": 1.0, "constipation": 1.0,
-    "abdominal_pain": 1.0, "diarrhoea": 1.0, "mild_fever": 1.0,
-    "yellow_urine": 1.0, "yellowing_of_eyes": 2.0, "acute_liver_failure": 3.0,
-    "fluid_overload": 3.0, "swelling_of_stomach": 2.0, "swelled_lymph_nodes": 2.0,
-    "malaise": 1.0, "blurred_and_distorted_vision": 2.0, "phlegm": 1.0,
-    "throat_irritation": 1.0, "redness_of_eyes": 1.0, "sinus_pressure": 1.0,
-    "runny_nose": 1.0, "congestion": 1.0, "chest_pain": 2.0,
-    "weakness_in_limbs": 1.0, "fast_heart_rate": 2.0, "pain_during_bowel_movements": 1.0,
-    "pain_in_anal_region": 1.0, "bloody_stool": 3.0, "irritation_in_anus": 1.0,
-    "neck_pain": 1.0, "dizziness": 1.0, "cramps": 1.0, "bruising": 2.0,
-    "obesity": 1.0, "swollen_legs": 1.0, "swollen_blood_vessels": 2.0,
-    "puffy_face_and_eyes": 2.0, "enlarged_thyroid": 2.0, "brittle_nails": 1.0,
-    "swollen_extremeties": 2.0, "excessive_hunger": 1.0, "extra_marital_contacts": 1.0,
-    "drying_and_tingling_lips": 1.0, "slurred_speech": 3.0, "knee_pain": 1.0,
-    "hip_joint_pain": 1.0, "muscle_weakness": 2.0, "stiff_neck": 1.0,
-    "swelling_joints": 1.0, "movement_stiffness": 1.0, "spinning_movements": 2.0,
-    "loss_of_balance": 2.0, "unsteadiness": 2.0, "weakness_of_one_body_side": 3.0,
-    "loss_of_smell": 2.0, "bladder_discomfort": 1.0, "foul_smell_of_urine": 1.0,
-    "continuous_feel_of_urine": 1.0, "passage_of_gases": 1.0, "internal_itching": 1.0,
-    "toxic_look_(typhos)": 3.0, "depression": 1.0, "irritability": 1.0,
-    "muscle_pain": 1.0, "altered_sensorium": 3.0, "red_spots_over_body": 2.0,
-    "belly_pain": 1.0, "abnormal_menstruation": 1.0, "dischromic _patches": 1.0,
-    "watering_from_eyes": 1.0, "increased_appetite": 1.0, "polyuria": 2.0,
-    "family_history": 1.0, "mucoid_sputum": 1.0, "rusty_sputum": 2.0,
-    "lack_of_concentration": 1.0, "visual_disturbances": 2.0,
-    "receiving_blood_transfusion": 2.0, "receiving_unsterile_injections": 2.0,
-    "coma": 3.0, "stomach_bleeding": 3.0, "distention_of_abdomen": 2.0,
-    "history_of_alcohol_consumption": 1.0, "fluid_overload": 3.0,
-    "blood_in_sputum": 3.0, "prominent_veins_on_calf": 2.0, "palpitations": 2.0,
-    "painful_walking": 1.0, "pus_filled_pimples": 1.0, "blackheads": 1.0,
-    "scurring": 1.0, "skin_peeling": 1.0, "silver_like_dusting": 1.0,
-    "small_dents_in_nails": 1.0, "inflammatory_nails": 1.0, "blister": 1.0,
-    "red_sore_around_nose": 1.0, "yellow_crust_ooze": 1.0
-}
-
-def calculate_weighted_jaccard_similarity(user_symptoms: List[str], match_symptoms: List[str]) -> float:
-    if not user_symptoms or not match_symptoms:
-        return 0.0
+def calculate_weighted_jaccard_similarity(user_symptom_ids, match_symptom_ids) -> float:
+    return weighted_jaccard(set(user_symptom_ids), set(match_symptom_ids), symptom_weights)
+
+# Strong references to fire-and-forget tasks so they are not garbage collected.
+background_tasks = set()
+
+def run_in_background(fn, *args):
+    """Run a blocking function in a worker thread without awaiting it."""
+    task = asyncio.create_task(asyncio.to_thread(fn, *args))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# Columns find_matches needs from a timeline (symptoms + persisted embedding).
+TIMELINE_MATCH_COLUMNS = "id,user_id,symptoms,embedding,embedding_fingerprint,embedding_model,embedding_diagnoses"
+
+# Latest embedding space reported by the AI service (None until first call),
+# and the space of reference rows that carry no embedding_model tag.
+current_embedding_space: Optional[str] = None
+baseline_embedding_space: Optional[str] = None
+
+def symptom_fingerprint(symptoms: List[str]) -> str:
+    """Order-insensitive hash of the normalized symptom set."""
+    normalized = sorted({s.lower().strip().replace(" ", "_") for s in symptoms})
+    return hashlib.sha256("\n".join(normalized).encode()).hexdigest()
+
+def parse_vector(value) -> Optional[List[float]]:
+    # PostgREST returns pgvector columns as strings like "[0.1,0.2,...]"
+    if isinstance(value, str):
+        return json.loads(value)
+    return value
+
+def stored_embedding(timeline: dict, fingerprint: str) -> Optional[List[float]]:
+    """The timeline's persisted embedding, if it was computed for this symptom set and embedding space."""
+    if not timeline.get("embedding") or timeline.get("embedding_fingerprint") != fingerprint:
+        return None
+    if current_embedding_space and timeline.get("embedding_model") != current_embedding_space:
+        return None
+    return parse_vector(timeline["embedding"])
+
+def store_embedding(timeline_id: str, embedding: List[float], fingerprint: str, space: str, probabilities: Optional[List[dict]] = None):
+    supabase = get_supabase_client()
+    try:
+        supabase.table("timelines").update({
+            "embedding": embedding,
+            "embedding_fingerprint": fingerprint,
+            "embedding_model": space,
+            "embedding_diagnoses": probabilities,
+        }).eq("id", timeline_id).execute()
+    except Exception as e:
+        logger.warning(f"Failed to store embedding for timeline {timeline_id}: {e}")
+
+# Model versions already reported with a dimension other than EMBEDDING_DIM.
+dimension_mismatches = set()
+
+def check_embedding_dim(embedding: List[float], model_version: str) -> bool:
+    """
+    A model whose embeddings don't match EMBEDDING_DIM is a deployment
+    error, not an outage: log it once per model version. The in-memory
+    indexes skip such vectors and searches go to the RPC.
+    """
+    if len(embedding) == EMBEDDING_DIM:
+        return True
+    if model_version not in dimension_mismatches:
+        dimension_mismatches.add(model_version)
+        logger.error(
+            f"Embedding model {model_version} returns {len(embedding)}-d vectors but EMBEDDING_DIM is {EMBEDDING_DIM}; "
+            f"set EMBEDDING_DIM (and the vector columns) to the model's dimension"
+        )
+    return False
+
+async def get_embedding(symptoms: List[str]):
+    """
+    Embed a symptom list via the AI service.
+    Returns (embedding, space, symptom_ids, probabilities). space is the
+    embedding space id (versions sharing it embed comparably). embedding
+    and space are None when the AI service is unavailable;
+    symptom_ids are the IDs the AI service resolved (including fuzzy
+    matches), else the locally resolved ones; probabilities are the model's
+    top diagnosis predictions.
+    """
+    global current_embedding_space, baseline_embedding_space
+    symptom_ids = symptom_dictionary.ids(symptoms)
+    unresolved = [s for s in symptoms if symptom_dictionary.id_of(s) is None]
+    payload = {
+        "text": ", ".join(symptoms),
+        "symptoms": unresolved,
+        "symptom_ids": symptom_ids,
+    }
+    try:
+        data = await ai_client.embed(payload)
+    except AIServiceUnavailable as e:
+        logger.error(f"AI Service unavailable: {e}")
+        return None, None, symptom_ids, []
+    embedding = data.get("embedding")
+    model_version = data.get("model_version")
+    # The AI service answers with a zero vector and no model version when its
+    # model is not loaded; that can't be searched.
+    if not model_version or not embedding:
+        logger.error(f"AI Service returned no usable embedding (model {model_version})")
+        return None, None, symptom_ids, []
+    check_embedding_dim(embedding, model_version)
+    # Older AI services report no space: each version is its own.
+    space = data.get("embedding_space") or model_version
+    current_embedding_space = space
+    baseline_embedding_space = data.get("baseline_space")
+    return embedding, space, data.get("symptom_ids") or symptom_ids, data.get("probabilities") or []
+
+def score_candidates(rows: List[dict], user_symptom_ids: List[int], limit: int, fingerprint: Optional[str], vector_weight: float = 0.6) -> List[dict]:
+    """
+    Re-rank candidate reference cases by the hybrid score (vector similarity
+    and weighted Jaccard) plus the feedback boost for this symptom set.
+    """
+    user_ids = set(user_symptom_ids)
+    scored_matches = []
+    for item in rows:
+        match_ids = set(reference_symptom_ids(item))
+        vector_sim = item.get("similarity") or 0.0
+        jaccard_sim = weighted_jaccard(user_ids, match_ids, symptom_weights)
+        hybrid_score = (vector_weight * vector_sim) + ((1 - vector_weight) * jaccard_sim)
+        hybrid_score += feedback_store.boost(str(item.get("id")), fingerprint)
         
-    user_set = set([s.lower().strip() for s in user_symptoms])
-    match_set = set([s.lower().strip() for s in match_symptoms])
-    
-    intersection = user_set.intersection(match_set)
-    union = user_set.union(match_set)
-    
-    if not union:
-        return 0.0
+        shared = [symptom_dictionary.name_of(i) for i in user_symptom_ids if i in match_ids]
+        explanation = f"Shared symptoms: {', '.join(list(shared)[:3])}"
+        if len(shared) > 3:
+            explanation += f" and {len(shared)-3} more."
+        scored_matches.append({
+            "data": item,
+            "score": hybrid_score,
+            "explanation": explanation
+        })
         
-    intersection_weight = sum([SYMPTOM_WEIGHTS.get(s, 1.0) for s in intersection])
-    union_weight = sum([SYMPTOM_WEIGHTS.get(s, 1.0) for s in union])
+    scored_matches.sort(key=lambda x: x["score"], reverse=True)
     
-    return intersection_weight / union_weight if union_weight > 0 else 0.0
+    # Plain dicts in MatchResult's shape: serialized once with orjson, never
+    # re-validated (see serialize_matches).
+    final_matches = []
+    for m in scored_matches[:limit]:
+        item = m["data"]
+        final_matches.append({
+            "match_id": str(item.get("id")),
+            "similarity": m["score"],
+            "diagnosis": item.get("diagnosis_label", "Unknown"),
+            "symptoms": item.get("symptoms") or [],
+            "explanation": m["explanation"],
+            "multiplicity": item.get("multiplicity") or 1,
+        })
+    return final_matches
+
+def reference_models(space: str) -> List[Optional[str]]:
+    """embedding_model tags of reference rows comparable with `space` (None: untagged rows)."""
+    return [space, None] if space == baseline_embedding_space else [space]
+
+# Embedding spaces with no reference embeddings to compare against, already logged.
+unsearchable_models = set()
+
+def reference_embeddings_for(space: str) -> bool:
+    """
+    Whether reference cases embedded in this space are available. Vectors
+    of different spaces are not comparable, so after a swap to a model with
+    a new space, vector search waits until reference_cases are uploaded for
+    it (swaps within a space keep the existing rows). Only known once the
+    in-memory index is loaded; the RPC filters itself.
+    """
+    if not reference_index.ready or any(reference_index.has_model(m) for m in reference_models(space)):
+        return True
+    if space not in unsearchable_models:
+        unsearchable_models.add(space)
+        logger.error(
+            f"No reference cases embedded in space {space}; ranking by symptom overlap "
+            f"until reference_cases are uploaded for it"
+        )
+    return False
+
+async def rank_matches(user_symptom_ids: List[int], embedding: List[float], space: str, limit: int, fingerprint: Optional[str] = None, probabilities: Optional[List[dict]] = None) -> List[dict]:
+    """
+    Vector search over reference cases of the same embedding space,
+    re-ranked by the hybrid score. Uses the in-memory diagnosis-partitioned
+    index once it is loaded, probing only the partitions of the most
+    probable diagnoses.
+    """
+    models = reference_models(space)
+    if reference_index.ready and len(embedding) == reference_index.dim:
+        labels = partitions_to_probe(probabilities)
+        hits = reference_index.search(embedding, limit * 3, 0.1, labels, models)
+        if labels is not None and len(hits) < limit:
+            # Too few candidates in the probed partitions: widen to all.
+            hits = reference_index.search(embedding, limit * 3, 0.1, models=models)
+        rows = [dict(payload, similarity=score) for _, score, payload in hits]
+        return score_candidates(rows, user_symptom_ids, limit, fingerprint)
+
+    supabase = get_supabase_client()
+    params = {
+        "query_embedding": embedding,
+        "match_threshold": 0.1, 
+        "match_count": limit * 3,
+        "query_model": space,
+        "include_untagged": None in models,
+    }
+    response = await asyncio.to_thread(lambda: supabase.rpc("match_reference_cases", params).execute())
+    return score_candidates(response.data, user_symptom_ids, limit, fingerprint)
+
+async def rank_by_symptom_overlap(user_symptom_ids: List[int], limit: int, fingerprint: Optional[str] = None) -> List[dict]:
+    """
+    Degraded mode for AI outages: candidates sharing at least one symptom,
+    ranked by weighted Jaccard alone.
+    """
+    if not user_symptom_ids:
+        return []
+    supabase = get_supabase_client()
+    params = {"query_symptom_ids": user_symptom_ids, "match_count": limit * 3}
+    response = await asyncio.to_thread(lambda: supabase.rpc("match_reference_cases_by_symptoms", params).execute())
+    return score_candidates(response.data, user_symptom_ids, limit, fingerprint, vector_weight=0.0)
+
+def serialize_matches(final_matches: List[dict]) -> bytes:
+    return orjson.dumps(final_matches)
+
+def cached_response(body: bytes, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Pre-serialized match list, sent as-is (no response_model validation)."""
+    return Response(content=body, media_type="application/json", headers=headers)
+
+async def compute_matches(timeline: dict, limit: int):
+    """
+    Returns (matches, degraded). degraded is True when the AI service was
+    unavailable, or no reference cases exist for its embedding model, and
+    matches are ranked by symptom overlap only; such results must not be
+    cached.
+    """
+    user_symptoms_list = [s["symptom_name"] for s in timeline.get("symptoms", [])]
+    fingerprint = symptom_fingerprint(user_symptoms_list)
+    embedding = stored_embedding(timeline, fingerprint)
+    space = timeline.get("embedding_model")
+    user_symptom_ids = symptom_dictionary.ids(user_symptoms_list)
+    probabilities = timeline.get("embedding_diagnoses")
+    if embedding is None:
+        embedding, space, user_symptom_ids, probabilities = await get_embedding(user_symptoms_list)
+        if embedding is None:
+            return await rank_by_symptom_overlap(user_symptom_ids, limit, fingerprint), True
+        if space and timeline.get("id"):
+            run_in_background(store_embedding, timeline["id"], embedding, fingerprint, space, probabilities)
+            index_timeline(timeline["id"], timeline.get("user_id"), embedding)
+    else:
+        logger.info(f"Reusing stored embedding for timeline {timeline.get('id')}")
+    if timeline.get("id"):
+        feedback_store.remember_fingerprint(timeline["id"], fingerprint)
+    if not reference_embeddings_for(space):
+        return await rank_by_symptom_overlap(user_symptom_ids, limit, fingerprint), True
+    return await rank_matches(user_symptom_ids, embedding, space, limit, fingerprint, probabilities), False
 
 @app.post("/match", response_model=List[MatchResult])
-async def find_matches(request: MatchRequest, user: dict = Depends(get_current_user)):
+async def find_matches(request: MatchRequest, http_request: Request, user: dict = Depends(get_current_user)):
     """
     Find similar cases using Hybrid Scoring (Vector + Jaccard).
-    Caches results in 'matches' table.
+    Caches results in 'matches' table. Recomputing is admission-controlled:
+    429 when the caller is over its rate, 503 when the service is full.
     """
     try:
         user_id = user.user.id
@@ -158,17 +420,23 @@ async def find_matches(request: MatchRequest, user: dict = Depends(get_current_u
     
     # 0. Check Cache
     if not request.force_refresh:
+        pending = match_cache.get(request.timeline_id)
+        if pending is not None:
+            return cached_response(pending)
         try:
-            cached = supabase.table("matches").select("match_data").eq("timeline_id", request.timeline_id).maybe_single().execute()
+            cached = supabase.table("matches").select("match_json,match_data").eq("timeline_id", request.timeline_id).maybe_single().execute()
             if cached and cached.data:
                 logger.info(f"Returning cached matches for timeline {request.timeline_id}")
-                return cached.data["match_data"]
+                if cached.data.get("match_json"):
+                    return cached_response(cached.data["match_json"].encode())
+                # Rows cached before match_json existed
+                return cached_response(orjson.dumps(cached.data["match_data"]))
         except Exception as e:
             logger.warning(f"Cache lookup failed: {e}")
 
     # 1. Fetch Timeline Data
     try:
-        timeline_response = supabase.table("timelines").select("*").eq("id", request.timeline_id).single().execute()
+        timeline_response = supabase.table("timelines").select(TIMELINE_MATCH_COLUMNS).eq("id", request.timeline_id).single().execute()
         if not timeline_response.data:
             raise HTTPException(status_code=404, detail="Timeline not found")
         timeline = timeline_response.data
@@ -176,88 +444,206 @@ async def find_matches(request: MatchRequest, user: dict = Depends(get_current_u
         logger.error(f"Error fetching timeline: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch timeline")
 
-    # 2. Generate Embedding
-    user_symptoms_list = [s["symptom_name"] for s in timeline.get("symptoms", [])]
-    symptoms_text = ", ".join(user_symptoms_list)
-    
-    embedding = []
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            payload = {
-                "text": symptoms_text,
-                "symptoms": user_symptoms_list,
-            }
-            response = await client.post(f"{AI_SERVICE_URL}/embed", json=payload)
-            if response.status_code == 200:
-                data = response.json()
-                embedding = data.get("embedding")
-            else:
-                logger.error(f"AI Service error: {response.text}")
-                embedding = [0.1] * 256 
-        except Exception as e:
-            logger.error(f"Failed to call AI Service: {e}")
-            embedding = [0.1] * 256
-
-    # 3. Hybrid Search
+    # 2-3. Generate Embedding + Hybrid Search
     try:
-        params = {
-            "query_embedding": embedding,
-            "match_threshold": 0.1, 
-            "match_count": request.limit * 3 
-        }
-        response = supabase.rpc("match_reference_cases", params).execute()
-        
-        scored_matches = []
-        for item in response.data:
-            match_symptoms = item.get("symptoms", [])
-            vector_sim = item.get("similarity")
-            jaccard_sim = calculate_weighted_jaccard_similarity(user_symptoms_list, match_symptoms)
-            hybrid_score = (0.6 * vector_sim) + (0.4 * jaccard_sim)
-            
-            shared = set([s.lower() for s in user_symptoms_list]).intersection(set([s.lower() for s in match_symptoms]))
-            explanation = f"Shared symptoms: {', '.join(list(shared)[:3])}"
-            if len(shared) > 3:
-                explanation += f" and {len(shared)-3} more."
-            scored_matches.append({
-                "data": item,
-                "score": hybrid_score,
-                "explanation": explanation
-            })
-            
-        scored_matches.sort(key=lambda x: x["score"], reverse=True)
-        
-        final_matches = []
-        for m in scored_matches[:request.limit]:
-            item = m["data"]
-            final_matches.append(MatchResult(
-                match_id=str(item.get("id")),
-                similarity=m["score"],
-                diagnosis=item.get("diagnosis_label", "Unknown"),
-                symptoms=item.get("symptoms", []),
-                explanation=m["explanation"]
-            ))
-
-        # 4. Cache Results
-        try:
-            # Delete old cache
-            supabase.table("matches").delete().eq("timeline_id", request.timeline_id).execute()
-            # Insert new cache
-            cache_data = [r.model_dump() for r in final_matches]
-            supabase.table("matches").insert({
-                "timeline_id": request.timeline_id,
-                "match_data": cache_data
-            }).execute()
-            logger.info(f"Cached {len(final_matches)} matches for timeline {request.timeline_id}")
-        except Exception as e:
-            logger.error(f"Failed to cache results: {e}")
-            
-        return final_matches
-
+        with match_gate.admit(client_key(http_request, {"id": user_id}), request_priority(http_request)):
+            final_matches, degraded = await compute_matches(timeline, request.limit)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error executing search: {e}")
         return []
 
+    # 4. Cache Results, written behind (degraded results are served but not cached)
+    body = serialize_matches(final_matches)
+    if degraded:
+        return cached_response(body, {"X-Match-Degraded": "symptom-overlap"})
+    match_cache.put(request.timeline_id, body)
+    return cached_response(body)
+
+# Background precompute: timeline inserts/updates recompute matches off the
+# request path so most /match calls hit the cache.
+async def precompute_timeline_matches(timeline_id: str):
+    supabase = get_supabase_client()
+    response = await asyncio.to_thread(
+        lambda: supabase.table("timelines").select(TIMELINE_MATCH_COLUMNS).eq("id", timeline_id).maybe_single().execute()
+    )
+    if not response or not response.data:
+        return
+    final_matches, degraded = await compute_matches(response.data, PRECOMPUTE_LIMIT)
+    if degraded:
+        # Retried on the next change or /match once the AI service is back.
+        logger.warning(f"Skipping precompute cache for timeline {timeline_id}: no vector search (AI service or reference embeddings unavailable)")
+        return
+    match_cache.put(timeline_id, serialize_matches(final_matches))
+
+timeline_feed = LocalChangeFeed()
+precompute_runner = DebouncedRunner(
+    precompute_timeline_matches,
+    delay=PRECOMPUTE_DEBOUNCE_SECONDS,
+    concurrency=PRECOMPUTE_CONCURRENCY,
+)
+
+def on_timeline_change(event: dict):
+    if event.get("table", "timelines") != "timelines" or not symptoms_changed(event):
+        return
+    timeline_id = event_timeline_id(event)
+    if timeline_id:
+        precompute_runner.submit(timeline_id)
+
+timeline_feed.subscribe(on_timeline_change)
+
+# Patient-to-patient search: in-memory index over timeline embeddings, kept
+# current from the change feed instead of scanning timelines per query.
+timeline_index = make_vector_index(EMBEDDING_DIM)
+
+def index_timeline(timeline_id: str, user_id: Optional[str], embedding) -> bool:
+    vector = parse_vector(embedding)
+    if not vector or len(vector) != EMBEDDING_DIM:
+        return False
+    timeline_index.upsert(timeline_id, vector, {"user_id": user_id})
+    return True
+
+def on_timeline_index_change(event: dict):
+    if event.get("table", "timelines") != "timelines":
+        return
+    timeline_id = event_timeline_id(event)
+    if not timeline_id:
+        return
+    record = event.get("record") or {}
+    if event.get("type") == "DELETE":
+        timeline_index.remove(timeline_id)
+    elif record.get("embedding"):
+        index_timeline(timeline_id, record.get("user_id"), record["embedding"])
+    elif "embedding" in record:
+        # Embedding cleared: drop the stale vector.
+        timeline_index.remove(timeline_id)
+
+timeline_feed.subscribe(on_timeline_index_change)
+
+def load_timeline_index(page_size: int = 1000):
+    """Initial fill of the timeline index, paging by id."""
+    supabase = get_supabase_client()
+    last_id = None
+    loaded = 0
+    try:
+        while True:
+            query = supabase.table("timelines").select("id,user_id,embedding").not_.is_("embedding", "null")
+            if last_id:
+                query = query.gt("id", last_id)
+            rows = query.order("id").limit(page_size).execute().data or []
+            for row in rows:
+                loaded += index_timeline(row["id"], row.get("user_id"), row["embedding"])
+            if len(rows) < page_size:
+                break
+            last_id = rows[-1]["id"]
+        logger.info(f"Timeline index loaded with {loaded} embeddings")
+    except Exception as e:
+        logger.error(f"Failed to load timeline index: {e}")
+
+# Reference-case search: in-memory index partitioned by diagnosis_label,
+# kept current by polling the reference_data_version marker (new uploads are
+# appended, other changes rebuild in the background and swap in). Until the
+# first load, searches go to the match_reference_cases RPC.
+reference_index = LiveReferenceIndex(EMBEDDING_DIM, get_supabase_client)
+reference_refresh_task: Optional[asyncio.Task] = None
+
+async def refresh_reference_data():
+    first = True
+    while True:
+        changed = await asyncio.to_thread(reference_index.refresh)
+        if changed or first:
+            # IDF weights are computed over the same reference cases.
+            await asyncio.to_thread(load_symptom_weights)
+            first = False
+        await asyncio.sleep(REFERENCE_VERSION_POLL_SECONDS)
+
+@app.on_event("startup")
+async def start_background_workers():
+    global reference_refresh_task
+    await feedback_store.start()
+    await match_cache.start()
+    if PRECOMPUTE_ENABLED:
+        await precompute_runner.start()
+    if TIMELINE_INDEX_ENABLED:
+        run_in_background(load_timeline_index)
+    if REFERENCE_INDEX_ENABLED:
+        # Loads symptom weights after each reference data change.
+        reference_refresh_task = asyncio.create_task(refresh_reference_data())
+    else:
+        run_in_background(load_symptom_weights)
+    if TIMELINE_FEED_SOURCE == "realtime":
+        start_realtime_listener(SUPABASE_URL, SUPABASE_KEY, timeline_feed, asyncio.get_running_loop())
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    if reference_refresh_task:
+        reference_refresh_task.cancel()
+    await precompute_runner.stop()
+    await feedback_store.stop()
+    await match_cache.stop()
+    await ai_client.close()
+
+@app.post("/events/timelines")
+async def timeline_change_event(event: Dict[str, Any], x_webhook_secret: Optional[str] = Header(None)):
+    """
+    Local change feed entry point. Accepts Supabase Database Webhook payloads
+    ({"type", "table", "record", "old_record"}) for timelines. Every event
+    can trigger recompute work, so the endpoint is closed (503) until
+    MATCH_EVENTS_WEBHOOK_SECRET is configured and the webhook sends it in
+    X-Webhook-Secret.
+    """
+    if not EVENTS_WEBHOOK_SECRET:
+        raise HTTPException(status_code=503, detail="Timeline events webhook is not configured")
+    if not x_webhook_secret or not hmac.compare_digest(x_webhook_secret, EVENTS_WEBHOOK_SECRET):
+        raise HTTPException(status_code=401, detail="Invalid webhook secret")
+    timeline_feed.publish(event)
+    return {"status": "accepted", "pending": len(precompute_runner.deadlines)}
+
+@app.get("/events/stats")
+def precompute_stats():
+    return {
+        "enabled": PRECOMPUTE_ENABLED,
+        "source": TIMELINE_FEED_SOURCE,
+        "timeline_index_size": len(timeline_index),
+        "reference_index": reference_index.stats(),
+        "match_cache": match_cache.stats,
+        **precompute_runner.stats,
+    }
+
+@app.post("/similar-timelines", response_model=List[SimilarTimeline])
+async def find_similar_timelines(request: SimilarTimelinesRequest, user: dict = Depends(get_current_user)):
+    """
+    Find other patients' timelines similar to one of the caller's timelines,
+    using the in-memory timeline index. Returns timeline ids and scores
+    only; the timelines themselves stay behind RLS.
+    """
+    user_id = user.get("id")
+    supabase = get_supabase_client()
+    try:
+        timeline = supabase.table("timelines").select(TIMELINE_MATCH_COLUMNS).eq("id", request.timeline_id).eq("user_id", user_id).single().execute().data
+    except Exception as e:
+        logger.error(f"Error fetching timeline: {e}")
+        raise HTTPException(status_code=404, detail="Timeline not found")
+
+    user_symptoms_list = [s["symptom_name"] for s in timeline.get("symptoms", [])]
+    embedding = stored_embedding(timeline, symptom_fingerprint(user_symptoms_list))
+    if embedding is None:
+        embedding, space, _, probabilities = await get_embedding(user_symptoms_list)
+        if not space:
+            raise HTTPException(status_code=503, detail="Embedding unavailable")
+        run_in_background(store_embedding, timeline["id"], embedding, symptom_fingerprint(user_symptoms_list), space, probabilities)
+        index_timeline(timeline["id"], user_id, embedding)
+    if len(embedding) != EMBEDDING_DIM:
+        raise HTTPException(status_code=503, detail="Timeline index unavailable for this embedding model")
+
+    # Exclude the caller's own timelines (owners are on the index payloads).
+    hits = timeline_index.search(
+        embedding, request.limit, request.min_similarity,
+        exclude={timeline["id"]}, where=lambda payload: (payload or {}).get("user_id") != user_id,
+    )
+    return [SimilarTimeline(timeline_id=key, similarity=score) for key, score, _ in hits]
+
 @app.post("/debug/similarity")
 async def debug_similarity(request: DebugRequest):
     """
@@ -277,12 +663,15 @@ async def debug_similarity(request: DebugRequest):
     else:
         return {"error": "Must provide either timeline_id or symptoms"}
     
-    async with httpx.AsyncClient() as client:
-        payload = {"text": "", "symptoms": user_symptoms}
-        ai_resp = await client.post(f"{AI_SERVICE_URL}/embed", json=payload)
-        ai_data = ai_resp.json()
-        
+    user_symptom_ids = symptom_dictionary.ids(user_symptoms)
+    payload = {"text": "", "symptoms": user_symptoms, "symptom_ids": user_symptom_ids}
+    try:
+        ai_data = await ai_client.embed(payload)
+    except AIServiceUnavailable as e:
+        return {"error": f"AI service unavailable: {e}", "ai_circuit": ai_client.breaker.state}
+
     embedding = ai_data.get("embedding")
+    user_symptom_ids = ai_data.get("symptom_ids") or user_symptom_ids
     
     params = {
         "query_embedding": embedding,
@@ -293,9 +682,9 @@ async def debug_similarity(request: DebugRequest):
     
     debug_results = []
     for item in rpc_resp.data:
-        match_symptoms = item.get("symptoms", [])
+        match_ids = reference_symptom_ids(item)
         vector_sim = item.get("similarity")
-        jaccard_sim = calculate_weighted_jaccard_similarity(user_symptoms, match_symptoms)
+        jaccard_sim = calculate_weighted_jaccard_similarity(user_symptom_ids, match_ids)
         hybrid_score = (0.6 * vector_sim) + (0.4 * jaccard_sim)
         
         debug_results.append({
@@ -303,11 +692,13 @@ async def debug_similarity(request: DebugRequest):
             "vector_similarity": vector_sim,
             "jaccard_similarity": jaccard_sim,
             "hybrid_score": hybrid_score,
-            "symptoms_match": list(set(user_symptoms).intersection(set(match_symptoms)))
+            "symptoms_match": [symptom_dictionary.name_of(i) for i in user_symptom_ids if i in match_ids]
         })
         
     return {
         "user_symptoms": user_symptoms,
+        "user_symptom_ids": user_symptom_ids,
+        "symptom_weights": {symptom_dictionary.name_of(i): symptom_weights[i] for i in user_symptom_ids},
         "ai_service_debug": ai_data.get("debug_info"),
         "top_candidates": debug_results
     }
@@ -0,0 +1,170 @@
+import asyncio
+import os
+import sys
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.logger import setup_logger
+
+logger = setup_logger("match-cache")
+
+MATCH_CACHE_FLUSH_SIZE = int(os.getenv("MATCH_CACHE_FLUSH_SIZE", "100"))
+MATCH_CACHE_FLUSH_SECONDS = float(os.getenv("MATCH_CACHE_FLUSH_SECONDS", "0.5"))
+MATCH_CACHE_MAX_PENDING = int(os.getenv("MATCH_CACHE_MAX_PENDING", "10000"))
+# Failed flushes a row survives before it is dropped.
+MATCH_CACHE_MAX_ATTEMPTS = int(os.getenv("MATCH_CACHE_MAX_ATTEMPTS", "5"))
+
+
+def is_row_error(error: Exception) -> bool:
+    """
+    Postgres data or integrity errors (SQLSTATE classes 22 and 23, e.g. a
+    timeline deleted before its matches were flushed) are caused by a row
+    in the batch, not by the database being unavailable.
+    """
+    return str(getattr(error, "code", "") or "").startswith(("22", "23"))
+
+
+class MatchCacheWriter:
+    """
+    Write-behind persistence for the 'matches' cache.
+
+    put() only records the serialized match list in memory, keyed by
+    timeline, so repeated writes for one timeline coalesce into the latest.
+    A background loop upserts everything pending in one request (unique
+    key on timeline_id) whenever MATCH_CACHE_FLUSH_SIZE rows are waiting or
+    MATCH_CACHE_FLUSH_SECONDS pass. get() serves pending and in-flight
+    rows, so a repeat request never recomputes just because the write
+    hasn't landed yet.
+
+    A batch rejected because of its rows is split in halves until the
+    offending rows are isolated; those are dropped and the rest written.
+    Other failures (database unreachable) put the batch back for the next
+    flush, up to MATCH_CACHE_MAX_ATTEMPTS times per row.
+    """
+
+    def __init__(self, supabase_factory: Callable):
+        self.supabase_factory = supabase_factory
+        self.pending: "OrderedDict[str, dict]" = OrderedDict()  # timeline_id -> row
+        self.inflight: Dict[str, dict] = {}  # timeline_id -> row being written
+        self.attempts: Dict[str, int] = {}  # timeline_id -> failed flushes
+        self.stats = {"queued": 0, "coalesced": 0, "written": 0, "dropped": 0, "rejected": 0, "flush_errors": 0}
+        self._flush_now: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def put(self, timeline_id: str, body: bytes):
+        if timeline_id in self.pending:
+            self.stats["coalesced"] += 1
+            del self.pending[timeline_id]
+        elif len(self.pending) >= MATCH_CACHE_MAX_PENDING:
+            # The cache is only an optimization: drop the oldest write.
+            dropped, _ = self.pending.popitem(last=False)
+            self.attempts.pop(dropped, None)
+            self.stats["dropped"] += 1
+        self.pending[timeline_id] = {
+            "timeline_id": timeline_id,
+            "match_json": body.decode(),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        self.attempts.pop(timeline_id, None)
+        self.stats["queued"] += 1
+        if len(self.pending) >= MATCH_CACHE_FLUSH_SIZE and self._flush_now:
+            self._flush_now.set()
+
+    def get(self, timeline_id: str) -> Optional[bytes]:
+        row = self.pending.get(timeline_id) or self.inflight.get(timeline_id)
+        return row["match_json"].encode() if row else None
+
+    def _write(self, rows: List[dict]) -> Optional[Exception]:
+        """Upsert `rows`; returns the error, or None once they are stored."""
+        try:
+            self.supabase_factory().table("matches").upsert(rows, on_conflict="timeline_id").execute()
+            return None
+        except Exception as e:
+            return e
+
+    def _write_isolating(self, rows: List[dict]) -> Tuple[List[dict], List[dict]]:
+        """
+        Write `rows`, bisecting on row errors. Returns (rejected, failed):
+        rows refused on their own, and rows not written for other reasons.
+        """
+        error = self._write(rows)
+        if error is None:
+            return [], []
+        if not is_row_error(error):
+            logger.error(f"Failed to persist {len(rows)} cached match lists: {error}")
+            return [], rows
+        if len(rows) == 1:
+            logger.warning(f"Dropping cached matches for timeline {rows[0]['timeline_id']}: {error}")
+            return rows, []
+        middle = len(rows) // 2
+        rejected, failed = self._write_isolating(rows[:middle])
+        more_rejected, more_failed = self._write_isolating(rows[middle:])
+        return rejected + more_rejected, failed + more_failed
+
+    async def flush(self):
+        """Upsert all pending match lists in one batch (more only if rows are rejected)."""
+        if not self.pending:
+            return
+        rows = list(self.pending.values())
+        self.pending = OrderedDict()
+        self.inflight.update((row["timeline_id"], row) for row in rows)
+        try:
+            rejected, failed = await asyncio.to_thread(self._write_isolating, rows)
+        except BaseException:
+            # Cancelled mid-write: keep the rows for stop()'s final flush.
+            failed, rejected = rows, []
+            raise
+        finally:
+            for row in rows:
+                if self.inflight.get(row["timeline_id"]) is row:
+                    del self.inflight[row["timeline_id"]]
+            self._settle(rows, rejected, failed)
+
+    def _settle(self, rows: List[dict], rejected: List[dict], failed: List[dict]):
+        self.stats["written"] += len(rows) - len(rejected) - len(failed)
+        self.stats["rejected"] += len(rejected)
+        if failed:
+            self.stats["flush_errors"] += 1
+        failed_ids = {row["timeline_id"] for row in failed}
+        for row in rows:
+            if row["timeline_id"] not in failed_ids:
+                self.attempts.pop(row["timeline_id"], None)
+        # Retry next time, unless a newer list for the timeline arrived
+        # meanwhile or the row has failed too often.
+        for row in reversed(failed):
+            timeline_id = row["timeline_id"]
+            if timeline_id in self.pending:
+                continue
+            attempts = self.attempts.get(timeline_id, 0) + 1
+            if attempts >= MATCH_CACHE_MAX_ATTEMPTS or len(self.pending) >= MATCH_CACHE_MAX_PENDING:
+                self.attempts.pop(timeline_id, None)
+                self.stats["dropped"] += 1
+                continue
+            self.attempts[timeline_id] = attempts
+            self.pending[timeline_id] = row
+            self.pending.move_to_end(timeline_id, last=False)
+
+    async def start(self):
+        if self._task:
+            return
+        self._flush_now = asyncio.Event()
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), timeout=MATCH_CACHE_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            await self.flush()
@@ -0,0 +1,266 @@
+import json
+import os
+import sys
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.logger import setup_logger
+from vector_index import SearchHit, VectorIndex
+
+logger = setup_logger("reference-index")
+
+# Probe diagnoses (most probable first) until they cover this share of the
+# predicted probability mass among the AI service's top predictions.
+REFERENCE_PROBE_MASS = float(os.getenv("REFERENCE_PROBE_MASS", "0.8"))
+# Below this top-1 probability the prediction is not trusted: search everything.
+REFERENCE_MIN_CONFIDENCE = float(os.getenv("REFERENCE_MIN_CONFIDENCE", "0.2"))
+REFERENCE_MAX_PARTITIONS = int(os.getenv("REFERENCE_MAX_PARTITIONS", "5"))
+REFERENCE_PAGE_SIZE = int(os.getenv("REFERENCE_PAGE_SIZE", "1000"))
+REFERENCE_COLUMNS = "id,seq,diagnosis_label,symptoms,symptom_ids,multiplicity,embedding_model,embedding"
+
+
+def partitions_to_probe(
+    probabilities: Optional[List[dict]],
+    mass: float = REFERENCE_PROBE_MASS,
+    min_confidence: float = REFERENCE_MIN_CONFIDENCE,
+    max_partitions: int = REFERENCE_MAX_PARTITIONS,
+) -> Optional[List[str]]:
+    """
+    Diagnosis partitions to search for a query, given the AI service's
+    [{"disease", "probability"}] predictions. None means search all
+    partitions (no or low-confidence predictions). The multilabel outputs
+    are independent sigmoids, so mass is measured on their normalized share.
+    """
+    ranked = sorted(
+        (p for p in probabilities or [] if p.get("disease") and p.get("probability") is not None),
+        key=lambda p: p["probability"],
+        reverse=True,
+    )
+    if not ranked or ranked[0]["probability"] < min_confidence:
+        return None
+    total = sum(p["probability"] for p in ranked) or 1.0
+    labels = []
+    covered = 0.0
+    for p in ranked[:max_partitions]:
+        labels.append(p["disease"])
+        covered += p["probability"] / total
+        if covered >= mass:
+            break
+    return labels
+
+
+class PartitionedReferenceIndex:
+    """
+    Reference-case embeddings partitioned by diagnosis_label, one exact
+    VectorIndex per label. A query probes only the partitions of its most
+    probable diagnoses, so work shrinks with the number of labels probed
+    instead of scanning every reference case. Partitions are also split by
+    the embedding model that produced the vectors: vectors of different
+    models live in different spaces and are never compared.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.partitions: Dict[Tuple[Optional[str], str], VectorIndex] = {}  # (model, label) -> index
+        self.keys: Dict[str, Tuple[Optional[str], str]] = {}  # case id -> partition
+        self.models: Dict[Optional[str], int] = {}  # model -> cases
+        self.lock = threading.Lock()
+        self.ready = False
+
+    def __len__(self):
+        return len(self.keys)
+
+    def has_model(self, model: Optional[str]) -> bool:
+        return self.models.get(model, 0) > 0
+
+    def _forget(self, case_id: str) -> Optional[Tuple[Optional[str], str]]:
+        key = self.keys.pop(case_id, None)
+        if key is not None:
+            self.models[key[0]] -= 1
+        return key
+
+    def upsert(self, case_id: str, label: Optional[str], vector, payload: dict, model: Optional[str] = None):
+        key = (model, label or "Unknown")
+        with self.lock:
+            previous = self._forget(case_id)
+            if previous is not None and previous != key:
+                self.partitions[previous].remove(case_id)
+            partition = self.partitions.get(key)
+            if partition is None:
+                partition = self.partitions[key] = VectorIndex(self.dim, capacity=64)
+            self.keys[case_id] = key
+            self.models[model] = self.models.get(model, 0) + 1
+        partition.upsert(case_id, vector, payload)
+
+    def remove(self, case_id: str) -> bool:
+        with self.lock:
+            key = self._forget(case_id)
+        return key is not None and self.partitions[key].remove(case_id)
+
+    def search(
+        self,
+        query,
+        k: int,
+        threshold: Optional[float] = None,
+        labels: Optional[Iterable[str]] = None,
+        models: Optional[Iterable[Optional[str]]] = None,
+    ) -> List[SearchHit]:
+        """
+        Top-k across the given partitions (all labels when labels is None)
+        of the given embedding_model tags (None in `models` selects untagged
+        rows; all tags when models is None).
+        """
+        wanted = None if labels is None else set(labels)
+        tags = None if models is None else set(models)
+        # Appends from the refresh thread may add partitions: pick them under
+        # the lock, search them (each has its own lock) outside it.
+        with self.lock:
+            selected = [
+                partition for key, partition in self.partitions.items()
+                if (tags is None or key[0] in tags) and (wanted is None or key[1] in wanted)
+            ]
+        hits: List[SearchHit] = []
+        for partition in selected:
+            hits.extend(partition.search(query, k, threshold))
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        return hits[:k]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "size": len(self),
+                "partitions": len(self.partitions),
+                "models": {str(model): count for model, count in self.models.items() if count},
+                "ready": self.ready,
+            }
+
+
+class LiveReferenceIndex:
+    """
+    Keeps a PartitionedReferenceIndex in step with reference_cases without
+    restarts. refresh() reads the reference_data_version marker (bumped by a
+    trigger on every write): a new `version` with the same `generation`
+    means rows were only inserted, and those are appended to the live index
+    by `seq`; a new `generation` (updates, deletes, truncate, or an insert
+    committing a `seq` below one already committed, which an append past
+    it would have missed) triggers a full rebuild into a second index that then replaces the live one in a
+    single reference assignment. Queries keep using the old copy until the
+    swap, so they never wait, and at most two copies exist at once.
+    """
+
+    def __init__(self, dim: int, supabase_factory: Callable):
+        self.dim = dim
+        self.supabase_factory = supabase_factory
+        self.current = PartitionedReferenceIndex(dim)
+        self.version: Optional[int] = None
+        self.generation: Optional[int] = None
+        self.last_seq = 0
+        self.refresh_lock = threading.Lock()
+        self.stats_counts = {"rebuilds": 0, "appended": 0, "refresh_errors": 0, "skipped_dimension": 0}
+
+    # Queries go to whichever copy is live at call time.
+    @property
+    def ready(self) -> bool:
+        return self.current.ready
+
+    def __len__(self):
+        return len(self.current)
+
+    def has_model(self, model: Optional[str]) -> bool:
+        return self.current.has_model(model)
+
+    def search(
+        self,
+        query,
+        k: int,
+        threshold: Optional[float] = None,
+        labels: Optional[Iterable[str]] = None,
+        models: Optional[Iterable[Optional[str]]] = None,
+    ) -> List[SearchHit]:
+        return self.current.search(query, k, threshold, labels, models)
+
+    def stats(self) -> dict:
+        return {
+            **self.current.stats(),
+            "version": self.version,
+            "generation": self.generation,
+            "last_seq": self.last_seq,
+            **self.stats_counts,
+        }
+
+    def _read_marker(self):
+        rows = self.supabase_factory().table("reference_data_version").select("version,generation") \
+            .eq("name", "reference_cases").limit(1).execute().data
+        if not rows:
+            return 0, 0
+        return rows[0]["version"], rows[0]["generation"]
+
+    def _load_into(self, index: PartitionedReferenceIndex, after_seq: int) -> int:
+        """Add rows with seq > after_seq to `index`; returns the highest seq seen."""
+        supabase = self.supabase_factory()
+        last_seq = after_seq
+        wrong_dim: Dict[int, int] = {}  # dimension -> rows skipped
+        while True:
+            rows = supabase.table("reference_cases").select(REFERENCE_COLUMNS) \
+                .gt("seq", last_seq).order("seq").limit(REFERENCE_PAGE_SIZE).execute().data or []
+            for row in rows:
+                vector = row.pop("embedding", None)
+                if isinstance(vector, str):
+                    vector = json.loads(vector)
+                if not vector:
+                    continue
+                if len(vector) != self.dim:
+                    wrong_dim[len(vector)] = wrong_dim.get(len(vector), 0) + 1
+                    continue
+                index.upsert(row["id"], row.get("diagnosis_label"), np.asarray(vector, dtype=np.float32), row, row.get("embedding_model"))
+            if rows:
+                last_seq = rows[-1]["seq"]
+            if len(rows) < REFERENCE_PAGE_SIZE:
+                break
+        if wrong_dim:
+            self.stats_counts["skipped_dimension"] += sum(wrong_dim.values())
+            logger.error(
+                f"Skipped {sum(wrong_dim.values())} reference cases whose embedding dimension "
+                f"{sorted(wrong_dim)} is not the index dimension {self.dim}; check EMBEDDING_DIM"
+            )
+        return last_seq
+
+    def rebuild(self):
+        """Build a fresh index off to the side, then swap it in."""
+        version, generation = self._read_marker()
+        fresh = PartitionedReferenceIndex(self.dim)
+        last_seq = self._load_into(fresh, 0)
+        fresh.ready = len(fresh) > 0
+        self.current, self.last_seq = fresh, last_seq
+        self.version, self.generation = version, generation
+        self.stats_counts["rebuilds"] += 1
+        logger.info(f"Reference index rebuilt: {self.stats()}")
+
+    def refresh(self) -> bool:
+        """Bring the index up to the current marker; True if anything changed."""
+        with self.refresh_lock:
+            try:
+                if self.generation is None:
+                    self.rebuild()
+                    return True
+                version, generation = self._read_marker()
+                if version == self.version and generation == self.generation:
+                    return False
+                if generation != self.generation:
+                    self.rebuild()
+                    return True
+                before = len(self.current)
+                self.last_seq = self._load_into(self.current, self.last_seq)
+                self.version = version
+                self.current.ready = len(self.current) > 0
+                self.stats_counts["appended"] += len(self.current) - before
+                logger.info(f"Appended {len(self.current) - before} reference cases (version {version})")
+                return True
+            except Exception as e:
+                self.stats_counts["refresh_errors"] += 1
+                logger.error(f"Failed to refresh reference index: {e}")
+                return False
@@ -0,0 +1,175 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.logger import setup_logger
+
+logger = setup_logger("timeline-feed")
+
+# Change events use the Supabase Realtime / Database Webhook shape:
+# {"type": "INSERT" | "UPDATE" | "DELETE", "table": "timelines",
+#  "record": {...}, "old_record": {...}}
+ChangeEvent = Dict[str, Any]
+
+
+def event_timeline_id(event: ChangeEvent) -> Optional[str]:
+    record = event.get("record") or event.get("old_record") or {}
+    return record.get("id")
+
+
+def symptoms_changed(event: ChangeEvent) -> bool:
+    """
+    True if the event can change match results. Updates that leave the
+    symptoms untouched (title edits, our own embedding write-backs) are ignored.
+    """
+    kind = event.get("type")
+    if kind == "INSERT":
+        return True
+    if kind != "UPDATE":
+        return False
+    old = event.get("old_record") or {}
+    new = event.get("record") or {}
+    if "symptoms" not in old or "symptoms" not in new:
+        return True
+    return old["symptoms"] != new["symptoms"]
+
+
+class DebouncedRunner:
+    """
+    Runs `handler(key)` once a key has been quiet for `delay` seconds.
+    Repeated submits for the same key push its deadline back, so an edit
+    burst costs one run. At most `concurrency` handlers run at once; keys
+    beyond `max_pending` are dropped (the request path still computes them).
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[str], Awaitable[Any]],
+        delay: float = 2.0,
+        concurrency: int = 2,
+        max_pending: int = 10000,
+    ):
+        self.handler = handler
+        self.delay = delay
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.deadlines: Dict[str, float] = {}
+        self.ready: asyncio.Queue = asyncio.Queue()
+        self.running = set()
+        self.stats = {"submitted": 0, "coalesced": 0, "dropped": 0, "completed": 0, "failed": 0}
+        self._tasks = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def submit(self, key: str):
+        self.stats["submitted"] += 1
+        if key in self.deadlines:
+            self.stats["coalesced"] += 1
+        elif len(self.deadlines) >= self.max_pending:
+            self.stats["dropped"] += 1
+            return
+        self.deadlines[key] = time.monotonic() + self.delay
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._schedule())]
+        self._tasks += [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _schedule(self):
+        while True:
+            now = time.monotonic()
+            due = [k for k, t in self.deadlines.items() if t <= now and k not in self.running]
+            for key in due:
+                del self.deadlines[key]
+                self.running.add(key)
+                self.ready.put_nowait(key)
+            waiting = [t for k, t in self.deadlines.items() if k not in self.running]
+            timeout = max(0.0, min(waiting) - now) if waiting else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        while True:
+            key = await self.ready.get()
+            try:
+                await self.handler(key)
+                self.stats["completed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"Precompute for {key} failed: {e}")
+            finally:
+                self.running.discard(key)
+                # An edit that arrived mid-run is already rescheduled.
+                if self._wakeup:
+                    self._wakeup.set()
+
+
+class LocalChangeFeed:
+    """In-process change feed; stands in for Realtime in dev and tests."""
+
+    def __init__(self):
+        self.subscribers = []
+
+    def subscribe(self, callback: Callable[[ChangeEvent], None]):
+        self.subscribers.append(callback)
+
+    def publish(self, event: ChangeEvent):
+        for callback in self.subscribers:
+            callback(event)
+
+
+def start_realtime_listener(supabase_url: str, api_key: str, feed: LocalChangeFeed, loop: asyncio.AbstractEventLoop):
+    """
+    Subscribe to postgres changes on public.timelines over Supabase Realtime
+    and republish them on `feed` (on the event loop thread). Runs the
+    blocking realtime client in a daemon thread with its own event loop,
+    reconnecting after errors. Returns False if the
+    realtime package is not available.
+    """
+    try:
+        from realtime.connection import Socket
+    except ImportError:
+        logger.warning("realtime package not installed; timeline precompute uses the local feed only")
+        return False
+
+    ws_url = supabase_url.replace("https://", "wss://").replace("http://", "ws://")
+    ws_url = f"{ws_url}/realtime/v1/websocket?apikey={api_key}&vsn=1.0.0"
+
+    def on_change(payload):
+        loop.call_soon_threadsafe(feed.publish, payload)
+
+    def run():
+        # The realtime client drives its coroutines with
+        # asyncio.get_event_loop(), which a plain thread doesn't have.
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        while True:
+            try:
+                socket = Socket(ws_url)
+                socket.connect()
+                channel = socket.set_channel("realtime:public:timelines")
+                channel.join().on("*", on_change)
+                socket.listen()
+            except Exception as e:
+                logger.error(f"Realtime listener error: {e}; reconnecting")
+            time.sleep(5)
+
+    threading.Thread(target=run, name="timeline-realtime", daemon=True).start()
+    logger.info("Subscribed to timeline changes over Supabase Realtime")
+    return True
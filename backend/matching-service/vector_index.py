@@ -0,0 +1,240 @@
+import os
+import sys
+import threading
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.logger import setup_logger
+
+logger = setup_logger("vector-index")
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+# (key, cosine similarity, payload)
+SearchHit = Tuple[Hashable, float, Any]
+
+
+def normalize(vector) -> np.ndarray:
+    v = np.asarray(vector, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(v)
+    return v / norm if norm > 0 else v
+
+
+def take_hits(candidates, k: int, threshold: Optional[float], exclude: set, where: Optional[Callable[[Any], bool]]) -> Tuple[List[SearchHit], bool]:
+    """
+    Up to k hits from (key, score, payload) candidates in descending score
+    order, and whether that is final: k hits found or the threshold reached.
+    Otherwise a wider candidate window may still hold more.
+    """
+    hits = []
+    for key, score, payload in candidates:
+        if threshold is not None and score <= threshold:
+            return hits, True
+        if key is None or key in exclude or (where is not None and not where(payload)):
+            continue
+        hits.append((key, score, payload))
+        if len(hits) == k:
+            return hits, True
+    return hits, False
+
+
+class VectorIndex:
+    """
+    Exact in-memory cosine index. Vectors live in one preallocated float32
+    matrix (grown by doubling); upsert overwrites a row in place and remove
+    moves the last row into the hole, so both are O(1) and the index never
+    needs a rebuild.
+    """
+
+    def __init__(self, dim: int, capacity: int = 1024):
+        self.dim = dim
+        self.matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self.keys: List[Hashable] = []
+        self.payloads: List[Any] = []
+        self.rows: Dict[Hashable, int] = {}
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def upsert(self, key: Hashable, vector, payload: Any = None):
+        v = normalize(vector)
+        if v.shape[0] != self.dim:
+            raise ValueError(f"Expected {self.dim}-d vector, got {v.shape[0]}")
+        with self.lock:
+            row = self.rows.get(key)
+            if row is None:
+                row = len(self.keys)
+                if row >= self.matrix.shape[0]:
+                    grown = np.zeros((self.matrix.shape[0] * 2, self.dim), dtype=np.float32)
+                    grown[:row] = self.matrix[:row]
+                    self.matrix = grown
+                self.keys.append(key)
+                self.payloads.append(payload)
+                self.rows[key] = row
+            else:
+                self.payloads[row] = payload
+            self.matrix[row] = v
+
+    def remove(self, key: Hashable) -> bool:
+        with self.lock:
+            row = self.rows.pop(key, None)
+            if row is None:
+                return False
+            last = len(self.keys) - 1
+            if row != last:
+                self.matrix[row] = self.matrix[last]
+                self.keys[row] = self.keys[last]
+                self.payloads[row] = self.payloads[last]
+                self.rows[self.keys[row]] = row
+            self.keys.pop()
+            self.payloads.pop()
+            return True
+
+    def search(
+        self,
+        query,
+        k: int,
+        threshold: Optional[float] = None,
+        exclude: Iterable[Hashable] = (),
+        where: Optional[Callable[[Any], bool]] = None,
+    ) -> List[SearchHit]:
+        """
+        Top-k above threshold, skipping keys in `exclude` and hits whose
+        payload fails `where`. The candidate window starts at k plus the
+        excluded count and doubles while filtered-out hits leave it short.
+        """
+        q = normalize(query)
+        exclude = set(exclude)
+        with self.lock:
+            n = len(self.keys)
+            if n == 0 or k <= 0:
+                return []
+            scores = self.matrix[:n] @ q
+            take = min(n, k + len(exclude))
+            while True:
+                top = np.argpartition(-scores, take - 1)[:take]
+                top = top[np.argsort(-scores[top])]
+                candidates = ((self.keys[row], float(scores[row]), self.payloads[row]) for row in top)
+                hits, final = take_hits(candidates, k, threshold, exclude, where)
+                if final or take == n:
+                    return hits
+                take = min(n, take * 2)
+
+
+class HnswVectorIndex:
+    """
+    Approximate cosine index on an HNSW graph (hnswlib). Inserts, in-place
+    updates and deletes are incremental and query cost grows roughly
+    logarithmically with size. Deleted slots are reused by later inserts.
+    """
+
+    def __init__(self, dim: int, capacity: int = 1024, ef_construction: int = 200, m: int = 16, ef_search: int = 64):
+        self.dim = dim
+        self.index = hnswlib.Index(space="cosine", dim=dim)
+        self.index.init_index(max_elements=capacity, ef_construction=ef_construction, M=m, allow_replace_deleted=True)
+        self.index.set_ef(ef_search)
+        self.ef_search = ef_search
+        self.labels: Dict[Hashable, int] = {}
+        self.keys: Dict[int, Hashable] = {}
+        self.payloads: Dict[int, Any] = {}
+        self.next_label = 0
+        self.deleted = 0
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, key):
+        return key in self.labels
+
+    def upsert(self, key: Hashable, vector, payload: Any = None):
+        v = normalize(vector)
+        if v.shape[0] != self.dim:
+            raise ValueError(f"Expected {self.dim}-d vector, got {v.shape[0]}")
+        with self.lock:
+            label = self.labels.get(key)
+            if label is not None:
+                # Same label: hnswlib updates the element in place.
+                self.index.add_items(v[None, :], [label])
+                self.payloads[label] = payload
+                return
+            label = self.next_label
+            self.next_label += 1
+            if self.deleted:
+                self.index.add_items(v[None, :], [label], replace_deleted=True)
+                self.deleted -= 1
+            else:
+                if self.index.get_current_count() >= self.index.get_max_elements():
+                    self.index.resize_index(self.index.get_max_elements() * 2)
+                self.index.add_items(v[None, :], [label])
+            self.labels[key] = label
+            self.keys[label] = key
+            self.payloads[label] = payload
+
+    def remove(self, key: Hashable) -> bool:
+        with self.lock:
+            label = self.labels.pop(key, None)
+            if label is None:
+                return False
+            self.index.mark_deleted(label)
+            self.deleted += 1
+            del self.keys[label]
+            del self.payloads[label]
+            return True
+
+    def _knn(self, q: np.ndarray, take: int):
+        self.index.set_ef(max(self.ef_search, take))
+        try:
+            return self.index.knn_query(q[None, :], k=take)
+        except RuntimeError:
+            # The graph walk reached fewer than `take` live elements
+            # (many deletions): search with ef over the whole graph.
+            self.index.set_ef(max(self.index.get_current_count(), take))
+            return self.index.knn_query(q[None, :], k=take)
+
+    def search(
+        self,
+        query,
+        k: int,
+        threshold: Optional[float] = None,
+        exclude: Iterable[Hashable] = (),
+        where: Optional[Callable[[Any], bool]] = None,
+    ) -> List[SearchHit]:
+        """Same contract as VectorIndex.search; a wider window is a new graph query."""
+        q = normalize(query)
+        exclude = set(exclude)
+        with self.lock:
+            # Live elements only: the graph's element count includes deleted ones.
+            live = len(self.labels)
+            if live == 0 or k <= 0:
+                return []
+            take = min(live, k + len(exclude))
+            while True:
+                labels, distances = self._knn(q, take)
+                candidates = (
+                    (self.keys.get(int(label)), 1.0 - float(distance), self.payloads.get(int(label)))
+                    for label, distance in zip(labels[0], distances[0])
+                )
+                hits, final = take_hits(candidates, k, threshold, exclude, where)
+                if final or take == live:
+                    return hits
+                take = min(live, take * 2)
+
+
+def make_vector_index(dim: int, capacity: int = 1024, exact: bool = False):
+    """HNSW index when hnswlib is installed (and exact search not requested), else exact."""
+    if hnswlib is not None and not exact:
+        return HnswVectorIndex(dim, capacity)
+    if not exact:
+        logger.warning("hnswlib not installed; using exact vector index")
+    return VectorIndex(dim, capacity)
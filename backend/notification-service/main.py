@@ -1,7 +1,8 @@
 import sys
 import os
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks
-from pydantic import BaseModel
+from fastapi import FastAPI, Depends, HTTPException
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 
@@ -12,30 +13,37 @@ from shared.auth import get_current_user
 from shared.supabase_client import get_supabase_client
 from shared.logger import setup_logger
 
-app = FastAPI(title="RareMatch Notification Service", version="1.0.0")
+app = FastAPI(title="RareMatch Notification Service", version="1.0.0", default_response_class=ORJSONResponse)
 logger = setup_logger("notification-service")
 
+# Recipients per send-bulk request; larger audiences are sent in several
+# requests, so one insert (and its outbox trigger) stays bounded.
+BULK_MAX_RECIPIENTS = int(os.getenv("BULK_MAX_RECIPIENTS", "1000"))
+
 class NotificationRequest(BaseModel):
     user_id: str
     title: str
     body: str
     data: Optional[Dict[str, Any]] = None
 
+class BulkNotificationRequest(BaseModel):
+    user_ids: List[str] = Field(max_length=BULK_MAX_RECIPIENTS)
+    title: str
+    body: str
+    data: Optional[Dict[str, Any]] = None
+
 @app.get("/health")
 def health_check():
     return {"status": "healthy", "service": "notification-service"}
 
-def send_fcm_push(token: str, title: str, body: str):
-    # Placeholder for FCM logic
-    logger.info(f"Sending FCM push to {token}: {title} - {body}")
-
 @app.post("/notifications/send")
-async def send_notification(request: NotificationRequest, background_tasks: BackgroundTasks, user: dict = Depends(get_current_user)):
+async def send_notification(request: NotificationRequest, user: dict = Depends(get_current_user)):
     """
     Send a notification to a user.
     1. Insert into 'notifications' table (for in-app history).
     2. Trigger Realtime event (via table insert).
-    3. Send Push Notification (if token exists).
+    3. The insert trigger enqueues the push in 'notification_outbox';
+       notification-service/worker.py delivers it.
     """
     supabase = get_supabase_client()
     
@@ -53,18 +61,39 @@ async def send_notification(request: NotificationRequest, background_tasks: Back
         supabase.table("notifications").insert(notification_data).execute()
     except Exception as e:
         logger.error(f"Error saving notification: {e}")
-        # Continue to push even if save fails? Maybe.
-    
-    # 2. Get User's FCM Token (assuming stored in profiles)
+        raise HTTPException(status_code=500, detail="Failed to queue notification")
+
+    return {"status": "queued"}
+
+@app.post("/notifications/send-bulk")
+async def send_bulk_notification(request: BulkNotificationRequest, user: dict = Depends(get_current_user)):
+    """
+    Send the same notification to up to BULK_MAX_RECIPIENTS users (larger
+    lists are rejected with 422). All rows (and, via trigger, their outbox
+    entries) are written in one insert.
+    """
+    user_ids = list(dict.fromkeys(request.user_ids))
+    if not user_ids:
+        raise HTTPException(status_code=400, detail="user_ids must not be empty")
+    supabase = get_supabase_client()
+    created_at = datetime.utcnow().isoformat()
+
+    # 1. Insert all notifications in one batched write
+    rows = [{
+        "user_id": uid,
+        "title": request.title,
+        "body": request.body,
+        "data": request.data,
+        "read": False,
+        "created_at": created_at
+    } for uid in user_ids]
     try:
-        profile_response = supabase.table("profiles").select("fcm_token").eq("id", request.user_id).single().execute()
-        if profile_response.data and profile_response.data.get("fcm_token"):
-            fcm_token = profile_response.data.get("fcm_token")
-            background_tasks.add_task(send_fcm_push, fcm_token, request.title, request.body)
+        supabase.table("notifications").insert(rows).execute()
     except Exception as e:
-        logger.warning(f"Could not fetch FCM token: {e}")
+        logger.error(f"Error saving bulk notifications: {e}")
+        raise HTTPException(status_code=500, detail="Failed to queue notifications")
 
-    return {"status": "queued"}
+    return {"status": "queued", "recipients": len(user_ids)}
 
 if __name__ == "__main__":
     import uvicorn
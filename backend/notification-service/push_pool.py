@@ -0,0 +1,127 @@
+import asyncio
+import os
+import sys
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.logger import setup_logger
+from shared.rate_limit import TokenBucket
+
+logger = setup_logger("push-pool")
+
+PUSH_WORKERS = int(os.getenv("PUSH_WORKERS", "4"))
+PUSH_RATE_PER_SEC = float(os.getenv("PUSH_RATE_PER_SEC", "50"))
+PUSH_QUEUE_SIZE = int(os.getenv("PUSH_QUEUE_SIZE", "10000"))
+
+
+def send_fcm_push(token: str, title: str, body: str, data: Optional[Dict[str, Any]] = None):
+    # Placeholder for FCM logic
+    logger.info(f"Sending FCM push to {token}: {title} - {body}")
+
+
+class PushQueueFull(Exception):
+    pass
+
+
+@dataclass
+class PushMessage:
+    title: str
+    body: str
+    data: Optional[Dict[str, Any]] = None
+    future: Optional[asyncio.Future] = field(default=None, repr=False)
+
+
+def coalesce(messages: List[PushMessage]) -> PushMessage:
+    """Collapse several pending notifications for one device into one push."""
+    if len(messages) == 1:
+        return messages[0]
+    latest = messages[-1]
+    return PushMessage(
+        title=f"You have {len(messages)} new notifications",
+        body=latest.body,
+        data={"count": len(messages), "latest_title": latest.title},
+    )
+
+
+class PushDispatcher:
+    """
+    Bounded worker pool for device pushes.
+    Messages are queued per device token: a token that already has pending
+    messages is not queued again, so a worker sends everything pending for
+    that device as a single push. Sends are throttled by a shared token bucket.
+    `send` is a blocking callable (token, title, body, data) run in a thread.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str, str, str, Optional[Dict[str, Any]]], Any],
+        workers: int = PUSH_WORKERS,
+        rate_per_sec: float = PUSH_RATE_PER_SEC,
+        queue_size: int = PUSH_QUEUE_SIZE,
+    ):
+        self.send = send
+        self.workers = workers
+        self.bucket = TokenBucket(rate_per_sec, max(1.0, rate_per_sec))
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.pending: Dict[str, List[PushMessage]] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def submit(self, token: str, title: str, body: str, data: Optional[Dict[str, Any]] = None) -> asyncio.Future:
+        """
+        Queue a push for `token`. The returned future resolves once the push
+        (possibly coalesced with others) has been sent, or raises if it failed.
+        """
+        future = asyncio.get_running_loop().create_future()
+        # Fire-and-forget callers never await the future; mark errors as seen.
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        message = PushMessage(title, body, data, future)
+
+        if token in self.pending:
+            self.pending[token].append(message)
+            return future
+        try:
+            self.queue.put_nowait(token)
+        except asyncio.QueueFull:
+            raise PushQueueFull(f"Push queue is full ({self.queue.maxsize} devices pending)")
+        self.pending[token] = [message]
+        return future
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Started {self.workers} push workers at {self.bucket.rate}/s")
+
+    async def stop(self, drain: bool = True):
+        if drain:
+            await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, worker_id: int):
+        loop = asyncio.get_running_loop()
+        while True:
+            token = await self.queue.get()
+            messages = self.pending.pop(token, [])
+            try:
+                if not messages:
+                    continue
+                await self.bucket.acquire()
+                push = coalesce(messages)
+                try:
+                    await loop.run_in_executor(None, self.send, token, push.title, push.body, push.data)
+                except Exception as e:
+                    logger.error(f"Push to {token} failed: {e}")
+                    for m in messages:
+                        if m.future and not m.future.done():
+                            m.future.set_exception(e)
+                else:
+                    for m in messages:
+                        if m.future and not m.future.done():
+                            m.future.set_result(len(messages))
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,162 @@
+"""
+Notification outbox worker.
+
+Claims due rows from 'notification_outbox' in batches (claim/lease via the
+claim_notification_outbox RPC), delivers them through the push pool and
+records the outcome. Rows whose lease expires (e.g. the worker died) are
+claimed again by any worker, so running more workers scales delivery; each
+claim counts as an attempt, and rows out of attempts are marked failed.
+
+Usage: python notification-service/worker.py
+"""
+import asyncio
+import os
+import random
+import socket
+import sys
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.dirname(__file__))
+
+from shared.supabase_client import get_supabase_client
+from shared.logger import setup_logger
+from push_pool import PushDispatcher, PushQueueFull, send_fcm_push
+
+logger = setup_logger("notification-worker")
+
+WORKER_ID = os.getenv("OUTBOX_WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "200"))
+LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "60"))
+POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1.0"))
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+BACKOFF_BASE_SECONDS = float(os.getenv("OUTBOX_BACKOFF_BASE_SECONDS", "5"))
+BACKOFF_MAX_SECONDS = float(os.getenv("OUTBOX_BACKOFF_MAX_SECONDS", "3600"))
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Exponential backoff with full jitter."""
+    ceiling = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+class OutboxWorker:
+    def __init__(self, supabase=None, dispatcher: PushDispatcher = None):
+        self.supabase = supabase or get_supabase_client()
+        self.dispatcher = dispatcher or PushDispatcher(send_fcm_push)
+
+    def claim(self) -> List[Dict[str, Any]]:
+        response = self.supabase.rpc("claim_notification_outbox", {
+            "worker_id": WORKER_ID,
+            "batch_size": BATCH_SIZE,
+            "lease_seconds": LEASE_SECONDS,
+            "max_attempts": MAX_ATTEMPTS,
+        }).execute()
+        return response.data or []
+
+    def fetch_tokens(self, user_ids: List[str]) -> Dict[str, str]:
+        response = self.supabase.table("profiles").select("id,fcm_token").in_("id", user_ids).execute()
+        return {p["id"]: p["fcm_token"] for p in response.data or [] if p.get("fcm_token")}
+
+    def _mark(self, ids: List[str], fields: Dict[str, Any]):
+        if ids:
+            self.supabase.table("notification_outbox").update(fields).in_("id", ids).eq("claimed_by", WORKER_ID).execute()
+
+    def record(self, sent: List[str], no_token: List[str], failed: List[Dict[str, Any]]):
+        now = datetime.utcnow()
+        self._mark(sent, {"status": "sent", "lease_expires_at": None, "delivered_at": now.isoformat(), "last_error": None})
+        self._mark(no_token, {"status": "no_token", "lease_expires_at": None})
+
+        # Rows with the same attempt count share a retry time: one update per group.
+        by_attempts: Dict[int, List[Dict[str, Any]]] = {}
+        for row in failed:
+            by_attempts.setdefault(row["attempts"], []).append(row)
+        for attempts, rows in by_attempts.items():
+            ids = [r["id"] for r in rows]
+            error = rows[0]["error"][:500]
+            if attempts >= MAX_ATTEMPTS:
+                self._mark(ids, {"status": "failed", "lease_expires_at": None, "last_error": error})
+            else:
+                retry_at = now + timedelta(seconds=backoff_seconds(attempts))
+                self._mark(ids, {
+                    "status": "pending",
+                    "lease_expires_at": None,
+                    "next_attempt_at": retry_at.isoformat(),
+                    "last_error": error,
+                })
+
+    def release(self, rows: List[Dict[str, Any]]):
+        """Hand back claimed rows that were never tried, without using up an attempt."""
+        by_attempts: Dict[int, List[str]] = {}
+        for row in rows:
+            by_attempts.setdefault(row["attempts"], []).append(row["id"])
+        retry_at = (datetime.utcnow() + timedelta(seconds=POLL_INTERVAL)).isoformat()
+        for attempts, ids in by_attempts.items():
+            self._mark(ids, {
+                "status": "pending",
+                "lease_expires_at": None,
+                "next_attempt_at": retry_at,
+                "attempts": max(0, attempts - 1),
+            })
+
+    async def deliver(self, rows: List[Dict[str, Any]]):
+        loop = asyncio.get_running_loop()
+        user_ids = list({r["user_id"] for r in rows})
+        tokens = await loop.run_in_executor(None, self.fetch_tokens, user_ids)
+
+        no_token, pending, overflow = [], [], []
+        for row in rows:
+            token = tokens.get(row["user_id"])
+            if not token:
+                no_token.append(row["id"])
+                continue
+            try:
+                future = self.dispatcher.submit(token, row["title"], row["body"], row.get("data"))
+            except PushQueueFull:
+                # Only this row didn't fit; it goes back for a later claim.
+                overflow.append(row)
+                continue
+            pending.append((row, future))
+        if overflow:
+            await loop.run_in_executor(None, self.release, overflow)
+
+        results = await asyncio.gather(*(f for _, f in pending), return_exceptions=True)
+        sent, failed = [], []
+        for (row, _), result in zip(pending, results):
+            if isinstance(result, Exception):
+                failed.append({"id": row["id"], "attempts": row["attempts"], "error": str(result)})
+            else:
+                sent.append(row["id"])
+
+        await loop.run_in_executor(None, self.record, sent, no_token, failed)
+        logger.info(
+            f"Outbox batch: {len(sent)} sent, {len(failed)} failed, {len(no_token)} without token, "
+            f"{len(overflow)} released (push queue full)"
+        )
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        await self.dispatcher.start()
+        logger.info(f"Outbox worker {WORKER_ID} started (batch={BATCH_SIZE}, lease={LEASE_SECONDS}s)")
+        try:
+            while True:
+                try:
+                    rows = await loop.run_in_executor(None, self.claim)
+                except Exception as e:
+                    logger.error(f"Failed to claim outbox rows: {e}")
+                    rows = []
+                if not rows:
+                    await asyncio.sleep(POLL_INTERVAL)
+                    continue
+                try:
+                    await self.deliver(rows)
+                except Exception as e:
+                    # Claimed rows are retried once their lease expires.
+                    logger.error(f"Failed to deliver outbox batch: {e}")
+        finally:
+            await self.dispatcher.stop(drain=False)
+
+
+if __name__ == "__main__":
+    asyncio.run(OutboxWorker().run())
@@ -0,0 +1,180 @@
+import ipaddress
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional
+
+from fastapi import HTTPException, Request
+
+from .rate_limit import TokenBucket
+
+# Admission control for expensive endpoints: a per-user token bucket plus a
+# per-endpoint concurrency cap. Requests over either limit are rejected at
+# once (429 for the caller's own rate, 503 when the endpoint is full) with
+# a Retry-After header, instead of queueing until the client times out.
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+# Share of an endpoint's slots that batch callers may hold; the rest is
+# always left for interactive traffic.
+ADMISSION_BATCH_SHARE = float(os.getenv("ADMISSION_BATCH_SHARE", "0.5"))
+# Per-user buckets kept in memory (least recently seen are dropped first).
+ADMISSION_MAX_TRACKED_USERS = int(os.getenv("ADMISSION_MAX_TRACKED_USERS", "10000"))
+# Reverse proxies (comma-separated addresses or CIDRs) whose X-Forwarded-For
+# is trusted. From anyone else the header is ignored: clients could rotate it
+# to get a fresh bucket per request.
+ADMISSION_TRUSTED_PROXIES = [
+    ipaddress.ip_network(entry.strip(), strict=False)
+    for entry in os.getenv("ADMISSION_TRUSTED_PROXIES", "").split(",") if entry.strip()
+]
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITY_HEADER = "X-Request-Priority"
+
+
+def request_priority(request: Request) -> str:
+    """Callers mark background work with 'X-Request-Priority: batch'."""
+    value = request.headers.get(PRIORITY_HEADER, "").strip().lower()
+    return BATCH if value == BATCH else INTERACTIVE
+
+
+def is_trusted_proxy(address: str, proxies=None) -> bool:
+    proxies = ADMISSION_TRUSTED_PROXIES if proxies is None else proxies
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in proxies)
+
+
+def client_address(request: Request, proxies=None) -> str:
+    """
+    The caller's address: the peer, or, when the peer is a trusted proxy,
+    the nearest X-Forwarded-For hop that isn't one (entries left of an
+    untrusted hop may be forged).
+    """
+    address = request.client.host if request.client else "unknown"
+    if not is_trusted_proxy(address, proxies):
+        return address
+    hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        address = hop
+        if not is_trusted_proxy(hop, proxies):
+            break
+    return address
+
+
+def client_key(request: Request, user: Optional[dict] = None) -> str:
+    """
+    Stable per-caller key: the verified user id (from get_current_user) when
+    the endpoint authenticates, else the client address. Unverified request
+    data such as a bearer token is never used, since a caller could vary it
+    to get a fresh bucket per request.
+    """
+    if user and user.get("id"):
+        return f"user:{user['id']}"
+    return "ip:" + client_address(request)
+
+
+class AdmissionGate:
+    """
+    Gate for one expensive endpoint. `rate_per_minute` / `burst` bound each
+    caller; `max_concurrency` bounds the endpoint as a whole (None for no
+    cap), with batch callers limited to `batch_share` of the slots.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: Optional[int],
+        rate_per_minute: float,
+        burst: float,
+        batch_share: float = ADMISSION_BATCH_SHARE,
+        max_users: int = ADMISSION_MAX_TRACKED_USERS,
+        enabled: bool = ADMISSION_ENABLED,
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.batch_limit = None if max_concurrency is None else max(1, int(max_concurrency * batch_share))
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(1.0, burst)
+        self.max_users = max_users
+        self.enabled = enabled
+        self.buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.active = {INTERACTIVE: 0, BATCH: 0}
+        self.lock = threading.Lock()
+        self.stats = {"admitted": 0, "rate_limited": 0, "shed": 0}
+
+    def _bucket(self, key: str) -> TokenBucket:
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+                while len(self.buckets) > self.max_users:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+            return bucket
+
+    def _reject(self, status_code: int, detail: str, retry_after: float):
+        raise HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(max(1, int(retry_after + 0.999)))},
+        )
+
+    def check_rate(self, key: str):
+        """Charge one request to `key`; 429 when the caller is over its rate."""
+        if not self.enabled:
+            return
+        bucket = self._bucket(key)
+        if not bucket.try_acquire():
+            with self.lock:
+                self.stats["rate_limited"] += 1
+            self._reject(429, f"Too many {self.name} requests, slow down", bucket.retry_after())
+
+    def _enter(self, priority: str):
+        with self.lock:
+            if self.max_concurrency is not None:
+                total = self.active[INTERACTIVE] + self.active[BATCH]
+                limit = self.batch_limit if priority == BATCH else self.max_concurrency
+                in_use = self.active[BATCH] if priority == BATCH else total
+                if total >= self.max_concurrency or in_use >= limit:
+                    self.stats["shed"] += 1
+                    return False
+            self.active[priority] += 1
+            self.stats["admitted"] += 1
+            return True
+
+    def _exit(self, priority: str):
+        with self.lock:
+            self.active[priority] -= 1
+
+    @contextmanager
+    def admit(self, key: str, priority: str = INTERACTIVE):
+        """
+        Hold one slot of the endpoint for the duration of the block. Never
+        waits: raises 429/503 HTTPException when the request cannot run now.
+        """
+        if not self.enabled:
+            yield
+            return
+        self.check_rate(key)
+        if not self._enter(priority):
+            self._reject(503, f"{self.name} is at capacity, please retry shortly", 1)
+        try:
+            yield
+        finally:
+            self._exit(priority)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "max_concurrency": self.max_concurrency,
+                "batch_limit": self.batch_limit,
+                "active": dict(self.active),
+                "tracked_users": len(self.buckets),
+                **self.stats,
+            }
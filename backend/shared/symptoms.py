@@ -0,0 +1,99 @@
+import json
+import math
+import os
+import re
+from functools import lru_cache
+from typing import Iterable, List, Optional, Sequence, Set
+
+DICTIONARY_PATH = os.path.join(os.path.dirname(__file__), "symptom_dictionary.json")
+
+
+@lru_cache(maxsize=8192)
+def canonical_symptom(name: str) -> str:
+    """Lowercase and collapse spaces/underscores: 'Spotting_ urination' -> 'spotting_urination'."""
+    return re.sub(r"[\s_]+", "_", name.strip().lower()).strip("_")
+
+
+class SymptomDictionary:
+    """
+    The shared symptom dictionary: stable integer IDs for every known
+    symptom, with the model feature column each one maps to. Generated by
+    infrastructure/scripts/build_symptom_dictionary.py; IDs never change
+    once assigned, so services can exchange them instead of names.
+    """
+
+    def __init__(self, entries: List[dict], version: str = ""):
+        self.version = version
+        size = max((e["id"] for e in entries), default=-1) + 1
+        self.names: List[Optional[str]] = [None] * size
+        self.features: List[Optional[str]] = [None] * size
+        self._ids = {}
+        for e in entries:
+            self.names[e["id"]] = e["name"]
+            self.features[e["id"]] = e.get("feature")
+            self._ids[e["name"]] = e["id"]
+            for alias in e.get("aliases", []):
+                self._ids[canonical_symptom(alias)] = e["id"]
+
+    @classmethod
+    def load(cls, path: str = DICTIONARY_PATH) -> "SymptomDictionary":
+        with open(path, "r") as f:
+            data = json.load(f)
+        return cls(data["symptoms"], data.get("version", ""))
+
+    def __len__(self):
+        return len(self.names)
+
+    def id_of(self, name: str) -> Optional[int]:
+        return self._ids.get(canonical_symptom(name))
+
+    def ids(self, names: Iterable[str]) -> List[int]:
+        """IDs of the known names, de-duplicated, in input order."""
+        seen = []
+        for name in names:
+            symptom_id = self.id_of(name)
+            if symptom_id is not None and symptom_id not in seen:
+                seen.append(symptom_id)
+        return seen
+
+    def name_of(self, symptom_id: int) -> Optional[str]:
+        return self.names[symptom_id] if 0 <= symptom_id < len(self.names) else None
+
+    def feature_of(self, symptom_id: int) -> Optional[str]:
+        return self.features[symptom_id] if 0 <= symptom_id < len(self.features) else None
+
+
+def idf_weights(size: int, documents: Iterable[Iterable[int]], counts: Optional[Iterable[int]] = None) -> List[float]:
+    """
+    Smoothed IDF per symptom ID: log((1 + N) / (1 + df)) + 1. `counts`
+    gives each document's multiplicity (collapsed reference prototypes).
+    """
+    n = 0
+    df = [0] * size
+    counts = iter(counts) if counts is not None else None
+    for doc in documents:
+        count = int(next(counts)) if counts is not None else 1
+        n += count
+        for symptom_id in set(doc):
+            if 0 <= symptom_id < size:
+                df[symptom_id] += count
+    return [math.log((1 + n) / (1 + d)) + 1.0 for d in df]
+
+
+def weighted_jaccard(a: Set[int], b: Set[int], weights: Sequence[float]) -> float:
+    if not a or not b:
+        return 0.0
+    union_weight = sum(weights[i] for i in a | b)
+    if union_weight <= 0:
+        return 0.0
+    return sum(weights[i] for i in a & b) / union_weight
+
+
+_dictionary: Optional[SymptomDictionary] = None
+
+
+def get_symptom_dictionary() -> SymptomDictionary:
+    global _dictionary
+    if _dictionary is None:
+        _dictionary = SymptomDictionary.load()
+    return _dictionary
@@ -1,9 +1,13 @@
 import sys
 import os
-from fastapi import FastAPI, Depends, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, Field, field_validator
 from typing import List, Optional, Dict, Any
 from datetime import datetime
+import base64
+import hashlib
+import uuid
 
 # Add parent directory to path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
@@ -12,16 +16,33 @@ from shared.auth import get_current_user
 from shared.supabase_client import get_supabase_client
 from shared.logger import setup_logger
 
-app = FastAPI(title="RareMatch Timeline Service", version="1.0.0")
+app = FastAPI(title="RareMatch Timeline Service", version="1.0.0", default_response_class=ORJSONResponse)
 logger = setup_logger("timeline-service")
 
 class SymptomEntry(BaseModel):
+    # Stable entry id, used by the per-symptom add/update/remove operations.
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     symptom_name: str
     severity: int # 1-10
     start_date: str # YYYY-MM-DD
     end_date: Optional[str] = None
     notes: Optional[str] = None
 
+class SymptomPatch(BaseModel):
+    symptom_name: Optional[str] = None
+    severity: Optional[int] = None
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    notes: Optional[str] = None
+
+    # Omitted means unchanged; required entry fields can't be cleared.
+    @field_validator("symptom_name", "severity", "start_date", mode="before")
+    @classmethod
+    def required_not_null(cls, value):
+        if value is None:
+            raise ValueError("cannot be null")
+        return value
+
 class TimelineCreate(BaseModel):
     title: str
     description: Optional[str] = None
@@ -55,18 +76,87 @@ def create_timeline(timeline: TimelineCreate, user: dict = Depends(get_current_u
         data["id"] = "mock-timeline-id"
         return data
 
+# List projection: heavy columns (symptoms JSON, embedding vector) are opt-in.
+TIMELINE_FIELDS = {"id", "user_id", "title", "description", "symptoms", "embedding", "created_at", "updated_at"}
+DEFAULT_LIST_FIELDS = ["id", "title", "description", "created_at", "updated_at"]
+# Always selected: needed for the keyset cursor and the ETag.
+KEY_FIELDS = ["id", "created_at", "updated_at"]
+MAX_PAGE_SIZE = 100
+
+def encode_cursor(row: dict) -> str:
+    raw = f"{row['created_at']}|{row['id']}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    # Both parts end up in a PostgREST filter string, so they must be
+    # exactly a timestamp and a UUID.
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, timeline_id = raw.rsplit("|", 1)
+        datetime.fromisoformat(created_at)
+        return created_at, str(uuid.UUID(timeline_id))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    if not fields:
+        requested = DEFAULT_LIST_FIELDS
+    else:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = set(requested) - TIMELINE_FIELDS
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return list(dict.fromkeys(KEY_FIELDS + requested))
+
+def page_etag(rows: List[dict], columns: List[str]) -> str:
+    digest = hashlib.sha1(",".join(columns).encode())
+    for row in rows:
+        digest.update(f"|{row['id']}:{row['updated_at']}".encode())
+    return f'W/"{digest.hexdigest()}"'
+
 @app.get("/timelines")
-def list_timelines(user: dict = Depends(get_current_user)):
+def list_timelines(
+    request: Request,
+    response: Response,
+    after: Optional[str] = Query(None, description="Cursor from the previous page's X-Next-Cursor header"),
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = Query(None, description="Comma-separated columns; embedding and symptoms are excluded by default"),
+    user: dict = Depends(get_current_user),
+):
+    """
+    List the user's timelines, newest first, using keyset pagination.
+    The next page cursor is returned in the X-Next-Cursor header. The ETag is
+    derived from the page's ids and updated_at values, so unchanged pages
+    answer If-None-Match with 304.
+    """
     user_id = user.get("id")
     supabase = get_supabase_client()
-    
+    columns = parse_fields(fields)
+
     try:
-        response = supabase.table("timelines").select("*").eq("user_id", user_id).execute()
-        return response.data
+        query = supabase.table("timelines").select(",".join(columns)).eq("user_id", user_id)
+        if after:
+            created_at, timeline_id = decode_cursor(after)
+            query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{timeline_id})')
+        rows = query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1).execute().data
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error listing timelines: {e}")
         raise HTTPException(status_code=500, detail="Failed to list timelines")
 
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    etag = page_etag(rows, columns)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if has_more:
+        headers["X-Next-Cursor"] = encode_cursor(rows[-1])
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return rows
+
 @app.get("/timelines/{timeline_id}")
 def get_timeline(timeline_id: str, user: dict = Depends(get_current_user)):
     user_id = user.get("id")
@@ -96,6 +186,57 @@ def update_timeline(timeline_id: str, timeline: TimelineUpdate, user: dict = Dep
         logger.error(f"Error updating timeline: {e}")
         raise HTTPException(status_code=500, detail="Failed to update timeline")
 
+def apply_symptom_op(function: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Run one of the timeline_*_symptom SQL functions. They edit the symptoms
+    JSONB in place, bump updated_at, record a row in 'timeline_events' and
+    return the compact diff.
+    """
+    supabase = get_supabase_client()
+    try:
+        diff = supabase.rpc(function, params).execute().data
+    except Exception as e:
+        logger.error(f"Error applying {function}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to update symptoms")
+    if not diff:
+        raise HTTPException(status_code=404, detail="Timeline not found")
+    if diff.get("error") == "symptom_not_found":
+        raise HTTPException(status_code=404, detail="Symptom not found")
+    if diff.get("error") == "symptom_exists":
+        raise HTTPException(status_code=409, detail="Symptom id already exists")
+    return diff
+
+@app.post("/timelines/{timeline_id}/symptoms")
+def add_symptom(timeline_id: str, symptom: SymptomEntry, user: dict = Depends(get_current_user)):
+    """Append one symptom entry without resending the timeline. 409 if its id is taken."""
+    return apply_symptom_op("timeline_add_symptom", {
+        "p_timeline_id": timeline_id,
+        "p_user_id": user.get("id"),
+        "p_entry": symptom.dict(),
+    })
+
+@app.patch("/timelines/{timeline_id}/symptoms/{symptom_id}")
+def update_symptom(timeline_id: str, symptom_id: str, changes: SymptomPatch, user: dict = Depends(get_current_user)):
+    """Update fields of one symptom entry; the diff lists only changed fields."""
+    fields = changes.dict(exclude_unset=True)
+    if not fields:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    return apply_symptom_op("timeline_update_symptom", {
+        "p_timeline_id": timeline_id,
+        "p_user_id": user.get("id"),
+        "p_symptom_id": symptom_id,
+        "p_changes": fields,
+    })
+
+@app.delete("/timelines/{timeline_id}/symptoms/{symptom_id}")
+def remove_symptom(timeline_id: str, symptom_id: str, user: dict = Depends(get_current_user)):
+    """Remove one symptom entry."""
+    return apply_symptom_op("timeline_remove_symptom", {
+        "p_timeline_id": timeline_id,
+        "p_user_id": user.get("id"),
+        "p_symptom_id": symptom_id,
+    })
+
 @app.delete("/timelines/{timeline_id}")
 def delete_timeline(timeline_id: str, user: dict = Depends(get_current_user)):
     user_id = user.get("id")
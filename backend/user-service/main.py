@@ -1,6 +1,7 @@
 import sys
 import os
 from fastapi import FastAPI, Depends, HTTPException, Body
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import Optional
 
@@ -11,7 +12,7 @@ from shared.auth import get_current_user
 from shared.supabase_client import get_supabase_client
 from shared.logger import setup_logger
 
-app = FastAPI(title="RareMatch User Service", version="1.0.0")
+app = FastAPI(title="RareMatch User Service", version="1.0.0", default_response_class=ORJSONResponse)
 logger = setup_logger("user-service")
 
 class UserProfile(BaseModel):
@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+import hashlib
+import pandas as pd
+
+# Builds backend/shared/symptom_dictionary.json from the AI service vocab and
+# model metadata. Existing IDs are kept; new symptoms get the next free ID,
+# so IDs stay stable across regenerations.
+#
+# Usage: python infrastructure/scripts/build_symptom_dictionary.py
+
+ROOT = os.path.join(os.path.dirname(__file__), "..", "..")
+sys.path.append(os.path.join(ROOT, "backend"))
+
+from shared.symptoms import DICTIONARY_PATH, canonical_symptom
+
+VOCAB_PATH = os.path.join(ROOT, "backend", "ai-service", "symptom_vocab.csv")
+METADATA_PATHS = [
+    os.path.join(ROOT, "backend", "ai-service", "rare_match_metadata.json"),
+    os.path.join(ROOT, "backend", "matching-service", "rare_match_metadata.json"),
+]
+
+def build_dictionary():
+    existing = []
+    if os.path.exists(DICTIONARY_PATH):
+        with open(DICTIONARY_PATH, "r") as f:
+            existing = json.load(f)["symptoms"]
+    entries = {e["name"]: e for e in existing}
+    for e in entries.values():
+        e["aliases"] = set(e.get("aliases", []))
+
+    # name -> (feature column, raw spellings)
+    found = {}
+    for path in METADATA_PATHS:
+        with open(path, "r") as f:
+            for col in json.load(f).get("feature_cols", []):
+                if col.startswith("sym_"):
+                    raw = col[len("sym_"):]
+                    name = canonical_symptom(raw)
+                    found.setdefault(name, [col, set()])[1].add(raw)
+    for raw in pd.read_csv(VOCAB_PATH)["symptom"].astype(str):
+        name = canonical_symptom(raw)
+        found.setdefault(name, [f"sym_{raw}", set()])[1].add(raw)
+
+    next_id = max((e["id"] for e in entries.values()), default=-1) + 1
+    for name in sorted(found):
+        feature, raws = found[name]
+        if name not in entries:
+            entries[name] = {"id": next_id, "name": name, "feature": feature, "aliases": set()}
+            next_id += 1
+        entry = entries[name]
+        entry["feature"] = entry.get("feature") or feature
+        entry["aliases"] |= {r for r in raws if r != name}
+
+    symptoms = []
+    for e in sorted(entries.values(), key=lambda e: e["id"]):
+        item = {"id": e["id"], "name": e["name"], "feature": e["feature"]}
+        if e["aliases"]:
+            item["aliases"] = sorted(e["aliases"])
+        symptoms.append(item)
+
+    version = hashlib.sha1(json.dumps(symptoms, sort_keys=True).encode()).hexdigest()[:12]
+    with open(DICTIONARY_PATH, "w") as f:
+        json.dump({"version": version, "symptoms": symptoms}, f, indent=2)
+        f.write("\n")
+    print(f"Wrote {len(symptoms)} symptoms to {DICTIONARY_PATH} (version {version})")
+
+if __name__ == "__main__":
+    build_dictionary()
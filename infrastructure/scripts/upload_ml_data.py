@@ -1,5 +1,6 @@
 import os
 import sys
+import hashlib
 import json
 import numpy as np
 import pandas as pd
@@ -12,28 +13,148 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY") # Or SERVICE_ROLE_KEY if RLS blocks insert
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    print("Error: SUPABASE_URL or SUPABASE_ANON_KEY not found in .env")
-    sys.exit(1)
+def get_client() -> Client:
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        print("Error: SUPABASE_URL or SUPABASE_ANON_KEY not found in .env")
+        sys.exit(1)
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "..", "backend"))
+from shared.symptoms import get_symptom_dictionary
+
+symptom_dictionary = get_symptom_dictionary()
+
+# Reference rows with the same diagnosis whose symptom sets are at least this
+# similar (Jaccard) are stored as one prototype; 1.0 collapses exact
+# duplicates only.
+NEAR_DUPLICATE_JACCARD = float(os.getenv("REFERENCE_NEAR_DUPLICATE_JACCARD", "1.0"))
 
 # Paths
 BASE_DIR = os.path.join(os.path.dirname(__file__), "Dataset-training")
 EMBEDDINGS_PATH = os.path.join(BASE_DIR, "patient_embeddings.npy")
 MASTER_CSV_PATH = os.path.join(BASE_DIR, "ml_master_patients.csv")
 METADATA_PATH = os.path.join(BASE_DIR, "rare_match_metadata.json")
+EMBEDDING_MODEL_PATH = os.path.join(BASE_DIR, "rare_match_embedding_model.h5")
+
+def embedding_model_version():
+    """
+    Embedding space of patient_embeddings.npy, stored with every row: the
+    matching service only compares a query with reference embeddings of the
+    same space. REFERENCE_EMBEDDING_MODEL overrides (use the AI service's
+    "embedding_space" from GET /models when the model inherited a space);
+    otherwise it is derived from the model file the way the AI service names
+    unversioned models ("emb-" + file digest).
+    """
+    if os.getenv("REFERENCE_EMBEDDING_MODEL"):
+        return os.getenv("REFERENCE_EMBEDDING_MODEL")
+    if not os.path.exists(EMBEDDING_MODEL_PATH):
+        return None
+    digest = hashlib.sha1()
+    with open(EMBEDDING_MODEL_PATH, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return f"emb-{digest.hexdigest()[:12]}"
+
+def collapse_prototypes(cases, threshold=NEAR_DUPLICATE_JACCARD):
+    """
+    Collapse cases with the same diagnosis and identical (or, below 1.0,
+    near-identical) symptom sets into prototype records. Larger groups seed
+    prototypes first; a prototype keeps its seed's symptoms and first
+    patient as the representative shown in results, the mean embedding of
+    all members, their count as multiplicity and their patient IDs.
+    Output order is deterministic, so interrupted uploads can resume.
+    """
+    groups = {}
+    for case in cases:
+        key = (case["diagnosis_label"], frozenset(case["symptom_ids"]))
+        groups.setdefault(key, []).append(case)
+
+    prototypes = {}  # diagnosis -> [(symptom set, members)]
+    for (diagnosis, symptom_set), members in sorted(groups.items(), key=lambda g: -len(g[1])):
+        candidates = prototypes.setdefault(diagnosis, [])
+        for proto_set, proto_members in candidates:
+            union = len(proto_set | symptom_set)
+            if threshold < 1.0 and union and len(proto_set & symptom_set) / union >= threshold:
+                proto_members.extend(members)
+                break
+        else:
+            candidates.append((symptom_set, list(members)))
+
+    records = []
+    for diagnosis, candidates in prototypes.items():
+        for proto_set, members in candidates:
+            representative = members[0]
+            symptom_ids = sorted(representative["symptom_ids"])
+            records.append({
+                "patient_id": representative["patient_id"],
+                "diagnosis_label": diagnosis,
+                "symptoms": [symptom_dictionary.name_of(s) for s in symptom_ids], # Store as JSON array
+                "symptom_ids": symptom_ids,
+                "embedding": np.mean([m["embedding"] for m in members], axis=0).tolist(),
+                "multiplicity": len(members),
+                "member_patient_ids": [m["patient_id"] for m in members],
+            })
+    return records
+
+class ResumeConflict(Exception):
+    pass
+
+def fetch_existing(supabase, embedding_model, page_size=1000):
+    """reference_cases rows (patient_id, member_patient_ids) already uploaded for this model."""
+    rows = []
+    last_id = None
+    while True:
+        query = supabase.table("reference_cases").select("id,patient_id,member_patient_ids,embedding_model")
+        if last_id:
+            query = query.gt("id", last_id)
+        page = query.order("id").limit(page_size).execute().data or []
+        rows.extend(page)
+        if len(page) < page_size:
+            return [r for r in rows if r.get("embedding_model") in (embedding_model, None)]
+        last_id = page[-1]["id"]
+
+def records_to_resume(records, existing):
+    """
+    The prototypes not uploaded yet, matched on patient IDs (not on row
+    counts, which differ between per-patient rows and prototypes).
+    Raises ResumeConflict when the table holds rows this upload would
+    duplicate: per-patient rows from before prototypes, or prototypes
+    grouped differently (e.g. another near-duplicate threshold).
+    """
+    legacy = sum(1 for row in existing if row.get("member_patient_ids") is None)
+    if legacy:
+        raise ResumeConflict(f"{legacy} reference cases predate prototypes (one row per patient, no member_patient_ids)")
+    covered = {}  # member patient -> representative of the row covering it
+    for row in existing:
+        for member in row["member_patient_ids"]:
+            covered[member] = row["patient_id"]
+
+    pending = []
+    for record in records:
+        owners = {covered.get(member) for member in record["member_patient_ids"]}
+        if owners == {None}:
+            pending.append(record)
+        elif owners != {record["patient_id"]}:
+            raise ResumeConflict(f"prototype {record['patient_id']} is grouped differently in the existing rows")
+    return pending
 
 def upload_data():
+    supabase = get_client()
     print("Loading data...")
     
     if not os.path.exists(EMBEDDINGS_PATH):
         print(f"Error: {EMBEDDINGS_PATH} not found.")
         return
 
+    embedding_model = embedding_model_version()
+    if not embedding_model:
+        print(f"Error: set REFERENCE_EMBEDDING_MODEL (or provide {EMBEDDING_MODEL_PATH}) "
+              f"to the AI service model version that produced the embeddings.")
+        return
+
     # Load Embeddings
     embeddings = np.load(EMBEDDINGS_PATH)
-    print(f"Loaded embeddings shape: {embeddings.shape}")
+    print(f"Loaded embeddings shape: {embeddings.shape} (model {embedding_model})")
 
     # Load Master CSV for metadata (diagnosis, symptoms)
     df = pd.read_csv(MASTER_CSV_PATH)
@@ -44,26 +165,9 @@ def upload_data():
         metadata = json.load(f)
         label_cols = metadata.get("label_cols", [])
 
-    # Prepare batch
-    records = []
-    batch_size = 100
-    total_records = len(df)
-
-    # Check existing count
-    try:
-        count_response = supabase.table("reference_cases").select("id", count="exact").execute()
-        existing_count = count_response.count
-        print(f"Found {existing_count} existing records.")
-    except Exception as e:
-        print(f"Error checking count: {e}")
-        existing_count = 0
-
-    print(f"Preparing to upload {total_records} records (skipping first {existing_count})...")
-
+    # Build one case per patient
+    cases = []
     for i, row in df.iterrows():
-        if i < existing_count:
-            continue
-            
         # Extract Diagnosis (Label)
         # Find which label column is 1
         diagnosis = "Unknown"
@@ -79,18 +183,41 @@ def upload_data():
             if col.startswith("sym_") and row[col] == 1:
                 symptoms.append(col.replace("sym_", ""))
 
-        record = {
+        cases.append({
             "patient_id": f"pat_{i}", # Generate a simple ID or use one if exists
             "diagnosis_label": diagnosis,
-            "symptoms": symptoms, # Store as JSON array
-            "embedding": embeddings[i].tolist()
-        }
+            "symptom_ids": symptom_dictionary.ids(symptoms),
+            "embedding": embeddings[i],
+        })
+
+    # Collapse duplicate symptom sets; only prototypes are searched
+    records_to_upload = collapse_prototypes(cases)
+    for record in records_to_upload:
+        record["embedding_model"] = embedding_model
+    print(f"Collapsed {len(cases)} patients into {len(records_to_upload)} prototypes "
+          f"(near-duplicate Jaccard >= {NEAR_DUPLICATE_JACCARD})")
+
+    # Prepare batch
+    records = []
+    batch_size = 100
+    total_records = len(records_to_upload)
+
+    # Resume: skip prototypes whose patients are already uploaded
+    try:
+        existing = fetch_existing(supabase, embedding_model)
+        records_to_upload = records_to_resume(records_to_upload, existing)
+    except ResumeConflict as e:
+        print(f"Error: {e}. Truncate reference_cases and run again.")
+        return
+    print(f"Found {len(existing)} existing records; uploading {len(records_to_upload)} of {total_records} prototypes...")
+
+    for i, record in enumerate(records_to_upload):
         records.append(record)
 
         if len(records) >= batch_size:
             try:
                 supabase.table("reference_cases").insert(records).execute()
-                print(f"Uploaded batch {i+1}/{total_records}")
+                print(f"Uploaded batch {i+1}/{len(records_to_upload)}")
             except Exception as e:
                 print(f"Error uploading batch: {e}")
             records = []
@@ -30,16 +30,38 @@ create table if not exists public.timelines (
   title text not null,
   description text,
   symptoms jsonb not null default '[]'::jsonb,
-  embedding vector(768), -- Gemini Embedding
+  embedding vector(256), -- AI service embedding model (EMBEDDING_DIM)
+  embedding_fingerprint text, -- hash of the symptom set the embedding was computed from
+  embedding_model text, -- embedding space (AI service) the embedding was computed in
+  embedding_diagnoses jsonb, -- top diagnosis probabilities predicted with the embedding
   created_at timestamp with time zone default timezone('utc'::text, now()) not null,
   updated_at timestamp with time zone default timezone('utc'::text, now()) not null
 );
+alter table public.timelines add column if not exists embedding_fingerprint text;
+alter table public.timelines add column if not exists embedding_model text;
+alter table public.timelines add column if not exists embedding_diagnoses jsonb;
 alter table public.timelines enable row level security;
 
 create policy "Users can view their own timelines" on public.timelines for select using (auth.uid() = user_id);
 create policy "Users can insert their own timelines" on public.timelines for insert with check (auth.uid() = user_id);
 create policy "Users can update their own timelines" on public.timelines for update using (auth.uid() = user_id);
 create policy "Users can delete their own timelines" on public.timelines for delete using (auth.uid() = user_id);
+create index if not exists timelines_user_created_idx on public.timelines(user_id, created_at desc, id desc);
+
+-- 3b. TIMELINE EVENTS (Per-symptom change feed)
+create table if not exists public.timeline_events (
+  id bigint generated always as identity primary key,
+  timeline_id uuid references public.timelines(id) on delete cascade not null,
+  user_id uuid references auth.users not null,
+  op text not null, -- symptom_added | symptom_updated | symptom_removed
+  symptom_id text,
+  diff jsonb not null,
+  created_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+alter table public.timeline_events enable row level security;
+
+create policy "Users can view their own timeline events" on public.timeline_events for select using (auth.uid() = user_id);
+create index if not exists timeline_events_timeline_id_idx on public.timeline_events(timeline_id, id);
 
 -- 4. NOTIFICATIONS
 create table if not exists public.notifications (
@@ -55,13 +77,36 @@ alter table public.notifications enable row level security;
 
 create policy "Users can view their own notifications" on public.notifications for select using (auth.uid() = user_id);
 
+-- 4b. NOTIFICATION OUTBOX (Push delivery queue, drained by notification-service/worker.py)
+create table if not exists public.notification_outbox (
+  id uuid default gen_random_uuid() primary key,
+  notification_id uuid references public.notifications(id) on delete cascade,
+  user_id uuid references auth.users not null,
+  title text not null,
+  body text not null,
+  data jsonb,
+  status text not null default 'pending', -- pending | claimed | sent | no_token | failed
+  attempts int not null default 0,
+  next_attempt_at timestamp with time zone default now() not null,
+  claimed_by text,
+  lease_expires_at timestamp with time zone,
+  last_error text,
+  delivered_at timestamp with time zone,
+  created_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+alter table public.notification_outbox enable row level security;
+create index if not exists notification_outbox_due_idx on public.notification_outbox(next_attempt_at) where status in ('pending', 'claimed');
+
 -- 5. MATCHES (Cache)
 create table if not exists public.matches (
   id uuid default gen_random_uuid() primary key,
   timeline_id uuid references public.timelines(id) on delete cascade not null,
-  match_data jsonb not null,
+  match_data jsonb, -- legacy; new rows store match_json
+  match_json text, -- match list serialized once by the matching service, served verbatim
   created_at timestamp with time zone default timezone('utc'::text, now()) not null
 );
+alter table public.matches add column if not exists match_json text;
+alter table public.matches alter column match_data drop not null;
 alter table public.matches enable row level security;
 
 create policy "Users can view their own matches" on public.matches for select using (
@@ -70,10 +115,17 @@ create policy "Users can view their own matches" on public.matches for select us
 create policy "Users can insert their own matches" on public.matches for insert with check (
   exists (select 1 from public.timelines where timelines.id = matches.timeline_id and timelines.user_id = auth.uid())
 );
+create policy "Users can update their own matches" on public.matches for update using (
+  exists (select 1 from public.timelines where timelines.id = matches.timeline_id and timelines.user_id = auth.uid())
+);
 create policy "Users can delete their own matches" on public.matches for delete using (
   exists (select 1 from public.timelines where timelines.id = matches.timeline_id and timelines.user_id = auth.uid())
 );
-create index if not exists matches_timeline_id_idx on public.matches(timeline_id);
+-- One cached list per timeline: the matching service upserts on timeline_id.
+delete from public.matches a using public.matches b
+  where a.timeline_id = b.timeline_id and (a.created_at, a.id) < (b.created_at, b.id);
+drop index if exists public.matches_timeline_id_idx;
+create unique index if not exists matches_timeline_id_key on public.matches(timeline_id);
 
 -- 6. MATCH FEEDBACK
 create table if not exists public.match_feedback (
@@ -89,6 +141,23 @@ alter table public.match_feedback enable row level security;
 create policy "Users can insert their own feedback" on public.match_feedback for insert with check (auth.uid() = user_id);
 create policy "Users can view their own feedback" on public.match_feedback for select using (auth.uid() = user_id);
 
+-- One vote per user, timeline and match (the latest one wins).
+delete from public.match_feedback a using public.match_feedback b
+  where a.user_id = b.user_id and a.timeline_id = b.timeline_id and a.match_id = b.match_id
+    and (a.created_at, a.id) < (b.created_at, b.id);
+create unique index if not exists match_feedback_vote_key on public.match_feedback(user_id, timeline_id, match_id);
+
+-- 6b. MATCH FEEDBACK AGGREGATES (Helpfulness per reference case + symptom set)
+create table if not exists public.match_feedback_aggregates (
+    reference_case_id text not null,
+    symptom_fingerprint text not null,
+    helpful_count int not null default 0,
+    total_count int not null default 0,
+    updated_at timestamp with time zone default now(),
+    primary key (reference_case_id, symptom_fingerprint)
+);
+alter table public.match_feedback_aggregates enable row level security;
+
 -- 7. ML TRAINING DATA (Collection)
 create table if not exists public.training_data (
   id uuid default gen_random_uuid() primary key,
@@ -107,11 +176,82 @@ create table if not exists public.reference_cases (
   patient_id text,
   diagnosis_label text,
   symptoms jsonb,
-  embedding vector(768),
+  symptom_ids int[], -- IDs from backend/shared/symptom_dictionary.json
+  embedding vector(256),
+  seq bigint generated always as identity, -- insertion order, for incremental loads
+  multiplicity int not null default 1, -- patients collapsed into this prototype at upload
+  member_patient_ids text[], -- all of them; patient_id is the representative shown
+  embedding_model text, -- embedding space (AI service) of the embedding; null: baseline space
   created_at timestamp with time zone default timezone('utc'::text, now()) not null
 );
 alter table public.reference_cases enable row level security;
 create policy "Public can view reference cases" on public.reference_cases for select using (true);
+create unique index if not exists reference_cases_seq_idx on public.reference_cases(seq);
+create index if not exists reference_cases_embedding_model_idx on public.reference_cases(embedding_model);
+
+-- Reference data version marker, polled by the matching service to keep its
+-- in-memory index current. Every write bumps `version`; anything other than
+-- an insert also bumps `generation`, which forces a full rebuild instead of
+-- an append of the new rows. `max_seq` is the highest seq committed so far.
+create table if not exists public.reference_data_version (
+  name text primary key,
+  version bigint not null default 0,
+  generation bigint not null default 0,
+  max_seq bigint not null default 0,
+  updated_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+alter table public.reference_data_version enable row level security;
+create policy "Public can view reference data version" on public.reference_data_version for select using (true);
+insert into public.reference_data_version (name) values ('reference_cases') on conflict (name) do nothing;
+
+create or replace function public.bump_reference_data_version()
+returns trigger
+language plpgsql
+security definer
+as $$
+begin
+  update public.reference_data_version
+    set version = version + 1,
+        generation = generation + case when tg_op = 'INSERT' then 0 else 1 end,
+        max_seq = case when tg_op = 'TRUNCATE' then 0 else max_seq end,
+        updated_at = timezone('utc'::text, now())
+    where name = tg_table_name;
+  return null;
+end;
+$$;
+
+drop trigger if exists reference_cases_version on public.reference_cases;
+create trigger reference_cases_version
+  after insert or update or delete on public.reference_cases
+  for each statement execute function public.bump_reference_data_version();
+drop trigger if exists reference_cases_version_truncate on public.reference_cases;
+create trigger reference_cases_version_truncate
+  after truncate on public.reference_cases
+  for each statement execute function public.bump_reference_data_version();
+
+-- Runs at commit time (deferred): identity values are handed out at insert,
+-- so a transaction can commit a seq below one another transaction already
+-- committed, after the matching service appended past it. Such a row
+-- bumps generation so the service rebuilds instead of missing it.
+create or replace function public.check_reference_seq_order()
+returns trigger
+language plpgsql
+security definer
+as $$
+begin
+  update public.reference_data_version
+    set generation = generation + case when new.seq < max_seq then 1 else 0 end,
+        max_seq = greatest(max_seq, new.seq),
+        updated_at = timezone('utc'::text, now())
+    where name = tg_table_name;
+  return null;
+end;
+$$;
+drop trigger if exists reference_cases_seq_order on public.reference_cases;
+create constraint trigger reference_cases_seq_order
+  after insert on public.reference_cases
+  deferrable initially deferred
+  for each row execute function public.check_reference_seq_order();
 
 -- 9. STORAGE BUCKETS
 insert into storage.buckets (id, name, public) values ('reports', 'reports', true) on conflict (id) do nothing;
@@ -153,9 +293,250 @@ $$ language plpgsql security definer;
 drop trigger if exists on_timeline_created_for_ml on public.timelines;
 create trigger on_timeline_created_for_ml after insert on public.timelines for each row execute procedure public.archive_timeline_for_training();
 
+-- Enqueue Push for every Notification (same transaction as the insert)
+create or replace function public.enqueue_notification_push() returns trigger as $$
+begin
+  insert into public.notification_outbox (notification_id, user_id, title, body, data)
+  values (new.id, new.user_id, new.title, new.body, new.data);
+  return new;
+end;
+$$ language plpgsql security definer;
+
+drop trigger if exists on_notification_created_enqueue_push on public.notifications;
+create trigger on_notification_created_enqueue_push after insert on public.notifications for each row execute procedure public.enqueue_notification_push();
+
+-- Claim a batch of due outbox rows (expired leases are reclaimed until
+-- their attempts run out)
+create or replace function claim_notification_outbox (
+  worker_id text,
+  batch_size int,
+  lease_seconds int,
+  max_attempts int
+) returns setof public.notification_outbox language plpgsql as $$
+begin
+  -- An expired lease means the worker died mid-delivery; that counts as an
+  -- attempt, so rows that used their last one are dead-lettered instead of
+  -- being reclaimed (a message that crashes its worker would loop forever).
+  update public.notification_outbox o
+  set status = 'failed',
+      lease_expires_at = null,
+      last_error = 'lease expired after ' || o.attempts || ' attempts'
+  where o.id in (
+    select q.id from public.notification_outbox q
+    where q.status = 'claimed' and q.lease_expires_at < now() and q.attempts >= max_attempts
+    for update skip locked
+  );
+
+  return query
+  update public.notification_outbox o
+  set status = 'claimed',
+      claimed_by = worker_id,
+      lease_expires_at = now() + make_interval(secs => lease_seconds),
+      attempts = o.attempts + 1
+  where o.id in (
+    select q.id from public.notification_outbox q
+    where (q.status = 'pending' and q.next_attempt_at <= now())
+       or (q.status = 'claimed' and q.lease_expires_at < now())
+    order by q.next_attempt_at
+    limit batch_size
+    for update skip locked
+  )
+  returning o.*;
+end;
+$$;
+
+-- Every symptom entry carries an "id" (the per-symptom operations address
+-- entries by it). Entries written without one, e.g. inserted directly by
+-- older app versions, get a random one on write; existing rows are backfilled.
+create or replace function timeline_symptoms_with_ids (p_symptoms jsonb)
+returns jsonb language sql volatile as $$
+  select coalesce(jsonb_agg(
+    case when coalesce(t.elem->>'id', '') = '' and jsonb_typeof(t.elem) = 'object'
+      then jsonb_set(t.elem, '{id}', to_jsonb(gen_random_uuid()::text))
+      else t.elem end
+    order by t.ord), '[]'::jsonb)
+  from jsonb_array_elements(p_symptoms) with ordinality as t(elem, ord);
+$$;
+
+create or replace function assign_timeline_symptom_ids()
+returns trigger language plpgsql as $$
+begin
+  if jsonb_typeof(new.symptoms) = 'array' then
+    new.symptoms := timeline_symptoms_with_ids(new.symptoms);
+  end if;
+  return new;
+end;
+$$;
+
+drop trigger if exists timelines_assign_symptom_ids on public.timelines;
+create trigger timelines_assign_symptom_ids
+  before insert or update of symptoms on public.timelines
+  for each row execute function assign_timeline_symptom_ids();
+
+update public.timelines
+set symptoms = timeline_symptoms_with_ids(symptoms)
+where jsonb_typeof(symptoms) = 'array'
+  and exists (select 1 from jsonb_array_elements(symptoms) e where coalesce(e->>'id', '') = '');
+
+-- Symptom Patch Operations (in-place JSONB edits + change event)
+create or replace function timeline_add_symptom (
+  p_timeline_id uuid,
+  p_user_id uuid,
+  p_entry jsonb
+) returns jsonb language plpgsql as $$
+declare
+  v_symptoms jsonb;
+  v_updated timestamp with time zone := timezone('utc'::text, now());
+  v_diff jsonb;
+begin
+  select symptoms into v_symptoms from public.timelines
+  where id = p_timeline_id and user_id = p_user_id for update;
+  if not found then
+    return null;
+  end if;
+  if exists (select 1 from jsonb_array_elements(v_symptoms) e where e->>'id' = p_entry->>'id') then
+    return jsonb_build_object('error', 'symptom_exists');
+  end if;
+  update public.timelines
+  set symptoms = symptoms || jsonb_build_array(p_entry), updated_at = v_updated
+  where id = p_timeline_id;
+  v_diff := jsonb_build_object('op', 'symptom_added', 'symptom_id', p_entry->>'id', 'after', p_entry, 'updated_at', v_updated);
+  insert into public.timeline_events (timeline_id, user_id, op, symptom_id, diff)
+  values (p_timeline_id, p_user_id, 'symptom_added', p_entry->>'id', v_diff);
+  return v_diff;
+end;
+$$;
+
+create or replace function timeline_update_symptom (
+  p_timeline_id uuid,
+  p_user_id uuid,
+  p_symptom_id text,
+  p_changes jsonb
+) returns jsonb language plpgsql as $$
+declare
+  v_symptoms jsonb;
+  v_idx int;
+  v_before jsonb;
+  v_changed jsonb;
+  v_updated timestamp with time zone := timezone('utc'::text, now());
+  v_diff jsonb;
+begin
+  select symptoms into v_symptoms from public.timelines
+  where id = p_timeline_id and user_id = p_user_id for update;
+  if not found then
+    return null;
+  end if;
+  select (t.ord - 1)::int, t.elem into v_idx, v_before
+  from jsonb_array_elements(v_symptoms) with ordinality as t(elem, ord)
+  where t.elem->>'id' = p_symptom_id limit 1;
+  if v_idx is null then
+    return jsonb_build_object('error', 'symptom_not_found');
+  end if;
+  -- Only fields whose value actually changes: {field: [old, new]}
+  select coalesce(jsonb_object_agg(c.key, jsonb_build_array(v_before->c.key, c.value)), '{}'::jsonb) into v_changed
+  from jsonb_each(p_changes) as c
+  where v_before->c.key is distinct from c.value;
+  if v_changed = '{}'::jsonb then
+    return jsonb_build_object('op', 'noop', 'symptom_id', p_symptom_id, 'changes', v_changed);
+  end if;
+  update public.timelines
+  set symptoms = jsonb_set(symptoms, array[v_idx::text], v_before || p_changes), updated_at = v_updated
+  where id = p_timeline_id;
+  v_diff := jsonb_build_object('op', 'symptom_updated', 'symptom_id', p_symptom_id, 'changes', v_changed, 'updated_at', v_updated);
+  insert into public.timeline_events (timeline_id, user_id, op, symptom_id, diff)
+  values (p_timeline_id, p_user_id, 'symptom_updated', p_symptom_id, v_diff);
+  return v_diff;
+end;
+$$;
+
+create or replace function timeline_remove_symptom (
+  p_timeline_id uuid,
+  p_user_id uuid,
+  p_symptom_id text
+) returns jsonb language plpgsql as $$
+declare
+  v_symptoms jsonb;
+  v_idx int;
+  v_before jsonb;
+  v_updated timestamp with time zone := timezone('utc'::text, now());
+  v_diff jsonb;
+begin
+  select symptoms into v_symptoms from public.timelines
+  where id = p_timeline_id and user_id = p_user_id for update;
+  if not found then
+    return null;
+  end if;
+  select (t.ord - 1)::int, t.elem into v_idx, v_before
+  from jsonb_array_elements(v_symptoms) with ordinality as t(elem, ord)
+  where t.elem->>'id' = p_symptom_id limit 1;
+  if v_idx is null then
+    return jsonb_build_object('error', 'symptom_not_found');
+  end if;
+  update public.timelines
+  set symptoms = symptoms - v_idx, updated_at = v_updated
+  where id = p_timeline_id;
+  v_diff := jsonb_build_object('op', 'symptom_removed', 'symptom_id', p_symptom_id, 'before', v_before, 'updated_at', v_updated);
+  insert into public.timeline_events (timeline_id, user_id, op, symptom_id, diff)
+  values (p_timeline_id, p_user_id, 'symptom_removed', p_symptom_id, v_diff);
+  return v_diff;
+end;
+$$;
+
+-- Record Match Feedback (batched; one vote per user, timeline and match)
+-- A repeated vote replaces the user's earlier one. Each vote is returned with
+-- the value it replaced (null for a first vote), so the caller adjusts the
+-- aggregates by the difference instead of counting the vote again.
+create or replace function record_match_feedback (
+  votes jsonb
+) returns table (timeline_id uuid, match_id text, is_helpful boolean, previous boolean)
+language plpgsql as $$
+#variable_conflict use_column
+declare
+  v record;
+begin
+  for v in
+    select (d->>'user_id')::uuid as user_id, (d->>'timeline_id')::uuid as timeline_id,
+           d->>'match_id' as match_id, (d->>'is_helpful')::boolean as is_helpful
+    from jsonb_array_elements(votes) with ordinality as t(d, n)
+    order by n
+  loop
+    previous := null;
+    insert into public.match_feedback (user_id, timeline_id, match_id, is_helpful)
+    values (v.user_id, v.timeline_id, v.match_id, v.is_helpful)
+    on conflict (user_id, timeline_id, match_id) do nothing;
+    if not found then
+      select f.is_helpful into previous from public.match_feedback f
+      where f.user_id = v.user_id and f.timeline_id = v.timeline_id and f.match_id = v.match_id
+      for update;
+      update public.match_feedback f set is_helpful = v.is_helpful, created_at = now()
+      where f.user_id = v.user_id and f.timeline_id = v.timeline_id and f.match_id = v.match_id;
+    end if;
+    timeline_id := v.timeline_id;
+    match_id := v.match_id;
+    is_helpful := v.is_helpful;
+    return next;
+  end loop;
+end;
+$$;
+
+-- Add Feedback Aggregate Deltas (batched; additive so replicas can flush independently)
+create or replace function add_feedback_aggregates (
+  deltas jsonb
+) returns void language plpgsql as $$
+begin
+  insert into public.match_feedback_aggregates as a (reference_case_id, symptom_fingerprint, helpful_count, total_count, updated_at)
+  select d->>'reference_case_id', d->>'symptom_fingerprint', (d->>'helpful')::int, (d->>'total')::int, now()
+  from jsonb_array_elements(deltas) as d
+  on conflict (reference_case_id, symptom_fingerprint) do update
+  set helpful_count = a.helpful_count + excluded.helpful_count,
+      total_count = a.total_count + excluded.total_count,
+      updated_at = now();
+end;
+$$;
+
 -- Match Timelines (Vector Search)
 create or replace function match_timelines (
-  query_embedding vector(768),
+  query_embedding vector(256),
   match_threshold float,
   match_count int
 ) returns table (
@@ -172,27 +553,59 @@ end;
 $$;
 
 -- Match Reference Cases (Vector Search)
+-- query_model: only compare against embeddings of the same embedding space
+-- (null compares against all, for debugging); include_untagged also searches
+-- rows without a tag, which belong to the AI service's baseline space.
+drop function if exists match_reference_cases(vector, float, int);
+drop function if exists match_reference_cases(vector, float, int, text);
+drop function if exists match_reference_cases(vector, float, int, text, boolean);
 create or replace function match_reference_cases (
-  query_embedding vector(768),
+  query_embedding vector(256),
   match_threshold float,
-  match_count int
+  match_count int,
+  query_model text default null,
+  include_untagged boolean default false
 ) returns table (
-  id uuid, similarity float, diagnosis_label text, symptoms jsonb
+  id uuid, similarity float, diagnosis_label text, symptoms jsonb, symptom_ids int[], multiplicity int
 ) language plpgsql as $$
 begin
   return query
-  select reference_cases.id, 1 - (reference_cases.embedding <=> query_embedding) as similarity, reference_cases.diagnosis_label, reference_cases.symptoms
+  select reference_cases.id, 1 - (reference_cases.embedding <=> query_embedding) as similarity, reference_cases.diagnosis_label, reference_cases.symptoms, reference_cases.symptom_ids, reference_cases.multiplicity
   from reference_cases
   where 1 - (reference_cases.embedding <=> query_embedding) > match_threshold
+    and (query_model is null or reference_cases.embedding_model = query_model
+         or (include_untagged and reference_cases.embedding_model is null))
   order by reference_cases.embedding <=> query_embedding
   limit match_count;
 end;
 $$;
 
+-- Degraded-mode candidates (AI service down): reference cases sharing at
+-- least one symptom ID, best overlap first
+create index if not exists reference_cases_symptom_ids_idx on public.reference_cases using gin (symptom_ids);
+
+drop function if exists match_reference_cases_by_symptoms(int[], int);
+create or replace function match_reference_cases_by_symptoms (
+  query_symptom_ids int[],
+  match_count int
+) returns table (
+  id uuid, similarity float, diagnosis_label text, symptoms jsonb, symptom_ids int[], multiplicity int
+) language sql stable as $$
+  select r.id,
+    (select count(*) from unnest(r.symptom_ids) s where s = any(query_symptom_ids))::float
+      / greatest(cardinality(query_symptom_ids), 1) as similarity,
+    r.diagnosis_label, r.symptoms, r.symptom_ids, r.multiplicity
+  from reference_cases r
+  where r.symptom_ids && query_symptom_ids
+  order by similarity desc
+  limit match_count;
+$$;
+
 -- 11. REALTIME SETUP
 begin;
   drop publication if exists supabase_realtime;
   create publication supabase_realtime;
 commit;
 alter publication supabase_realtime add table timelines;
+alter publication supabase_realtime add table timeline_events;
 alter table timelines replica identity full;
@@ -108,20 +108,21 @@ class ApiService {
     }
   }
 
-  Future<String> sendMessage(
-      String message, List<Map<String, String>> history) async {
+  // Sends a chat turn. History lives server-side; pass the session ID
+  // from the previous reply (or null to start a new conversation).
+  Future<Map<String, dynamic>> sendMessage(
+      String message, String? sessionId) async {
     final url = Uri.parse('$_aiServiceUrl/chat');
     final headers = await _getHeaders();
     final body = jsonEncode({
       'message': message,
-      'history': history,
+      if (sessionId != null) 'session_id': sessionId,
     });
 
     try {
       final response = await http.post(url, headers: headers, body: body);
       if (response.statusCode == 200) {
-        final data = jsonDecode(response.body);
-        return data['response'];
+        return jsonDecode(response.body);
       } else {
         throw Exception('Failed to send message: ${response.body}');
       }
@@ -130,6 +131,12 @@ class ApiService {
     }
   }
 
+  Future<void> endChatSession(String sessionId) async {
+    final url = Uri.parse('$_aiServiceUrl/chat/sessions/$sessionId');
+    final headers = await _getHeaders();
+    await http.delete(url, headers: headers);
+  }
+
   Future<void> submitFeedback(
       String timelineId, String matchId, bool isHelpful) async {
     final url = Uri.parse('$_matchingServiceUrl/feedback');
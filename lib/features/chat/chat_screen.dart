@@ -11,6 +11,7 @@ class ChatScreen extends StatefulWidget {
 class _ChatScreenState extends State<ChatScreen> {
   final TextEditingController _controller = TextEditingController();
   final List<Map<String, String>> _messages = [];
+  String? _sessionId;
   bool _isLoading = false;
   final ScrollController _scrollController = ScrollController();
 
@@ -33,17 +34,13 @@ class _ChatScreenState extends State<ChatScreen> {
     _scrollToBottom();
 
     try {
-      // Prepare history for API (excluding the current message)
-      final apiHistory = _messages
-          .sublist(0, _messages.length - 1)
-          .map((m) => {'role': m['role']!, 'parts': m['text']!})
-          .toList();
-
-      final response = await apiService.sendMessage(text, apiHistory);
+      // The server keeps the history; only the session ID is sent back.
+      final data = await apiService.sendMessage(text, _sessionId);
+      _sessionId = data['session_id'] ?? _sessionId;
 
       if (mounted) {
         setState(() {
-          _messages.add({'role': 'model', 'text': response});
+          _messages.add({'role': 'model', 'text': data['response']});
           _isLoading = false;
         });
         _scrollToBottom();
@@ -81,8 +78,13 @@ class _ChatScreenState extends State<ChatScreen> {
             icon: const Icon(Icons.delete_outline),
             tooltip: 'Clear Chat',
             onPressed: () {
+              final sessionId = _sessionId;
+              if (sessionId != null) {
+                apiService.endChatSession(sessionId).catchError((_) {});
+              }
               setState(() {
                 _messages.clear();
+                _sessionId = null;
               });
             },
           ),
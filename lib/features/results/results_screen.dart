@@ -299,6 +299,8 @@ class _ResultsScreenState extends State<ResultsScreen> {
                           final percentage = (similarity * 100).toInt();
                           final symptoms =
                               (m['symptoms'] as List<dynamic>).join(', ');
+                          final patients =
+                              (m['multiplicity'] as num?)?.toInt() ?? 1;
 
                           return Card(
                             margin: const EdgeInsets.only(bottom: 12),
@@ -330,7 +332,9 @@ class _ResultsScreenState extends State<ResultsScreen> {
                                   Text('Symptoms: $symptoms'),
                                   const SizedBox(height: 4),
                                   Text(
-                                    'Found in verified patients',
+                                    patients > 1
+                                        ? 'Found in $patients verified patients'
+                                        : 'Found in verified patients',
                                     style: TextStyle(
                                         fontSize: 12, color: Colors.grey[600]),
                                   ),
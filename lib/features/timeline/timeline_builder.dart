@@ -1,3 +1,5 @@
+import 'dart:math';
+
 import 'package:flutter/material.dart';
 import 'package:supabase_flutter/supabase_flutter.dart';
 import 'package:go_router/go_router.dart';
@@ -74,9 +76,23 @@ class _TimelineBuilderState extends State<TimelineBuilder> {
     'Other'
   ];
 
+  static final _random = Random.secure();
+
+  // Random (v4) UUID: every symptom entry carries an id so the timeline
+  // service's per-symptom update/remove operations can address it.
+  static String _newSymptomId() {
+    final bytes = List<int>.generate(16, (_) => _random.nextInt(256));
+    bytes[6] = (bytes[6] & 0x0f) | 0x40;
+    bytes[8] = (bytes[8] & 0x3f) | 0x80;
+    final hex = bytes.map((b) => b.toRadixString(16).padLeft(2, '0')).join();
+    return '${hex.substring(0, 8)}-${hex.substring(8, 12)}-${hex.substring(12, 16)}-'
+        '${hex.substring(16, 20)}-${hex.substring(20)}';
+  }
+
   void _addSymptom() {
     setState(() {
       _symptoms.add({
+        'id': _newSymptomId(),
         'symptom_name': _symptomNames.first,
         'age_onset': '',
         'severity': 5.0,
@@ -0,0 +1,24 @@
+-- One-off: collapse repeated votes to one per user, timeline and match, and
+-- recount the helpfulness aggregates from the remaining votes. Before this,
+-- every click was stored and counted, so a user could move the feedback
+-- boost by voting repeatedly.
+--
+-- Aggregates are keyed by the timeline's symptom fingerprint; votes on
+-- timelines without one (never embedded) are not counted, as in the service.
+
+begin;
+
+delete from public.match_feedback a using public.match_feedback b
+  where a.user_id = b.user_id and a.timeline_id = b.timeline_id and a.match_id = b.match_id
+    and (a.created_at, a.id) < (b.created_at, b.id);
+create unique index if not exists match_feedback_vote_key on public.match_feedback(user_id, timeline_id, match_id);
+
+delete from public.match_feedback_aggregates;
+insert into public.match_feedback_aggregates (reference_case_id, symptom_fingerprint, helpful_count, total_count, updated_at)
+select f.match_id, t.embedding_fingerprint, count(*) filter (where f.is_helpful), count(*), now()
+from public.match_feedback f
+join public.timelines t on t.id = f.timeline_id
+where t.embedding_fingerprint is not null
+group by f.match_id, t.embedding_fingerprint;
+
+commit;
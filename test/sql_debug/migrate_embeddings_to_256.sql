@@ -0,0 +1,11 @@
+-- Move databases created from an older schema.sql (vector(768) columns) to
+-- the embedding model's 256 dimensions. Vectors of another size can't be
+-- cast: timeline embeddings are cleared and recomputed on the next match,
+-- reference cases must be re-uploaded (upload_ml_data.py resumes).
+update public.timelines set embedding = null
+  where embedding is not null and vector_dims(embedding) <> 256;
+alter table public.timelines alter column embedding type vector(256);
+
+delete from public.reference_cases
+  where embedding is not null and vector_dims(embedding) <> 256;
+alter table public.reference_cases alter column embedding type vector(256);
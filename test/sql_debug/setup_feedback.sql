@@ -19,3 +19,73 @@ WITH CHECK (auth.uid() = user_id);
 CREATE POLICY "Users can view their own feedback" 
 ON match_feedback FOR SELECT 
 USING (auth.uid() = user_id);
+
+-- One vote per user, timeline and match (the latest one wins)
+DELETE FROM match_feedback a USING match_feedback b
+WHERE a.user_id = b.user_id AND a.timeline_id = b.timeline_id AND a.match_id = b.match_id
+  AND (a.created_at, a.id) < (b.created_at, b.id);
+CREATE UNIQUE INDEX IF NOT EXISTS match_feedback_vote_key ON match_feedback(user_id, timeline_id, match_id);
+
+-- Materialized helpfulness aggregates per (reference case, symptom-set fingerprint)
+create table if not exists public.match_feedback_aggregates (
+    reference_case_id text not null,
+    symptom_fingerprint text not null,
+    helpful_count int not null default 0,
+    total_count int not null default 0,
+    updated_at timestamp with time zone default now(),
+    primary key (reference_case_id, symptom_fingerprint)
+);
+
+alter table public.match_feedback_aggregates enable row level security;
+
+-- Additive batch upsert used by the matching service's periodic persist
+create or replace function add_feedback_aggregates (
+  deltas jsonb
+) returns void language plpgsql as $$
+begin
+  insert into public.match_feedback_aggregates as a (reference_case_id, symptom_fingerprint, helpful_count, total_count, updated_at)
+  select d->>'reference_case_id', d->>'symptom_fingerprint', (d->>'helpful')::int, (d->>'total')::int, now()
+  from jsonb_array_elements(deltas) as d
+  on conflict (reference_case_id, symptom_fingerprint) do update
+  set helpful_count = a.helpful_count + excluded.helpful_count,
+      total_count = a.total_count + excluded.total_count,
+      updated_at = now();
+end;
+$$;
+
+-- Batched vote upsert used by the matching service's feedback flush
+-- A repeated vote replaces the user's earlier one. Each vote is returned with
+-- the value it replaced (null for a first vote), so the caller adjusts the
+-- aggregates by the difference instead of counting the vote again.
+create or replace function record_match_feedback (
+  votes jsonb
+) returns table (timeline_id uuid, match_id text, is_helpful boolean, previous boolean)
+language plpgsql as $$
+#variable_conflict use_column
+declare
+  v record;
+begin
+  for v in
+    select (d->>'user_id')::uuid as user_id, (d->>'timeline_id')::uuid as timeline_id,
+           d->>'match_id' as match_id, (d->>'is_helpful')::boolean as is_helpful
+    from jsonb_array_elements(votes) with ordinality as t(d, n)
+    order by n
+  loop
+    previous := null;
+    insert into public.match_feedback (user_id, timeline_id, match_id, is_helpful)
+    values (v.user_id, v.timeline_id, v.match_id, v.is_helpful)
+    on conflict (user_id, timeline_id, match_id) do nothing;
+    if not found then
+      select f.is_helpful into previous from public.match_feedback f
+      where f.user_id = v.user_id and f.timeline_id = v.timeline_id and f.match_id = v.match_id
+      for update;
+      update public.match_feedback f set is_helpful = v.is_helpful, created_at = now()
+      where f.user_id = v.user_id and f.timeline_id = v.timeline_id and f.match_id = v.match_id;
+    end if;
+    timeline_id := v.timeline_id;
+    match_id := v.match_id;
+    is_helpful := v.is_helpful;
+    return next;
+  end loop;
+end;
+$$;
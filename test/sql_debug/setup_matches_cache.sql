@@ -30,6 +30,16 @@ create policy "Users can insert their own matches" on public.matches
     )
   );
 
+drop policy if exists "Users can update their own matches" on public.matches;
+create policy "Users can update their own matches" on public.matches
+  for update using (
+    exists (
+      select 1 from public.timelines
+      where timelines.id = matches.timeline_id
+      and timelines.user_id = auth.uid()
+    )
+  );
+
 drop policy if exists "Users can delete their own matches" on public.matches;
 create policy "Users can delete their own matches" on public.matches
   for delete using (
@@ -40,5 +50,13 @@ create policy "Users can delete their own matches" on public.matches
     )
   );
 
--- Index for faster lookups
-create index if not exists matches_timeline_id_idx on public.matches(timeline_id);
+-- Pre-serialized match list (served verbatim on cache hits); match_data is legacy
+alter table public.matches add column if not exists match_json text;
+alter table public.matches alter column match_data drop not null;
+
+-- One cached list per timeline (the matching service upserts on timeline_id).
+-- Keep only the newest row of any duplicates before adding the unique key.
+delete from public.matches a using public.matches b
+  where a.timeline_id = b.timeline_id and (a.created_at, a.id) < (b.created_at, b.id);
+drop index if exists public.matches_timeline_id_idx;
+create unique index if not exists matches_timeline_id_key on public.matches(timeline_id);
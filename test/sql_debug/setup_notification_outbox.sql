@@ -0,0 +1,80 @@
+-- Create NOTIFICATION_OUTBOX table, enqueue trigger and claim function
+create table if not exists public.notification_outbox (
+  id uuid default gen_random_uuid() primary key,
+  notification_id uuid references public.notifications(id) on delete cascade,
+  user_id uuid references auth.users not null,
+  title text not null,
+  body text not null,
+  data jsonb,
+  status text not null default 'pending', -- pending | claimed | sent | no_token | failed
+  attempts int not null default 0,
+  next_attempt_at timestamp with time zone default now() not null,
+  claimed_by text,
+  lease_expires_at timestamp with time zone,
+  last_error text,
+  delivered_at timestamp with time zone,
+  created_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+
+-- Enable RLS (no policies: only the service role reads or writes the outbox)
+alter table public.notification_outbox enable row level security;
+
+-- Index for the claim query
+create index if not exists notification_outbox_due_idx on public.notification_outbox(next_attempt_at) where status in ('pending', 'claimed');
+
+-- Every notification insert enqueues its push in the same transaction
+create or replace function public.enqueue_notification_push()
+returns trigger as $$
+begin
+  insert into public.notification_outbox (notification_id, user_id, title, body, data)
+  values (new.id, new.user_id, new.title, new.body, new.data);
+  return new;
+end;
+$$ language plpgsql security definer;
+
+drop trigger if exists on_notification_created_enqueue_push on public.notifications;
+
+create trigger on_notification_created_enqueue_push
+  after insert on public.notifications
+  for each row execute procedure public.enqueue_notification_push();
+
+-- Claim a batch of due rows; rows whose lease expired are claimed again
+-- (until their attempts run out)
+drop function if exists claim_notification_outbox(text, int, int);
+create or replace function claim_notification_outbox (
+  worker_id text,
+  batch_size int,
+  lease_seconds int,
+  max_attempts int
+) returns setof public.notification_outbox language plpgsql as $$
+begin
+  -- An expired lease means the worker died mid-delivery; that counts as an
+  -- attempt, so rows that used their last one are dead-lettered instead of
+  -- being reclaimed (a message that crashes its worker would loop forever).
+  update public.notification_outbox o
+  set status = 'failed',
+      lease_expires_at = null,
+      last_error = 'lease expired after ' || o.attempts || ' attempts'
+  where o.id in (
+    select q.id from public.notification_outbox q
+    where q.status = 'claimed' and q.lease_expires_at < now() and q.attempts >= max_attempts
+    for update skip locked
+  );
+
+  return query
+  update public.notification_outbox o
+  set status = 'claimed',
+      claimed_by = worker_id,
+      lease_expires_at = now() + make_interval(secs => lease_seconds),
+      attempts = o.attempts + 1
+  where o.id in (
+    select q.id from public.notification_outbox q
+    where (q.status = 'pending' and q.next_attempt_at <= now())
+       or (q.status = 'claimed' and q.lease_expires_at < now())
+    order by q.next_attempt_at
+    limit batch_size
+    for update skip locked
+  )
+  returning o.*;
+end;
+$$;
@@ -0,0 +1,48 @@
+-- Reference embeddings keyed by embedding space: the matching service only
+-- compares a query with reference embeddings from the same space (a
+-- retrained model that fails the AI service's same-space parity embeds into
+-- a new one). upload_ml_data.py records the space with each row.
+alter table public.reference_cases add column if not exists embedding_model text;
+create index if not exists reference_cases_embedding_model_idx on public.reference_cases(embedding_model);
+
+-- Rows uploaded before this carry no tag and belong to the baseline space
+-- (GET /models on the AI service, "baseline_space"): they are searched
+-- whenever the serving model is in that space.
+
+drop function if exists match_reference_cases(vector, float, int);
+drop function if exists match_reference_cases(vector, float, int, text);
+drop function if exists match_reference_cases(vector, float, int, text, boolean);
+create or replace function match_reference_cases (
+  query_embedding vector(256),
+  match_threshold float,
+  match_count int,
+  query_model text default null,
+  include_untagged boolean default false
+)
+returns table (
+  id uuid,
+  similarity float,
+  diagnosis_label text,
+  symptoms jsonb,
+  symptom_ids int[],
+  multiplicity int
+)
+language plpgsql
+as $$
+begin
+  return query
+  select
+    reference_cases.id,
+    1 - (reference_cases.embedding <=> query_embedding) as similarity,
+    reference_cases.diagnosis_label,
+    reference_cases.symptoms,
+    reference_cases.symptom_ids,
+    reference_cases.multiplicity
+  from reference_cases
+  where 1 - (reference_cases.embedding <=> query_embedding) > match_threshold
+    and (query_model is null or reference_cases.embedding_model = query_model
+         or (include_untagged and reference_cases.embedding_model is null))
+  order by reference_cases.embedding <=> query_embedding
+  limit match_count;
+end;
+$$;
@@ -0,0 +1,56 @@
+-- Reference prototypes: upload_ml_data.py collapses patients with the same
+-- diagnosis and (near-)identical symptom sets into one row. Rows uploaded
+-- before this stay one per patient (multiplicity 1) until the table is
+-- truncated and re-uploaded.
+alter table public.reference_cases add column if not exists multiplicity int not null default 1;
+alter table public.reference_cases add column if not exists member_patient_ids text[];
+
+-- Return types change, so the functions have to be recreated
+drop function if exists match_reference_cases(vector, float, int);
+create or replace function match_reference_cases (
+  query_embedding vector(256),
+  match_threshold float,
+  match_count int
+)
+returns table (
+  id uuid,
+  similarity float,
+  diagnosis_label text,
+  symptoms jsonb,
+  symptom_ids int[],
+  multiplicity int
+)
+language plpgsql
+as $$
+begin
+  return query
+  select
+    reference_cases.id,
+    1 - (reference_cases.embedding <=> query_embedding) as similarity,
+    reference_cases.diagnosis_label,
+    reference_cases.symptoms,
+    reference_cases.symptom_ids,
+    reference_cases.multiplicity
+  from reference_cases
+  where 1 - (reference_cases.embedding <=> query_embedding) > match_threshold
+  order by reference_cases.embedding <=> query_embedding
+  limit match_count;
+end;
+$$;
+
+drop function if exists match_reference_cases_by_symptoms(int[], int);
+create or replace function match_reference_cases_by_symptoms (
+  query_symptom_ids int[],
+  match_count int
+) returns table (
+  id uuid, similarity float, diagnosis_label text, symptoms jsonb, symptom_ids int[], multiplicity int
+) language sql stable as $$
+  select r.id,
+    (select count(*) from unnest(r.symptom_ids) s where s = any(query_symptom_ids))::float
+      / greatest(cardinality(query_symptom_ids), 1) as similarity,
+    r.diagnosis_label, r.symptoms, r.symptom_ids, r.multiplicity
+  from reference_cases r
+  where r.symptom_ids && query_symptom_ids
+  order by similarity desc
+  limit match_count;
+$$;
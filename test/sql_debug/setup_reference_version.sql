@@ -0,0 +1,77 @@
+-- Reference data version marker for the matching service's live index
+-- (new rows are appended by seq; other changes trigger a background rebuild)
+alter table public.reference_cases add column if not exists seq bigint generated always as identity;
+create unique index if not exists reference_cases_seq_idx on public.reference_cases(seq);
+
+create table if not exists public.reference_data_version (
+  name text primary key,
+  version bigint not null default 0,
+  generation bigint not null default 0,
+  max_seq bigint not null default 0,
+  updated_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+alter table public.reference_data_version enable row level security;
+
+drop policy if exists "Public can view reference data version" on public.reference_data_version;
+create policy "Public can view reference data version" on public.reference_data_version
+  for select using (true);
+
+insert into public.reference_data_version (name) values ('reference_cases') on conflict (name) do nothing;
+
+-- Highest seq committed so far (see check_reference_seq_order below)
+alter table public.reference_data_version add column if not exists max_seq bigint not null default 0;
+update public.reference_data_version
+  set max_seq = (select coalesce(max(seq), 0) from public.reference_cases)
+  where name = 'reference_cases';
+
+-- Every write bumps version; anything but an insert also bumps generation
+create or replace function public.bump_reference_data_version()
+returns trigger
+language plpgsql
+security definer
+as $$
+begin
+  update public.reference_data_version
+    set version = version + 1,
+        generation = generation + case when tg_op = 'INSERT' then 0 else 1 end,
+        max_seq = case when tg_op = 'TRUNCATE' then 0 else max_seq end,
+        updated_at = timezone('utc'::text, now())
+    where name = tg_table_name;
+  return null;
+end;
+$$;
+
+drop trigger if exists reference_cases_version on public.reference_cases;
+create trigger reference_cases_version
+  after insert or update or delete on public.reference_cases
+  for each statement execute function public.bump_reference_data_version();
+
+drop trigger if exists reference_cases_version_truncate on public.reference_cases;
+create trigger reference_cases_version_truncate
+  after truncate on public.reference_cases
+  for each statement execute function public.bump_reference_data_version();
+
+-- Runs at commit time (deferred): identity values are handed out at insert,
+-- so a transaction can commit a seq below one another transaction already
+-- committed, after the matching service appended past it. Such a row
+-- bumps generation so the service rebuilds instead of missing it.
+create or replace function public.check_reference_seq_order()
+returns trigger
+language plpgsql
+security definer
+as $$
+begin
+  update public.reference_data_version
+    set generation = generation + case when new.seq < max_seq then 1 else 0 end,
+        max_seq = greatest(max_seq, new.seq),
+        updated_at = timezone('utc'::text, now())
+    where name = tg_table_name;
+  return null;
+end;
+$$;
+
+drop trigger if exists reference_cases_seq_order on public.reference_cases;
+create constraint trigger reference_cases_seq_order
+  after insert on public.reference_cases
+  deferrable initially deferred
+  for each row execute function public.check_reference_seq_order();
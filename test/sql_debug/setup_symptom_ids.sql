@@ -0,0 +1,54 @@
+-- Shared symptom dictionary IDs on reference cases
+-- (IDs come from backend/shared/symptom_dictionary.json)
+alter table public.reference_cases add column if not exists symptom_ids int[];
+
+-- Return type changes, so the function has to be recreated
+drop function if exists match_reference_cases(vector, float, int);
+create or replace function match_reference_cases (
+  query_embedding vector(256),
+  match_threshold float,
+  match_count int
+)
+returns table (
+  id uuid,
+  similarity float,
+  diagnosis_label text,
+  symptoms jsonb,
+  symptom_ids int[]
+)
+language plpgsql
+as $$
+begin
+  return query
+  select
+    reference_cases.id,
+    1 - (reference_cases.embedding <=> query_embedding) as similarity,
+    reference_cases.diagnosis_label,
+    reference_cases.symptoms,
+    reference_cases.symptom_ids
+  from reference_cases
+  where 1 - (reference_cases.embedding <=> query_embedding) > match_threshold
+  order by reference_cases.embedding <=> query_embedding
+  limit match_count;
+end;
+$$;
+
+-- Degraded-mode candidates (AI service down): reference cases sharing at
+-- least one symptom ID, best overlap first
+create index if not exists reference_cases_symptom_ids_idx on public.reference_cases using gin (symptom_ids);
+
+create or replace function match_reference_cases_by_symptoms (
+  query_symptom_ids int[],
+  match_count int
+) returns table (
+  id uuid, similarity float, diagnosis_label text, symptoms jsonb, symptom_ids int[]
+) language sql stable as $$
+  select r.id,
+    (select count(*) from unnest(r.symptom_ids) s where s = any(query_symptom_ids))::float
+      / greatest(cardinality(query_symptom_ids), 1) as similarity,
+    r.diagnosis_label, r.symptoms, r.symptom_ids
+  from reference_cases r
+  where r.symptom_ids && query_symptom_ids
+  order by similarity desc
+  limit match_count;
+$$;
@@ -0,0 +1,160 @@
+-- Create TIMELINE_EVENTS table (per-symptom change feed)
+create table if not exists public.timeline_events (
+  id bigint generated always as identity primary key,
+  timeline_id uuid references public.timelines(id) on delete cascade not null,
+  user_id uuid references auth.users not null,
+  op text not null, -- symptom_added | symptom_updated | symptom_removed
+  symptom_id text,
+  diff jsonb not null,
+  created_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+
+-- Enable RLS
+alter table public.timeline_events enable row level security;
+
+drop policy if exists "Users can view their own timeline events" on public.timeline_events;
+create policy "Users can view their own timeline events" on public.timeline_events
+  for select using (auth.uid() = user_id);
+
+create index if not exists timeline_events_timeline_id_idx on public.timeline_events(timeline_id, id);
+
+-- Publish events over Realtime
+alter publication supabase_realtime add table timeline_events;
+
+-- Every symptom entry carries an "id" (the per-symptom operations address
+-- entries by it). Entries written without one, e.g. inserted directly by
+-- older app versions, get a random one on write; existing rows are backfilled.
+create or replace function timeline_symptoms_with_ids (p_symptoms jsonb)
+returns jsonb language sql volatile as $$
+  select coalesce(jsonb_agg(
+    case when coalesce(t.elem->>'id', '') = '' and jsonb_typeof(t.elem) = 'object'
+      then jsonb_set(t.elem, '{id}', to_jsonb(gen_random_uuid()::text))
+      else t.elem end
+    order by t.ord), '[]'::jsonb)
+  from jsonb_array_elements(p_symptoms) with ordinality as t(elem, ord);
+$$;
+
+create or replace function assign_timeline_symptom_ids()
+returns trigger language plpgsql as $$
+begin
+  if jsonb_typeof(new.symptoms) = 'array' then
+    new.symptoms := timeline_symptoms_with_ids(new.symptoms);
+  end if;
+  return new;
+end;
+$$;
+
+drop trigger if exists timelines_assign_symptom_ids on public.timelines;
+create trigger timelines_assign_symptom_ids
+  before insert or update of symptoms on public.timelines
+  for each row execute function assign_timeline_symptom_ids();
+
+update public.timelines
+set symptoms = timeline_symptoms_with_ids(symptoms)
+where jsonb_typeof(symptoms) = 'array'
+  and exists (select 1 from jsonb_array_elements(symptoms) e where coalesce(e->>'id', '') = '');
+
+-- Symptom Patch Operations (in-place JSONB edits + change event)
+create or replace function timeline_add_symptom (
+  p_timeline_id uuid,
+  p_user_id uuid,
+  p_entry jsonb
+) returns jsonb language plpgsql as $$
+declare
+  v_symptoms jsonb;
+  v_updated timestamp with time zone := timezone('utc'::text, now());
+  v_diff jsonb;
+begin
+  select symptoms into v_symptoms from public.timelines
+  where id = p_timeline_id and user_id = p_user_id for update;
+  if not found then
+    return null;
+  end if;
+  if exists (select 1 from jsonb_array_elements(v_symptoms) e where e->>'id' = p_entry->>'id') then
+    return jsonb_build_object('error', 'symptom_exists');
+  end if;
+  update public.timelines
+  set symptoms = symptoms || jsonb_build_array(p_entry), updated_at = v_updated
+  where id = p_timeline_id;
+  v_diff := jsonb_build_object('op', 'symptom_added', 'symptom_id', p_entry->>'id', 'after', p_entry, 'updated_at', v_updated);
+  insert into public.timeline_events (timeline_id, user_id, op, symptom_id, diff)
+  values (p_timeline_id, p_user_id, 'symptom_added', p_entry->>'id', v_diff);
+  return v_diff;
+end;
+$$;
+
+create or replace function timeline_update_symptom (
+  p_timeline_id uuid,
+  p_user_id uuid,
+  p_symptom_id text,
+  p_changes jsonb
+) returns jsonb language plpgsql as $$
+declare
+  v_symptoms jsonb;
+  v_idx int;
+  v_before jsonb;
+  v_changed jsonb;
+  v_updated timestamp with time zone := timezone('utc'::text, now());
+  v_diff jsonb;
+begin
+  select symptoms into v_symptoms from public.timelines
+  where id = p_timeline_id and user_id = p_user_id for update;
+  if not found then
+    return null;
+  end if;
+  select (t.ord - 1)::int, t.elem into v_idx, v_before
+  from jsonb_array_elements(v_symptoms) with ordinality as t(elem, ord)
+  where t.elem->>'id' = p_symptom_id limit 1;
+  if v_idx is null then
+    return jsonb_build_object('error', 'symptom_not_found');
+  end if;
+  -- Only fields whose value actually changes: {field: [old, new]}
+  select coalesce(jsonb_object_agg(c.key, jsonb_build_array(v_before->c.key, c.value)), '{}'::jsonb) into v_changed
+  from jsonb_each(p_changes) as c
+  where v_before->c.key is distinct from c.value;
+  if v_changed = '{}'::jsonb then
+    return jsonb_build_object('op', 'noop', 'symptom_id', p_symptom_id, 'changes', v_changed);
+  end if;
+  update public.timelines
+  set symptoms = jsonb_set(symptoms, array[v_idx::text], v_before || p_changes), updated_at = v_updated
+  where id = p_timeline_id;
+  v_diff := jsonb_build_object('op', 'symptom_updated', 'symptom_id', p_symptom_id, 'changes', v_changed, 'updated_at', v_updated);
+  insert into public.timeline_events (timeline_id, user_id, op, symptom_id, diff)
+  values (p_timeline_id, p_user_id, 'symptom_updated', p_symptom_id, v_diff);
+  return v_diff;
+end;
+$$;
+
+create or replace function timeline_remove_symptom (
+  p_timeline_id uuid,
+  p_user_id uuid,
+  p_symptom_id text
+) returns jsonb language plpgsql as $$
+declare
+  v_symptoms jsonb;
+  v_idx int;
+  v_before jsonb;
+  v_updated timestamp with time zone := timezone('utc'::text, now());
+  v_diff jsonb;
+begin
+  select symptoms into v_symptoms from public.timelines
+  where id = p_timeline_id and user_id = p_user_id for update;
+  if not found then
+    return null;
+  end if;
+  select (t.ord - 1)::int, t.elem into v_idx, v_before
+  from jsonb_array_elements(v_symptoms) with ordinality as t(elem, ord)
+  where t.elem->>'id' = p_symptom_id limit 1;
+  if v_idx is null then
+    return jsonb_build_object('error', 'symptom_not_found');
+  end if;
+  update public.timelines
+  set symptoms = symptoms - v_idx, updated_at = v_updated
+  where id = p_timeline_id;
+  v_diff := jsonb_build_object('op', 'symptom_removed', 'symptom_id', p_symptom_id, 'before', v_before, 'updated_at', v_updated);
+  insert into public.timeline_events (timeline_id, user_id, op, symptom_id, diff)
+  values (p_timeline_id, p_user_id, 'symptom_removed', p_symptom_id, v_diff);
+  return v_diff;
+end;
+$$;
+
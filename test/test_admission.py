@@ -0,0 +1,82 @@
+import ipaddress
+import os
+import sys
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from shared.admission import BATCH, INTERACTIVE, AdmissionGate, client_address, client_key
+
+
+def make_request(peer="203.0.113.7", headers=None):
+    return Request({
+        "type": "http",
+        "method": "POST",
+        "path": "/",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        "client": (peer, 12345),
+    })
+
+
+def test_rate_limit_rejects_with_retry_after():
+    gate = AdmissionGate("test", None, rate_per_minute=60, burst=2, enabled=True)
+    gate.check_rate("user:a")
+    gate.check_rate("user:a")
+    with pytest.raises(HTTPException) as raised:
+        gate.check_rate("user:a")
+    assert raised.value.status_code == 429
+    assert int(raised.value.headers["Retry-After"]) >= 1
+    # Other callers have their own bucket.
+    gate.check_rate("user:b")
+    assert gate.stats["rate_limited"] == 1
+
+
+def test_concurrency_cap_sheds_with_503_and_releases_slots():
+    gate = AdmissionGate("test", 2, rate_per_minute=6000, burst=100, enabled=True)
+    with gate.admit("user:a"), gate.admit("user:b"):
+        with pytest.raises(HTTPException) as raised:
+            with gate.admit("user:c"):
+                pass
+        assert raised.value.status_code == 503
+    with gate.admit("user:c"):
+        assert gate.snapshot()["active"][INTERACTIVE] == 1
+    assert gate.snapshot()["active"] == {INTERACTIVE: 0, BATCH: 0}
+
+
+def test_batch_callers_leave_room_for_interactive():
+    gate = AdmissionGate("test", 4, rate_per_minute=6000, burst=100, batch_share=0.5, enabled=True)
+    with gate.admit("user:a", BATCH), gate.admit("user:b", BATCH):
+        with pytest.raises(HTTPException):
+            with gate.admit("user:c", BATCH):
+                pass
+        with gate.admit("user:d", INTERACTIVE), gate.admit("user:e", INTERACTIVE):
+            pass
+
+
+def test_disabled_gate_admits_everything():
+    gate = AdmissionGate("test", 0, rate_per_minute=0, burst=1, enabled=False)
+    for _ in range(5):
+        with gate.admit("user:a"):
+            pass
+
+
+def test_client_key_prefers_verified_user():
+    request = make_request(headers={"Authorization": "Bearer anything"})
+    assert client_key(request, {"id": "u1"}) == "user:u1"
+
+
+def test_unverified_headers_do_not_change_the_key():
+    first = make_request(headers={"Authorization": "Bearer one", "X-Forwarded-For": "198.51.100.1"})
+    second = make_request(headers={"Authorization": "Bearer two", "X-Forwarded-For": "198.51.100.2"})
+    assert client_key(first) == client_key(second) == "ip:203.0.113.7"
+
+
+def test_forwarded_for_is_used_behind_trusted_proxies():
+    proxies = [ipaddress.ip_network("10.0.0.0/8")]
+    request = make_request(peer="10.0.0.2", headers={"X-Forwarded-For": "198.51.100.9, 192.0.2.4, 10.0.0.5"})
+    # The nearest untrusted hop; anything left of it could be forged.
+    assert client_address(request, proxies) == "192.0.2.4"
+    assert client_address(make_request(peer="10.0.0.2"), proxies) == "10.0.0.2"
@@ -0,0 +1,75 @@
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend', 'matching-service'))
+
+from ai_client import AIClient, AIRequestRejected, AIServiceUnavailable, CircuitBreaker
+
+
+def client_answering(status: int) -> AIClient:
+    client = AIClient(base_url="http://ai", budget=1.0, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0))
+    transport = httpx.MockTransport(lambda request: httpx.Response(status, json={"embedding": [1.0]}))
+    client.client = httpx.AsyncClient(base_url="http://ai", transport=transport)
+    return client
+
+
+async def call(client: AIClient):
+    try:
+        return await client.embed({"text": "fever"})
+    except AIServiceUnavailable as e:
+        return e
+
+
+def test_bad_requests_do_not_open_the_breaker():
+    async def run():
+        client = client_answering(422)
+        errors = [await call(client) for _ in range(5)]
+        return client, errors
+
+    client, errors = asyncio.run(run())
+    assert all(isinstance(e, AIRequestRejected) for e in errors)
+    assert client.breaker.state == "closed"
+
+
+def test_server_errors_open_the_breaker():
+    async def run():
+        client = client_answering(503)
+        errors = [await call(client) for _ in range(2)]
+        return client, errors
+
+    client, errors = asyncio.run(run())
+    assert all(type(e) is AIServiceUnavailable for e in errors)
+    assert client.breaker.opened_at is not None
+
+
+def test_cancelled_probe_frees_the_half_open_slot():
+    async def run():
+        client = AIClient(budget=5.0, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0))
+        client.breaker.record_failure()  # open; half-open at once (reset_timeout=0)
+        started = asyncio.Event()
+
+        async def slow(payload):
+            started.set()
+            await asyncio.sleep(10)
+
+        client.bind_local("/embed", slow)
+        probe = asyncio.create_task(client.embed({}))
+        await started.wait()
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        async def healthy(payload):
+            return {"embedding": [1.0]}
+
+        client.bind_local("/embed", healthy)
+        result = await client.embed({})
+        return client, result
+
+    client, result = asyncio.run(run())
+    assert result == {"embedding": [1.0]}
+    assert client.breaker.state == "closed"
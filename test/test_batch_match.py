@@ -0,0 +1,44 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend', 'matching-service'))
+
+import shared.supabase_client
+import batch_match
+
+
+class FakeTimelines:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __getattr__(self, name):
+        # select / not_ / is_ / gt / order / limit: the fake returns every row at once.
+        return lambda *args, **kwargs: self
+
+    @property
+    def not_(self):
+        return self
+
+    def execute(self):
+        return type("Response", (), {"data": self.rows})()
+
+
+class FakeClient:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def table(self, name):
+        return FakeTimelines(self.rows)
+
+
+def test_timelines_of_other_spaces_are_skipped(monkeypatch):
+    rows = [
+        {"id": "t1", "symptoms": [], "embedding": "[1, 0]", "embedding_model": "v2"},
+        {"id": "t2", "symptoms": [], "embedding": "[1, 0]", "embedding_model": "v1"},
+        {"id": "t3", "symptoms": [], "embedding": "[1, 0]", "embedding_model": None},
+        {"id": "t4", "symptoms": [], "embedding": "[1, 0, 0]", "embedding_model": "v2"},
+    ]
+    monkeypatch.setattr(shared.supabase_client, "get_supabase_client", lambda: FakeClient(rows))
+    assert list(batch_match.fetch_timelines(2, "v2")["ids"]) == ["t1"]
+    assert list(batch_match.fetch_timelines(2)["ids"]) == ["t1", "t2", "t3"]
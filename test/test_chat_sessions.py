@@ -0,0 +1,86 @@
+import importlib.util
+import os
+import sqlite3
+import sys
+
+import pytest
+
+AI_SERVICE = os.path.join(os.path.dirname(__file__), '..', 'backend', 'ai-service')
+sys.path.append(AI_SERVICE)
+
+from chat_sessions import ChatSessionStore
+
+HISTORY = [{"role": "user", "parts": ["my symptoms"]}, {"role": "model", "parts": ["noted"]}]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChatSessionStore(path=str(tmp_path / "sessions.sqlite3"))
+
+
+def test_session_is_only_visible_to_its_owner(store):
+    store.save("s1", "alice", HISTORY)
+    assert store.load("s1", "alice") == HISTORY
+    assert store.load("s1", "mallory") is None
+
+
+def test_other_user_cannot_overwrite_or_delete(store):
+    store.save("s1", "alice", HISTORY)
+    store.save("s1", "mallory", [{"role": "user", "parts": ["hijack"]}])
+    store.delete("s1", "mallory")
+    assert store.load("s1", "alice") == HISTORY
+    store.delete("s1", "alice")
+    assert store.load("s1", "alice") is None
+
+
+def test_sessions_without_owner_are_dropped(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    with sqlite3.connect(path) as conn:
+        conn.execute("create table chat_sessions (id text primary key, history text not null, updated_at real not null)")
+        conn.execute("insert into chat_sessions values ('s1', '[]', 9e9)")
+    store = ChatSessionStore(path=path)
+    assert store.load("s1", "alice") is None
+    store.save("s1", "alice", HISTORY)
+    assert store.load("s1", "alice") == HISTORY
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    pytest.importorskip("google.generativeai")
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setenv("GEMINI_CLIENT", "stub")
+    spec = importlib.util.spec_from_file_location("ai_main", os.path.join(AI_SERVICE, "main.py"))
+    main = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(main)
+    monkeypatch.setattr(main, "chat_sessions", ChatSessionStore(path=str(tmp_path / "api.sqlite3")))
+    monkeypatch.setattr(main, "GOOGLE_AI_API_KEY", "test-key")
+    return main, TestClient(main.app)
+
+
+def test_delete_requires_authentication(api):
+    main, client = api
+    main.chat_sessions.save("s1", "alice", HISTORY)
+    assert client.delete("/chat/sessions/s1").status_code in (401, 403)
+    assert main.chat_sessions.load("s1", "alice") == HISTORY
+
+
+def test_chat_cannot_continue_another_users_session(api, monkeypatch):
+    main, client = api
+    main.chat_sessions.save("s1", "alice", HISTORY)
+    main.app.dependency_overrides[main.get_current_user] = lambda: {"id": "mallory"}
+    try:
+        seen = []
+
+        async def stream_chat(model, history, message):
+            seen.append(history)
+            yield "hello"
+
+        monkeypatch.setattr(main.gemini_client, "stream_chat", stream_chat)
+        reply = client.post("/chat", json={"message": "what did I say?", "session_id": "s1"}).json()
+        assert seen == [[]]
+        assert reply["session_id"] != "s1"
+        client.delete("/chat/sessions/s1")
+        assert main.chat_sessions.load("s1", "alice") == HISTORY
+    finally:
+        main.app.dependency_overrides.clear()
@@ -0,0 +1,55 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend', 'matching-service'))
+
+import evaluate_retrieval
+
+
+def snapshot(path, tags, dims):
+    np.savez_compressed(
+        path,
+        ids=np.array([f"case-{i}" for i in range(len(tags))]),
+        labels=np.array(["A"] * len(tags)),
+        embeddings=np.ones((len(tags), dims), dtype=np.float32),
+        symptom_ids=np.array([json.dumps([i]) for i in range(len(tags))]),
+        multiplicity=np.ones(len(tags), dtype=np.int32),
+        embedding_model=np.array(tags, dtype=str),
+    )
+    return str(path)
+
+
+def test_keeps_rows_of_the_current_space(tmp_path):
+    cache = snapshot(tmp_path / "cases.npz", ["v2", "", "v1", "v2"], 4)
+    data = evaluate_retrieval.load_dataset(cache, "v2", "v1")
+    assert list(data["ids"]) == ["case-0", "case-3"]
+    assert data["symptom_ids"] == [[0], [3]]
+
+
+def test_baseline_space_includes_untagged_rows(tmp_path):
+    cache = snapshot(tmp_path / "cases.npz", ["v2", "", "v1"], 4)
+    data = evaluate_retrieval.load_dataset(cache, "v1", "v1")
+    assert list(data["ids"]) == ["case-1", "case-2"]
+
+
+def test_mixed_spaces_need_a_space(tmp_path):
+    cache = snapshot(tmp_path / "cases.npz", ["v2", "v1"], 4)
+    with pytest.raises(SystemExit):
+        evaluate_retrieval.load_dataset(cache)
+
+
+def test_predictions_are_made_once_per_query(tmp_path):
+    cache = snapshot(tmp_path / "cases.npz", [""] * 6, 4)
+    data = evaluate_retrieval.load_dataset(cache)
+    calls = []
+
+    def predictor(row):
+        calls.append(row)
+        return [{"disease": "A", "probability": 1.0}]
+
+    evaluate_retrieval.evaluate(data, np.array([0, 1]), 2, [1, 2], predictor)
+    assert sorted(calls) == [0, 1]
@@ -0,0 +1,77 @@
+import importlib.util
+import io
+import os
+import re
+import sys
+
+import pytest
+
+BACKEND = os.path.join(os.path.dirname(__file__), '..', 'backend')
+sys.path.append(BACKEND)
+
+spec = importlib.util.spec_from_file_location("export_main", os.path.join(BACKEND, "export-service", "main.py"))
+export_main = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(export_main)
+
+
+def timeline(rows: int) -> dict:
+    return {
+        "title": "Long timeline",
+        "description": "Many symptoms",
+        "symptoms": [{"symptom_name": f"symptom {i}", "start_date": "2024-01-01", "severity": i % 10} for i in range(rows)],
+    }
+
+
+def test_long_report_spans_pages():
+    out = io.BytesIO()
+    export_main.render_timeline_pdf(timeline(500), out)
+    pdf = out.getvalue()
+    assert pdf.startswith(b"%PDF-")
+    assert len(re.findall(rb"/Type /Page\b", pdf)) > 5
+
+
+def test_tables_taller_than_a_page_are_split():
+    out = io.BytesIO()
+    canv = export_main.canvas.Canvas(out)
+    flow = export_main.PageFlow(canv)
+    table, = export_main.symptom_tables(timeline(500)["symptoms"], rows_per_table=500)
+    flow.add(table)
+    canv.save()
+    assert len(re.findall(rb"/Type /Page\b", out.getvalue())) > 5
+
+
+class FakeSupabase:
+    def table(self, name):
+        return self
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        return self
+
+    def single(self):
+        return self
+
+    def execute(self):
+        return type("Response", (), {"data": timeline(10)})()
+
+
+def test_failed_render_closes_the_buffer(monkeypatch):
+    buffers = []
+
+    class TrackedSpool(export_main.SpooledTemporaryFile):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            buffers.append(self)
+
+    def broken_render(timeline, out):
+        out.write(b"%PDF-partial")
+        raise ValueError("bad markup")
+
+    monkeypatch.setattr(export_main, "SpooledTemporaryFile", TrackedSpool)
+    monkeypatch.setattr(export_main, "render_timeline_pdf", broken_render)
+    monkeypatch.setattr(export_main, "get_supabase_client", FakeSupabase)
+    with pytest.raises(ValueError):
+        export_main.build_pdf_response(export_main.ExportRequest(timeline_id="t1", delivery="download"), "u1")
+    assert buffers and all(b.closed for b in buffers)
@@ -0,0 +1,88 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend', 'matching-service'))
+
+from feedback_store import FeedbackStore
+
+FINGERPRINT = "fp-1"
+
+
+class Result:
+    def __init__(self, data=None):
+        self.data = data
+
+    def execute(self):
+        return self
+
+
+class FakeSupabase:
+    """record_match_feedback with the schema's semantics: one vote per (user, timeline, match)."""
+
+    def __init__(self):
+        self.votes = {}
+        self.stored_aggregates = {}
+
+    def rpc(self, name, params):
+        if name == "record_match_feedback":
+            recorded = []
+            for vote in params["votes"]:
+                key = (vote["user_id"], vote["timeline_id"], vote["match_id"])
+                previous = self.votes.get(key)
+                self.votes[key] = vote["is_helpful"]
+                recorded.append({
+                    "timeline_id": vote["timeline_id"],
+                    "match_id": vote["match_id"],
+                    "is_helpful": vote["is_helpful"],
+                    "previous": previous,
+                })
+            return Result(recorded)
+        assert name == "add_feedback_aggregates"
+        for d in params["deltas"]:
+            counts = self.stored_aggregates.setdefault((d["reference_case_id"], d["symptom_fingerprint"]), [0, 0])
+            counts[0] += d["helpful"]
+            counts[1] += d["total"]
+        return Result()
+
+    def table(self, name):
+        assert name == "timelines"
+        return self
+
+    def select(self, columns):
+        return self
+
+    def in_(self, column, values):
+        return Result([{"id": tid, "embedding_fingerprint": FINGERPRINT} for tid in values])
+
+
+def vote(store, user_id, is_helpful, times=1):
+    for _ in range(times):
+        store.record(user_id, "t1", "case-1", is_helpful)
+    asyncio.run(store.flush())
+
+
+def test_repeated_votes_count_once():
+    supabase = FakeSupabase()
+    store = FeedbackStore(lambda: supabase)
+    vote(store, "u1", True, times=3)
+    vote(store, "u1", True)
+    assert store.aggregates[("case-1", FINGERPRINT)] == [1, 1]
+    boost = store.boost("case-1", FINGERPRINT)
+
+    vote(store, "u1", True, times=5)
+    assert store.boost("case-1", FINGERPRINT) == boost
+
+    asyncio.run(store.persist_aggregates())
+    assert supabase.stored_aggregates[("case-1", FINGERPRINT)] == [1, 1]
+
+
+def test_changed_vote_replaces_the_earlier_one():
+    supabase = FakeSupabase()
+    store = FeedbackStore(lambda: supabase)
+    vote(store, "u1", True)
+    vote(store, "u1", False, times=2)
+    assert store.aggregates[("case-1", FINGERPRINT)] == [0, 1]
+
+    vote(store, "u2", True)
+    assert store.aggregates[("case-1", FINGERPRINT)] == [1, 2]
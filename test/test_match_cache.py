@@ -0,0 +1,112 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend', 'matching-service'))
+
+import match_cache
+from match_cache import MatchCacheWriter
+
+
+class RowError(Exception):
+    code = "23503"  # foreign_key_violation
+
+
+class FakeMatches:
+    """Stands in for supabase.table("matches"): records upserted batches."""
+
+    def __init__(self, bad=(), down=False):
+        self.bad = set(bad)
+        self.down = down
+        self.batches = []
+        self.stored = {}
+
+    def table(self, name):
+        return self
+
+    def upsert(self, rows, on_conflict=None):
+        self.rows = rows
+        return self
+
+    def execute(self):
+        self.batches.append([row["timeline_id"] for row in self.rows])
+        if self.down:
+            raise ConnectionError("database unreachable")
+        if any(row["timeline_id"] in self.bad for row in self.rows):
+            raise RowError("insert or update on table \"matches\" violates foreign key constraint")
+        self.stored.update((row["timeline_id"], row["match_json"]) for row in self.rows)
+
+
+def writer_for(db):
+    return MatchCacheWriter(lambda: db)
+
+
+def test_coalesces_and_writes_one_batch():
+    db = FakeMatches()
+    writer = writer_for(db)
+    writer.put("t1", b"[1]")
+    writer.put("t2", b"[2]")
+    writer.put("t1", b"[3]")
+    asyncio.run(writer.flush())
+    assert db.batches == [["t2", "t1"]]
+    assert db.stored == {"t1": "[3]", "t2": "[2]"}
+    assert writer.stats["coalesced"] == 1 and writer.stats["written"] == 2
+
+
+def test_rejected_row_is_isolated_and_dropped():
+    db = FakeMatches(bad={"t3"})
+    writer = writer_for(db)
+    for i in range(8):
+        writer.put(f"t{i}", b"[]")
+    asyncio.run(writer.flush())
+    assert set(db.stored) == {f"t{i}" for i in range(8)} - {"t3"}
+    assert writer.stats["rejected"] == 1 and writer.stats["written"] == 7
+    assert not writer.pending
+    # The poison row does not come back and block later batches.
+    writer.put("t8", b"[]")
+    asyncio.run(writer.flush())
+    assert db.batches[-1] == ["t8"]
+
+
+def test_outage_requeues_until_max_attempts():
+    db = FakeMatches(down=True)
+    writer = writer_for(db)
+    writer.put("t1", b"[]")
+    for _ in range(match_cache.MATCH_CACHE_MAX_ATTEMPTS - 1):
+        asyncio.run(writer.flush())
+        assert "t1" in writer.pending
+    asyncio.run(writer.flush())
+    assert not writer.pending and writer.stats["dropped"] == 1
+    # Whole batches are retried as they are: no per-row bisection on outages.
+    assert all(batch == ["t1"] for batch in db.batches)
+
+
+def test_newer_row_wins_over_failed_retry():
+    db = FakeMatches(down=True)
+    writer = writer_for(db)
+    writer.put("t1", b"[old]")
+
+    async def run():
+        flushing = asyncio.create_task(writer.flush())
+        await asyncio.sleep(0)
+        writer.put("t1", b"[new]")
+        await flushing
+
+    asyncio.run(run())
+    assert writer.get("t1") == b"[new]"
+
+
+def test_rows_stay_visible_while_in_flight():
+    seen = []
+
+    class Slow(FakeMatches):
+        def execute(self):
+            seen.append(writer.get("t1"))
+            super().execute()
+
+    db = Slow()
+    writer = writer_for(db)
+    writer.put("t1", b"[1]")
+    asyncio.run(writer.flush())
+    assert seen == [b"[1]"]
+    assert writer.get("t1") is None and writer.inflight == {}
@@ -0,0 +1,59 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("httpx")
+from fastapi.testclient import TestClient
+
+BACKEND = os.path.join(os.path.dirname(__file__), '..', 'backend')
+sys.path.append(BACKEND)
+
+spec = importlib.util.spec_from_file_location("notification_main", os.path.join(BACKEND, "notification-service", "main.py"))
+notification_main = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(notification_main)
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.inserted = []
+
+    def table(self, name):
+        return self
+
+    def insert(self, rows):
+        self.inserted.append(rows)
+        return self
+
+    def execute(self):
+        return self
+
+
+@pytest.fixture
+def client(monkeypatch):
+    supabase = FakeSupabase()
+    monkeypatch.setattr(notification_main, "get_supabase_client", lambda: supabase)
+    notification_main.app.dependency_overrides[notification_main.get_current_user] = lambda: {"id": "admin"}
+    yield TestClient(notification_main.app), supabase
+    notification_main.app.dependency_overrides.clear()
+
+
+def send(client, user_ids):
+    return client.post("/notifications/send-bulk", json={"user_ids": user_ids, "title": "t", "body": "b"})
+
+
+def test_bulk_send_within_the_cap(client):
+    http, supabase = client
+    user_ids = [f"u{i}" for i in range(notification_main.BULK_MAX_RECIPIENTS)]
+    response = send(http, user_ids)
+    assert response.status_code == 200, response.text
+    assert response.json()["recipients"] == len(user_ids)
+    assert len(supabase.inserted) == 1
+
+
+def test_bulk_send_over_the_cap_is_rejected(client):
+    http, supabase = client
+    response = send(http, [f"u{i}" for i in range(notification_main.BULK_MAX_RECIPIENTS + 1)])
+    assert response.status_code == 422
+    assert supabase.inserted == []
@@ -0,0 +1,35 @@
+import os
+import sys
+import threading
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend', 'matching-service'))
+
+from reference_index import PartitionedReferenceIndex
+
+VECTOR = np.array([1, 0, 0, 0], dtype=np.float32)
+
+
+def test_search_while_partitions_are_added():
+    index = PartitionedReferenceIndex(4)
+    done = threading.Event()
+
+    def append():
+        for i in range(20000):
+            index.upsert(f"case-{i}", f"label-{i}", VECTOR, {"id": i}, model="m" if i % 2 else None)
+        done.set()
+
+    # Switch threads as often as possible so appends land mid-search.
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    writer = threading.Thread(target=append)
+    try:
+        writer.start()
+        while not done.is_set():
+            index.search(VECTOR, 5, 0.1, labels=["label-0"])
+            index.stats()
+    finally:
+        writer.join()
+        sys.setswitchinterval(interval)
+    assert len(index.search(VECTOR, 5, 0.1, labels=["label-1", "label-2"], models=["m"])) == 1
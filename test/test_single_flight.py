@@ -0,0 +1,68 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend', 'ai-service'))
+pytest.importorskip("google.generativeai")
+
+from gemini_client import SingleFlight
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def run():
+        flights = SingleFlight()
+        results = await asyncio.gather(*(flights.do("k", fetch) for _ in range(5)))
+        return flights, results
+
+    flights, results = asyncio.run(run())
+    assert results == ["answer"] * 5
+    assert len(calls) == 1
+    assert flights.coalesced == 4
+    assert flights.inflight == {}
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def run():
+        gate = asyncio.Event()
+        flights = SingleFlight()
+
+        async def fetch():
+            await gate.wait()
+            return "answer"
+
+        leader = asyncio.create_task(flights.do("k", fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("k", fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        gate.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == "answer"
+
+
+def test_failure_reaches_every_caller_and_clears_the_key():
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def run():
+        flights = SingleFlight()
+        results = await asyncio.gather(flights.do("k", fetch), flights.do("k", fetch), return_exceptions=True)
+        return flights, results
+
+    flights, results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert flights.inflight == {}
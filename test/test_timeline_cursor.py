@@ -0,0 +1,46 @@
+import base64
+import importlib.util
+import os
+import sys
+
+import pytest
+from fastapi import HTTPException
+
+BACKEND = os.path.join(os.path.dirname(__file__), '..', 'backend')
+sys.path.append(BACKEND)
+
+spec = importlib.util.spec_from_file_location("timeline_main", os.path.join(BACKEND, "timeline-service", "main.py"))
+timeline_main = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(timeline_main)
+
+ROW = {"id": "5b0c3f4e-9d7a-4d8e-8f3a-2a1b6c9d0e11", "created_at": "2024-03-01T12:30:45.123456+00:00"}
+
+
+def raw_cursor(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip("=")
+
+
+def test_cursor_round_trips():
+    cursor = timeline_main.encode_cursor(ROW)
+    assert "=" not in cursor
+    assert timeline_main.decode_cursor(cursor) == (ROW["created_at"], ROW["id"])
+
+
+def test_cursor_is_url_safe():
+    for created_at in ("2024-03-01T12:30:45.999999+00:00", "2024-03-01T12:30:45+05:30"):
+        cursor = timeline_main.encode_cursor({**ROW, "created_at": created_at})
+        assert set(cursor) <= set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_")
+        assert timeline_main.decode_cursor(cursor)[0] == created_at
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    raw_cursor("no separator"),
+    raw_cursor(f"yesterday|{ROW['id']}"),
+    raw_cursor(f"{ROW['created_at']}|1),user_id.neq.0"),
+    raw_cursor(f'{ROW["created_at"]}",id.gt.0|{ROW["id"]}'),
+])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as e:
+        timeline_main.decode_cursor(cursor)
+    assert e.value.status_code == 400
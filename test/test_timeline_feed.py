@@ -0,0 +1,52 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend', 'matching-service'))
+
+from timeline_feed import LocalChangeFeed, start_realtime_listener
+
+connection = pytest.importorskip("realtime.connection")
+
+EVENT = {"type": "UPDATE", "table": "timelines", "record": {"id": "t1"}, "old_record": {"id": "t1"}}
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.incoming = [json.dumps({"event": "UPDATE", "topic": "realtime:public:timelines", "payload": EVENT, "ref": None})]
+
+    async def send(self, data):
+        self.sent.append(json.loads(data))
+
+    async def recv(self):
+        if self.incoming:
+            return self.incoming.pop(0)
+        await asyncio.Event().wait()
+
+
+class StubSocket(connection.Socket):
+    """The real realtime Socket, minus the network."""
+
+    async def _connect(self):
+        self.ws_connection = FakeWebSocket()
+        self.connected = True
+
+
+def test_realtime_listener_republishes_on_the_app_loop(monkeypatch):
+    monkeypatch.setattr(connection, "Socket", StubSocket)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        feed = LocalChangeFeed()
+        received = asyncio.Queue()
+        feed.subscribe(lambda event: received.put_nowait((event, asyncio.get_running_loop())))
+        assert start_realtime_listener("http://localhost:54321", "key", feed, loop)
+        event, delivered_on = await asyncio.wait_for(received.get(), timeout=5)
+        assert event == EVENT
+        assert delivered_on is loop
+
+    asyncio.run(main())
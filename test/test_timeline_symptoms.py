@@ -0,0 +1,207 @@
+import importlib.util
+import os
+import sys
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+
+BACKEND = os.path.join(os.path.dirname(__file__), '..', 'backend')
+sys.path.append(BACKEND)
+
+spec = importlib.util.spec_from_file_location("timeline_main", os.path.join(BACKEND, "timeline-service", "main.py"))
+timeline_main = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(timeline_main)
+
+
+def test_entries_get_distinct_ids():
+    a = timeline_main.SymptomEntry(symptom_name="fever", severity=3, start_date="2024-01-01")
+    b = timeline_main.SymptomEntry(symptom_name="fever", severity=3, start_date="2024-01-01")
+    assert a.id and b.id and a.id != b.id
+
+
+def test_patch_sends_only_set_fields():
+    patch = timeline_main.SymptomPatch(severity=7, notes=None)
+    assert patch.dict(exclude_unset=True) == {"severity": 7, "notes": None}
+
+
+@pytest.mark.parametrize("field", ["symptom_name", "severity", "start_date"])
+def test_patch_rejects_null_required_fields(field):
+    with pytest.raises(ValidationError):
+        timeline_main.SymptomPatch(**{field: None})
+
+
+# --- Symptom operations against a fake Supabase -------------------------------
+
+USER = "user-1"
+TIMELINE = "timeline-1"
+
+
+class FakeRpc:
+    def __init__(self, db, name, params):
+        self.db, self.name, self.params = db, name, params
+
+    def execute(self):
+        return type("Response", (), {"data": self.db.run(self.name, self.params)})()
+
+
+class FakeSupabase:
+    """
+    Records every RPC call and runs the timeline_*_symptom functions the way
+    schema.sql does: the timeline row is locked (select ... for update), one
+    array element is patched in place and the JSONB path written is logged.
+    """
+
+    def __init__(self, symptoms):
+        self.symptoms = {TIMELINE: [dict(s) for s in symptoms]}
+        self.owner = {TIMELINE: USER}
+        self.row_lock = threading.Lock()
+        self.calls = []
+        self.writes = []  # (function, jsonb path) of each in-place edit
+
+    def rpc(self, name, params):
+        self.calls.append((name, params))
+        return FakeRpc(self, name, params)
+
+    def run(self, name, p):
+        with self.row_lock:
+            if self.owner.get(p["p_timeline_id"]) != p["p_user_id"]:
+                return None
+            symptoms = self.symptoms[p["p_timeline_id"]]
+            # Widen the window between reading and writing the row.
+            time.sleep(0.01)
+            if name == "timeline_add_symptom":
+                if any(s["id"] == p["p_entry"]["id"] for s in symptoms):
+                    return {"error": "symptom_exists"}
+                symptoms.append(p["p_entry"])
+                self.writes.append((name, [str(len(symptoms) - 1)]))
+                return {"op": "symptom_added", "symptom_id": p["p_entry"]["id"], "after": p["p_entry"]}
+            idx = next((i for i, s in enumerate(symptoms) if s["id"] == p["p_symptom_id"]), None)
+            if idx is None:
+                return {"error": "symptom_not_found"}
+            before = symptoms[idx]
+            if name == "timeline_update_symptom":
+                changed = {k: [before.get(k), v] for k, v in p["p_changes"].items() if before.get(k) != v}
+                if not changed:
+                    return {"op": "noop", "symptom_id": p["p_symptom_id"], "changes": {}}
+                symptoms[idx] = {**before, **p["p_changes"]}
+                self.writes.append((name, [str(idx)]))
+                return {"op": "symptom_updated", "symptom_id": p["p_symptom_id"], "changes": changed}
+            assert name == "timeline_remove_symptom"
+            del symptoms[idx]
+            self.writes.append((name, [str(idx)]))
+            return {"op": "symptom_removed", "symptom_id": p["p_symptom_id"], "before": before}
+
+
+SYMPTOMS = [
+    {"id": "s1", "symptom_name": "fever", "severity": 3, "start_date": "2024-01-01", "end_date": None, "notes": None},
+    {"id": "s2", "symptom_name": "rash", "severity": 5, "start_date": "2024-01-03", "end_date": None, "notes": None},
+]
+
+
+@pytest.fixture
+def api(monkeypatch):
+    fake = FakeSupabase(SYMPTOMS)
+    monkeypatch.setattr(timeline_main, "get_supabase_client", lambda: fake)
+    timeline_main.app.dependency_overrides[timeline_main.get_current_user] = lambda: {"id": USER}
+    yield TestClient(timeline_main.app), fake
+    timeline_main.app.dependency_overrides.clear()
+
+
+def test_add_calls_rpc_with_the_entry(api):
+    client, fake = api
+    entry = {"id": "s3", "symptom_name": "cough", "severity": 2, "start_date": "2024-01-05"}
+    response = client.post(f"/timelines/{TIMELINE}/symptoms", json=entry)
+    assert response.status_code == 200, response.text
+    assert fake.calls == [("timeline_add_symptom", {
+        "p_timeline_id": TIMELINE,
+        "p_user_id": USER,
+        "p_entry": {**entry, "end_date": None, "notes": None},
+    })]
+    assert fake.writes == [("timeline_add_symptom", ["2"])]
+    assert response.json()["op"] == "symptom_added"
+
+
+def test_add_with_a_taken_id_conflicts(api):
+    client, fake = api
+    response = client.post(f"/timelines/{TIMELINE}/symptoms", json={**SYMPTOMS[0], "symptom_name": "other"})
+    assert response.status_code == 409
+    assert fake.symptoms[TIMELINE] == SYMPTOMS
+
+
+def test_update_sends_only_the_changed_fields(api):
+    client, fake = api
+    response = client.patch(f"/timelines/{TIMELINE}/symptoms/s2", json={"severity": 8, "notes": None})
+    assert response.status_code == 200, response.text
+    assert fake.calls == [("timeline_update_symptom", {
+        "p_timeline_id": TIMELINE,
+        "p_user_id": USER,
+        "p_symptom_id": "s2",
+        "p_changes": {"severity": 8, "notes": None},
+    })]
+    # Patched in place at the entry's array index; the other entry is untouched.
+    assert fake.writes == [("timeline_update_symptom", ["1"])]
+    assert response.json()["changes"] == {"severity": [5, 8]}
+    assert fake.symptoms[TIMELINE] == [SYMPTOMS[0], {**SYMPTOMS[1], "severity": 8}]
+
+
+def test_remove_calls_rpc_with_the_symptom_id(api):
+    client, fake = api
+    response = client.delete(f"/timelines/{TIMELINE}/symptoms/s1")
+    assert response.status_code == 200, response.text
+    assert fake.calls == [("timeline_remove_symptom", {
+        "p_timeline_id": TIMELINE,
+        "p_user_id": USER,
+        "p_symptom_id": "s1",
+    })]
+    assert fake.writes == [("timeline_remove_symptom", ["0"])]
+    assert fake.symptoms[TIMELINE] == [SYMPTOMS[1]]
+
+
+@pytest.mark.parametrize("method, path, body", [
+    ("patch", "/symptoms/missing", {"severity": 1}),
+    ("delete", "/symptoms/missing", None),
+])
+def test_unknown_symptom_is_not_found(api, method, path, body):
+    client, _ = api
+    kwargs = {"json": body} if body is not None else {}
+    assert getattr(client, method)(f"/timelines/{TIMELINE}{path}", **kwargs).status_code == 404
+
+
+def test_other_users_timeline_is_not_found(api):
+    client, fake = api
+    fake.owner[TIMELINE] = "someone-else"
+    assert client.delete(f"/timelines/{TIMELINE}/symptoms/s1").status_code == 404
+    assert fake.symptoms[TIMELINE] == SYMPTOMS
+
+
+def test_concurrent_patches_keep_both_writes(api):
+    client, fake = api
+    patches = [
+        ("s1", {"severity": 9}),
+        ("s1", {"notes": "worse at night"}),
+        ("s2", {"end_date": "2024-02-01"}),
+    ]
+    barrier = threading.Barrier(len(patches))
+    responses = []
+
+    def send(symptom_id, changes):
+        barrier.wait()
+        responses.append(client.patch(f"/timelines/{TIMELINE}/symptoms/{symptom_id}", json=changes))
+
+    threads = [threading.Thread(target=send, args=p) for p in patches]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert [r.status_code for r in responses] == [200] * len(patches)
+    # Each request carried only its own fields, so none overwrote another.
+    sent = [(params["p_symptom_id"], params["p_changes"]) for _, params in fake.calls]
+    assert sorted(sent, key=repr) == sorted(patches, key=repr)
+    assert fake.symptoms[TIMELINE] == [
+        {**SYMPTOMS[0], "severity": 9, "notes": "worse at night"},
+        {**SYMPTOMS[1], "end_date": "2024-02-01"},
+    ]
@@ -0,0 +1,79 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'infrastructure', 'scripts'))
+
+from upload_ml_data import ResumeConflict, collapse_prototypes, records_to_resume
+
+
+def case(patient_id, diagnosis, symptom_ids, embedding):
+    return {
+        "patient_id": patient_id,
+        "diagnosis_label": diagnosis,
+        "symptom_ids": symptom_ids,
+        "embedding": np.array(embedding, dtype=np.float32),
+    }
+
+
+CASES = [
+    case("pat_0", "A", [1, 2, 3], [1.0, 0.0]),
+    case("pat_1", "A", [3, 2, 1], [0.0, 1.0]),
+    case("pat_2", "B", [1, 2, 3], [1.0, 1.0]),
+    case("pat_3", "A", [1, 2, 4], [2.0, 2.0]),
+]
+
+
+def test_exact_duplicates_collapse_per_diagnosis():
+    records = collapse_prototypes(CASES, threshold=1.0)
+    by_patient = {r["patient_id"]: r for r in records}
+    assert len(records) == 3
+    merged = by_patient["pat_0"]
+    assert merged["multiplicity"] == 2
+    assert merged["member_patient_ids"] == ["pat_0", "pat_1"]
+    assert merged["embedding"] == [0.5, 0.5]
+    assert merged["symptom_ids"] == [1, 2, 3]
+    # Same symptoms but a different diagnosis stay apart.
+    assert by_patient["pat_2"]["multiplicity"] == 1
+
+
+def test_near_duplicates_join_the_larger_group():
+    records = collapse_prototypes(CASES, threshold=0.5)
+    by_patient = {r["patient_id"]: r for r in records}
+    assert by_patient["pat_0"]["member_patient_ids"] == ["pat_0", "pat_1", "pat_3"]
+    assert sum(r["multiplicity"] for r in records) == len(CASES)
+
+
+def test_collapse_is_deterministic():
+    # Resume matches on representatives and member lists, so both (and the
+    # record order) must follow from the input order alone: larger groups
+    # first, ties and members in input order.
+    records = collapse_prototypes(CASES)
+    assert [(r["patient_id"], r["diagnosis_label"], r["member_patient_ids"], r["symptom_ids"]) for r in records] == [
+        ("pat_0", "A", ["pat_0", "pat_1"], [1, 2, 3]),
+        ("pat_3", "A", ["pat_3"], [1, 2, 4]),
+        ("pat_2", "B", ["pat_2"], [1, 2, 3]),
+    ]
+    assert [r["embedding"] for r in records] == [[0.5, 0.5], [2.0, 2.0], [1.0, 1.0]]
+    assert [r["multiplicity"] for r in records] == [2, 1, 1]
+
+
+def test_resume_skips_uploaded_prototypes_only():
+    records = collapse_prototypes(CASES)
+    existing = [{"patient_id": "pat_0", "member_patient_ids": ["pat_0", "pat_1"]}]
+    pending = records_to_resume(records, existing)
+    assert sorted(r["patient_id"] for r in pending) == ["pat_2", "pat_3"]
+
+
+def test_resume_refuses_per_patient_rows():
+    existing = [{"patient_id": "pat_0", "member_patient_ids": None}]
+    with pytest.raises(ResumeConflict):
+        records_to_resume(collapse_prototypes(CASES), existing)
+
+
+def test_resume_refuses_differently_grouped_rows():
+    existing = [{"patient_id": "pat_1", "member_patient_ids": ["pat_1"]}]
+    with pytest.raises(ResumeConflict):
+        records_to_resume(collapse_prototypes(CASES), existing)
@@ -0,0 +1,52 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend', 'matching-service'))
+
+from vector_index import VectorIndex, hnswlib, normalize
+
+INDEXES = [VectorIndex]
+if hnswlib is not None:
+    from vector_index import HnswVectorIndex
+    INDEXES.append(HnswVectorIndex)
+
+QUERY = np.ones(8)
+
+
+def timelines():
+    """200 timelines; the 50 closest to QUERY belong to the caller."""
+    rng = np.random.default_rng(0)
+    return [
+        (f"t{i}", QUERY + rng.normal(scale=0.01 if i < 50 else 1.0, size=8), {"user_id": "me" if i < 50 else f"user-{i % 7}"})
+        for i in range(200)
+    ]
+
+
+def not_mine(payload):
+    return payload["user_id"] != "me"
+
+
+@pytest.mark.parametrize("index_type", INDEXES)
+def test_where_skips_payloads_beyond_the_first_window(index_type):
+    rows = timelines()
+    index = index_type(8, capacity=16)
+    for key, vector, payload in rows:
+        index.upsert(key, vector, payload)
+
+    hits = index.search(QUERY, 10, where=not_mine)
+
+    others = sorted((r for r in rows if not_mine(r[2])), key=lambda r: -float(normalize(r[1]) @ normalize(QUERY)))
+    assert [key for key, _, _ in hits] == [key for key, _, _ in others[:10]]
+    assert all(not_mine(payload) for _, _, payload in hits)
+
+
+@pytest.mark.parametrize("index_type", INDEXES)
+def test_where_returns_fewer_hits_when_too_few_pass(index_type):
+    index = index_type(8, capacity=16)
+    for key, vector, payload in timelines()[:60]:
+        index.upsert(key, vector, payload)
+    assert len(index.search(QUERY, 20, where=not_mine)) == 10
+    assert index.search(QUERY, 5, where=lambda payload: False) == []